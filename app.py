@@ -1,10 +1,21 @@
-from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse, HTMLResponse
+from fastapi import FastAPI, Request, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-import uvicorn
+from pydantic import BaseModel, Field
+from typing import Annotated, List, Literal
+import numpy as np
+import argparse
 import os
-from pipeline.predict import predict
-from pipeline.models.logistic_regression import LogisticRegressionTrainer
+from pipeline import PARAMS
+from pipeline.predict import (predict_match, predict_matches, predict_batch, load_player_state,
+                              load_transformations, model_holder, player_state_holder)
+from pipeline.batching import RequestBatcher
+from pipeline.prediction_cache import PredictionCache
+from pipeline.metrics import Histogram, MetricsMiddleware, PipelineRunMetrics, RequestMetrics, format_family
+from pipeline.serving import serve
+from pipeline.jobs import TrainingJobs
+from main import STAGE_NAME_01, STAGE_NAME_02
 from fastapi.templating import Jinja2Templates
 
 os.putenv('LANG', 'en_US.UTF-8')
@@ -22,9 +33,72 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Latency, status and in-flight count of the requests, exposed at /metrics
+request_metrics = RequestMetrics()
+app.add_middleware(MetricsMiddleware, metrics=request_metrics)
+pipeline_run_metrics = PipelineRunMetrics(PARAMS.profiling.report_dir)
+
 # Set up Jinja2 templates
 templates = Jinja2Templates(directory="templates")
 
+# Training runs in background processes, tracked in a store shared by the workers
+training_jobs = TrainingJobs([STAGE_NAME_01, STAGE_NAME_02], PARAMS.serving.training_jobs_path)
+
+# Concurrent match predictions are scored together
+batching = PARAMS.serving.batching
+match_batcher = RequestBatcher(predict_matches, batching.max_batch_size, batching.max_wait_ms / 1000)
+
+# Repeated match predictions are served from memory until the odds or the model change
+caching = PARAMS.serving.prediction_cache
+prediction_cache = PredictionCache(caching.max_size, caching.ttl_seconds)
+
+
+Surface = Literal['Hard', 'Clay', 'Grass', 'Carpet', 'Greenset']
+
+
+class MatchRequest(BaseModel):
+    """Upcoming match to predict."""
+    player_1: str
+    player_2: str
+    surface: Surface
+    odd_1: float = Field(gt=1)
+    odd_2: float = Field(gt=1)
+
+
+class BatchRequest(BaseModel):
+    """Upcoming matches to predict, one list per column."""
+    player_1: List[str]
+    player_2: List[str]
+    surface: List[Surface]
+    odd_1: List[Annotated[float, Field(gt=1)]]
+    odd_2: List[Annotated[float, Field(gt=1)]]
+
+
+def preload():
+    """Load the model, the players' state and the fitted transformations."""
+    model_holder.get()
+    load_player_state()
+    load_transformations(model_holder.get())
+
+
+@app.on_event("startup")
+async def load_state():
+    """Load the model, the players' state and the fitted transformations before serving requests.
+
+    Workers forked by serve() start with them already loaded. New versions of the model and the players' state are
+    then loaded by background threads, off the event loop.
+    """
+    preload()
+    model_holder.watch()
+    player_state_holder.watch()
+    if batching.enabled:
+        match_batcher.start()
+
+
+@app.on_event("shutdown")
+async def stop_batcher():
+    await match_batcher.stop()
+
 
 @app.get("/", response_class=HTMLResponse)
 async def home(request: Request):
@@ -32,18 +106,126 @@ async def home(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
 
-@app.post("/train")
-async def trainRoute():
-    """Route for training the model."""
-    os.system("python main.py")  # This runs the model training process
-    return JSONResponse({"message": "Training done successfully!"})
+@app.post("/train", status_code=202)
+async def trainRoute(stage_name: str = None, force: bool = False):
+    """Route for starting a training job. The new model is served as soon as it is saved."""
+    try:
+        job = training_jobs.start(stage_name, force)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return job.to_dict()
+
+
+@app.get("/train")
+async def trainJobsRoute():
+    """Route for listing the training jobs."""
+    return [job.to_dict() for job in training_jobs.jobs.values()]
 
 
-@app.post("/predict")
-async def predictRoute(input: list):
-    """Route for making predictions."""
-    return predict(input)
+@app.get("/train/{job_id}")
+async def trainJobRoute(job_id: str):
+    """Route for the status, progress and stage timings of a training job."""
+    job = training_jobs.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown training job: {job_id}")
+    return job.to_dict()
+
+
+@app.delete("/train/{job_id}")
+async def cancelTrainJobRoute(job_id: str):
+    """Route for cancelling a training job."""
+    try:
+        return training_jobs.cancel(job_id).to_dict()
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown training job: {job_id}")
+
+
+@app.post("/predict/match")
+async def predictMatchRoute(match: MatchRequest):
+    """Route for predicting a match from the players' names."""
+    key = (match.player_1, match.player_2, match.surface, match.odd_1, match.odd_2)
+    if caching.enabled:
+        # Versions being served, kept up to date by the holders' threads: a new version of the model or the players'
+        # state invalidates the cache even if every request hits it
+        version = (model_holder.version, player_state_holder.version)
+        prediction = prediction_cache.get(key, version)
+        if prediction is not None:
+            return prediction
+
+    try:
+        if batching.enabled:
+            prediction = await match_batcher.submit(*key)
+        else:
+            prediction = predict_match(*key)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+
+    if caching.enabled:
+        prediction_cache.put(key, prediction, version)
+    return prediction
+
+
+@app.get("/predict/cache")
+async def predictionCacheRoute():
+    """Route for the size and hit and miss counters of the prediction cache."""
+    return prediction_cache.stats()
+
+
+def serving_metrics() -> list:
+    """Lines of the model, prediction cache and batching metrics."""
+    batch_sizes = Histogram(tuple(2 ** i for i in range(batching.max_batch_size.bit_length())))
+    for size, count in list(match_batcher.batch_sizes.items()):
+        batch_sizes.observe(size, count)
+
+    return (format_family('model_info', 'gauge', 'Version (content hash) of the served model.',
+                          [('', {'version': model_holder.version}, 1)])
+            + format_family('model_load_seconds', 'gauge', 'Time taken by the last model load.',
+                            [('', {}, model_holder.load_seconds)])
+            + format_family('prediction_cache_hits_total', 'counter', 'Predictions served from the cache.',
+                            [('', {}, prediction_cache.hits)])
+            + format_family('prediction_cache_misses_total', 'counter', 'Predictions missing from the cache.',
+                            [('', {}, prediction_cache.misses)])
+            + format_family('prediction_cache_hit_ratio', 'gauge', 'Share of the cache lookups that were hits.',
+                            [('', {}, prediction_cache.hit_ratio)])
+            + format_family('prediction_cache_entries', 'gauge', 'Predictions held in the cache.',
+                            [('', {}, len(prediction_cache))])
+            + format_family('prediction_batch_size', 'histogram', 'Number of match requests scored together.',
+                            batch_sizes.samples()))
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metricsRoute():
+    """Route for the serving and last pipeline run metrics, in the Prometheus text exposition format.
+
+    Each worker process reports its own serving metrics.
+    """
+    lines = request_metrics.collect() + serving_metrics() + pipeline_run_metrics.collect()
+    return '\n'.join(lines) + '\n'
+
+
+@app.post("/predict/batch")
+async def predictBatchRoute(matches: BatchRequest):
+    """Route for predicting a batch of matches from the players' names.
+
+    Probabilities are null for the matches where one of the players is unknown.
+    """
+    columns = [matches.player_1, matches.player_2, matches.surface, matches.odd_1, matches.odd_2]
+    if len({len(column) for column in columns}) > 1:
+        raise HTTPException(status_code=422, detail="All the columns must have the same length")
+
+    # Scored in a thread, so that a large batch doesn't block the event loop and the micro-batcher
+    probabilities = await run_in_threadpool(predict_batch, *columns)
+    return {col: [None if np.isnan(p) else p for p in values.tolist()] for col, values in probabilities.items()}
 
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8080)
+    parser = argparse.ArgumentParser(description="Serve the tennis predictor API")
+    parser.add_argument('--host', default="0.0.0.0", help='Address to bind.')
+    parser.add_argument('--port', type=int, default=8080, help='Port to bind.')
+    parser.add_argument('--workers', type=int, default=PARAMS.serving.workers,
+                        help='Worker processes, forked after loading the model and the players\' state.')
+    args = parser.parse_args()
+
+    serve(app, args.host, args.port, args.workers, preload)
@@ -0,0 +1,207 @@
+# Usage: python -m benchmarks.run_benchmarks --sizes 10000 100000 1000000 10000000
+import argparse
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime
+import numpy as np
+from pipeline import PARAMS
+from pipeline import predict
+from pipeline.clean_data import DataCleaner
+from pipeline.features.build_features import FeaturesBuilder
+from pipeline.models.logistic_regression import LogisticRegressionTrainer
+from pipeline.profiling import profiler
+from libs.data_utils import split_data
+from benchmarks.synthetic_data import write_raw_data
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000, 10_000_000]
+
+# Features selected for the model (see notebooks/3.0-model-selection.ipynb)
+MODEL_FEATURES = ['inverted_log_rank_p1', 'rank_diff_binned', 'log_odd_ratio', 'surface_Clay', 'surface_Hard',
+                  'surface_Grass', 'h2h_binned', 'consecutive_wins_p1', 'consecutive_wins_p2', 'consecutive_losses_p1',
+                  'consecutive_losses_p2', 'consecutive_results', 'rank_evol_p1_binned', 'rank_evol_p2_binned',
+                  'rank_combined_binned', 'odd_p1', 'odd_p2']
+
+# A step is reported as superlinear above this scaling exponent, if it lasts long enough to be measured reliably
+SUPERLINEAR_EXPONENT = 1.15
+MIN_MEASURABLE_SECONDS = 0.05
+
+
+def use_work_dir(work_dir: str):
+    """Point the pipeline paths to work_dir, so that the benchmark never touches data/ and models/."""
+    PARAMS.data_path.raw.root_dir = os.path.join(work_dir, 'raw/')
+    PARAMS.data_path.interim.root_dir = os.path.join(work_dir, 'interim/')
+    PARAMS.data_path.processed.root_dir = os.path.join(work_dir, 'processed/')
+    PARAMS.logistic_regression.model_path = os.path.join(work_dir, 'model.joblib')
+    PARAMS.logistic_regression.transformations_path = os.path.join(work_dir, 'transformations.json')
+    PARAMS.logistic_regression.scorer_path = os.path.join(work_dir, 'model.json')
+    PARAMS.serving.shared_state_dir = os.path.join(work_dir, 'shared_state/')
+    PARAMS.cache.enabled = False
+    PARAMS.profiling.enabled = True
+    for path in [PARAMS.data_path.interim.root_dir, PARAMS.data_path.processed.root_dir]:
+        os.makedirs(path, exist_ok=True)
+
+    # The serving helpers cache what they load: start from the artifacts of this run
+    predict.load_transformations.cache_clear()
+    predict.model_holder = predict.ModelHolder(PARAMS.logistic_regression.model_path, check_interval=float('inf'))
+    predict.player_state_holder = predict.ModelHolder(
+        PARAMS.data_path.processed.root_dir + PARAMS.data_path.processed.player_state, check_interval=float('inf'),
+        loader=predict.read_player_state)
+
+
+def save_training_data(features):
+    """Split the features into the training, validation and testing sets read by LogisticRegressionTrainer."""
+    processed = PARAMS.data_path.processed
+    X_train, X_val, X_test, y_train, y_val, y_test = split_data(features[MODEL_FEATURES], features[['winner_is_p1']],
+                                                                train_size=0.7, test_size=0.15)
+    for data, file_name in [(X_train, processed.X_train), (X_val, processed.X_val), (X_test, processed.X_test),
+                            (y_train, processed.y_train), (y_val, processed.y_val), (y_test, processed.y_test)]:
+        data.to_csv(processed.root_dir + file_name)
+
+
+def time_predictions(cleaned_data, n_single: int, n_batch: int, seed: int = 0) -> dict:
+    """Time predict_match on n_single fixtures and predict_batch on n_batch fixtures between known players."""
+    rng = np.random.default_rng(seed)
+    players = cleaned_data['winner'].to_numpy()
+    player_1 = rng.choice(players, size=max(n_single, n_batch))
+    player_2 = rng.choice(players, size=len(player_1))
+    surface = rng.choice(['Hard', 'Clay', 'Grass'], size=len(player_1))
+    odd_1 = np.round(rng.uniform(1.05, 5, size=len(player_1)), 2)
+    odd_2 = np.round(rng.uniform(1.05, 5, size=len(player_1)), 2)
+
+    # Warm up: load the model, the players' state and the transformations
+    predict.predict_batch(player_1[:1], player_2[:1], surface[:1], odd_1[:1], odd_2[:1])
+
+    results = {}
+    begin_time = time.perf_counter()
+    for i in range(n_single):
+        predict.predict_match(player_1[i], player_2[i], surface[i], odd_1[i], odd_2[i])
+    seconds = time.perf_counter() - begin_time
+    results['predict_match'] = {'wall_seconds': seconds, 'rows_in': n_single, 'per_row_us': seconds / n_single * 1e6}
+
+    begin_time = time.perf_counter()
+    predict.predict_batch(player_1[:n_batch], player_2[:n_batch], surface[:n_batch], odd_1[:n_batch], odd_2[:n_batch])
+    seconds = time.perf_counter() - begin_time
+    results['predict_batch'] = {'wall_seconds': seconds, 'rows_in': n_batch, 'per_row_us': seconds / n_batch * 1e6}
+    return results
+
+
+def run_size(n_matches: int, work_dir: str, seed: int = 0, n_single: int = 1000, n_batch: int = 100_000) -> dict:
+    """Run the pipeline on n_matches synthetic matches and time each step.
+
+    Returns:
+        dict: 'steps' as {step: {'wall_seconds', 'cpu_seconds', 'peak_rss_mb', 'rows_in', 'rows_out'}} and 'errors'
+            as {part of the benchmark: error message}.
+    """
+    use_work_dir(work_dir)
+    steps, errors = {}, {}
+
+    begin_time = time.perf_counter()
+    write_raw_data(PARAMS.data_path.raw.root_dir, n_matches, seed)
+    steps['generate_raw_data'] = {'wall_seconds': time.perf_counter() - begin_time, 'rows_out': n_matches}
+
+    profiler.reset()
+    cleaned_data = trained_model = None
+    try:
+        cleaned_data = DataCleaner.main()
+        features = FeaturesBuilder.main(cleaned_data.copy())
+        save_training_data(features)
+
+        trainer = LogisticRegressionTrainer()
+        trained_model = trainer.train_model(trainer.create_model())
+        trainer.save_model(trained_model)
+    except Exception as e:
+        logging.error(f"Benchmark of {n_matches} matches failed: {e}", exc_info=True)
+        errors['pipeline'] = str(e)
+
+    # Steps called more than once (e.g. nested) are summed
+    for record in profiler.records:
+        step = steps.setdefault(record['step'], {'wall_seconds': 0, 'cpu_seconds': 0, 'peak_rss_mb': 0,
+                                                 'rows_in': record['rows_in'], 'rows_out': record['rows_out']})
+        step['wall_seconds'] += record['wall_seconds']
+        step['cpu_seconds'] += record['cpu_seconds']
+        step['peak_rss_mb'] = max(step['peak_rss_mb'], record['peak_rss_mb'] or 0)
+
+    if trained_model is not None:
+        # Serve what was just saved: the NumPy scorer unless disabled
+        predict.model_holder = predict.serving_model_holder(check_interval=float('inf'))
+        try:
+            steps.update(time_predictions(cleaned_data, n_single, min(n_batch, n_matches), seed))
+        except Exception as e:
+            logging.error(f"Prediction benchmark of {n_matches} matches failed: {e}", exc_info=True)
+            errors['prediction'] = str(e)
+
+    return {'steps': steps, 'errors': errors}
+
+
+def scaling_curves(results: dict) -> dict:
+    """Compute the scaling exponent of each step between consecutive sizes.
+
+    An exponent of 1 means linear time, 2 quadratic. Steps whose exponent exceeds SUPERLINEAR_EXPONENT are flagged.
+
+    Returns:
+        dict: {step: [{'from', 'to', 'exponent', 'superlinear'}]}.
+    """
+    sizes = sorted(results)
+    curves = {}
+    for small, large in zip(sizes, sizes[1:]):
+        for step, timing in results[large]['steps'].items():
+            previous = results[small]['steps'].get(step)
+            if previous is None or previous['wall_seconds'] <= 0 or timing['wall_seconds'] <= 0:
+                continue
+            exponent = np.log(timing['wall_seconds'] / previous['wall_seconds']) / np.log(large / small)
+            curves.setdefault(step, []).append({
+                'from': small,
+                'to': large,
+                'exponent': float(exponent),
+                'superlinear': bool(exponent > SUPERLINEAR_EXPONENT and timing['wall_seconds'] > MIN_MEASURABLE_SECONDS),
+            })
+    return curves
+
+
+def print_report(results: dict, curves: dict):
+    sizes = sorted(results)
+    steps = list(dict.fromkeys(step for size in sizes for step in results[size]['steps']))
+    print(f"{'step':45}" + ''.join(f"{size:>14,}" for size in sizes) + "   exponents")
+    for step in steps:
+        timings = [results[size]['steps'].get(step, {}).get('wall_seconds') for size in sizes]
+        exponents = ' '.join(f"{curve['exponent']:.2f}{'!' if curve['superlinear'] else ''}" for curve in curves.get(step, []))
+        print(f"{step[:45]:45}" + ''.join(f"{t:>13.3f}s" if t is not None else f"{'-':>14}" for t in timings) + f"   {exponents}")
+    print("(seconds of wall time; '!' marks steps growing faster than linearly)")
+
+
+def main(sizes: list, seed: int = 0, output: str = None, keep_data: bool = False):
+    """Run the benchmark for every size and save a JSON report with the timings and the scaling curves."""
+    results = {}
+    for n_matches in sorted(sizes):
+        work_dir = tempfile.mkdtemp(prefix=f'tennis-benchmark-{n_matches}-')
+        logging.info(f"Benchmarking {n_matches} matches in {work_dir}...")
+        try:
+            results[n_matches] = run_size(n_matches, work_dir, seed)
+        finally:
+            if not keep_data:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+    curves = scaling_curves(results)
+    print_report(results, curves)
+
+    output = output or os.path.join('logs', f"benchmark-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+    with open(output, 'w') as file:
+        json.dump({'created_at': datetime.now().isoformat(), 'seed': seed, 'results': results, 'scaling': curves},
+                  file, indent=4)
+    logging.info(f"Benchmark report saved to {output}")
+    return results, curves
+
+
+if __name__ == "__main__": # Won't be executed when module is imported
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline on synthetic data")
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='Numbers of matches to benchmark.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic data.')
+    parser.add_argument('--output', help='JSON report path. Defaults to logs/benchmark-<timestamp>.json.')
+    parser.add_argument('--keep_data', action='store_true', help='Keep the synthetic data and artifacts of each size.')
+    args = parser.parse_args()
+
+    main(args.sizes, args.seed, args.output, args.keep_data)
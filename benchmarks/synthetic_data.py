@@ -0,0 +1,128 @@
+# Usage: python -m benchmarks.synthetic_data --n_matches 100000 --root_dir data/synthetic/raw/
+import argparse
+import logging
+import os
+import numpy as np
+import pandas as pd
+
+# Observed on the ATP and WTA data: ~1,600 players for ~40k matches, ~2,500 matches per tour and year
+PLAYERS_PER_MATCH = 0.04
+MATCHES_PER_YEAR = 2500
+MAX_YEARS = 30
+SURFACES = {'Hard': 0.545, 'Clay': 0.314, 'Grass': 0.11, 'Carpet': 0.03, 'Greenset': 0.001}
+
+# Raw layout of each tour: column names and date format of the source files
+RAW_LAYOUTS = {
+    'atp': {'columns': {'date': 'Date', 'winner': 'Winner', 'loser': 'Loser', 'wrank': 'WRank', 'lrank': 'LRank',
+                        'b365w': 'B365W', 'b365l': 'B365L', 'surface': 'Surface', 'comment': 'Comment'},
+            'date_format': '%d/%m/%Y',
+            'share': 0.55},
+    'wta': {'columns': {'date': 'date', 'winner': 'winner', 'loser': 'loser', 'wrank': 'wrank', 'lrank': 'lrank',
+                        'b365w': 'b365w', 'b365l': 'b365l', 'surface': 'surface', 'comment': 'comment'},
+            'date_format': '%Y-%m-%d',
+            'share': 0.45},
+}
+
+
+def generate_matches(n_matches: int, seed: int = 0, tour: str = 'atp') -> pd.DataFrame:
+    """Generate a deterministic set of matches following the data_schemas.raw layout.
+
+    Players have a latent level that sets their initial ranking and drifts from one year to the next. Top players
+    play more often (Zipf-like activity), the better ranked player wins more often and the odds are derived from
+    the winning probability with a bookmaker margin, so that rankings, odds and results stay consistent.
+
+    Args:
+        n_matches (int): Number of matches.
+        seed (int): Seed of the random generator. The same seed always gives the same matches.
+        tour (str): 'atp' or 'wta', used for the player names.
+
+    Returns:
+        pd.DataFrame: Matches with the date, winner, loser, wrank, lrank, b365w, b365l, surface and comment columns.
+    """
+    rng = np.random.default_rng(seed)
+    n_players = max(200, int(n_matches * PLAYERS_PER_MATCH))
+    n_years = int(np.clip(np.ceil(n_matches / MATCHES_PER_YEAR), 1, MAX_YEARS))
+
+    # Latent level of each player, drifting over the years, and the resulting ranking of every year
+    level = np.cumsum(rng.normal(0, 0.3, size=(n_years, n_players)), axis=0) - np.log(np.arange(1, n_players + 1))
+    ranks = np.empty((n_years, n_players), dtype=np.int64)
+    ranks[np.arange(n_years)[:, None], np.argsort(-level, axis=1)] = np.arange(1, n_players + 1)
+
+    # Chronological match dates, spread over the years
+    start = np.datetime64('2000-01-01')
+    days = np.sort(rng.integers(0, n_years * 365, size=n_matches))
+    years = np.minimum(days // 365, n_years - 1)
+
+    # Players are drawn according to their initial ranking: top players play more matches
+    activity = 1 / np.arange(1, n_players + 1) ** 0.9
+    activity /= activity.sum()
+    player_a = rng.choice(n_players, size=n_matches, p=activity)
+    player_b = rng.choice(n_players, size=n_matches, p=activity)
+    player_b = np.where(player_a == player_b, (player_b + 1) % n_players, player_b)
+
+    rank_a = ranks[years, player_a]
+    rank_b = ranks[years, player_b]
+
+    # The better ranked player is more likely to win; odds carry a ~5% margin and some noise
+    probability_a = 1 / (1 + np.exp(-0.8 * (np.log(rank_b) - np.log(rank_a))))
+    a_wins = rng.random(n_matches) < probability_a
+    noise = rng.normal(0, 0.05, size=n_matches)
+    odd_a = np.clip(np.round(1 / (1.05 * np.clip(probability_a + noise, 0.02, 0.98)), 3), 1.01, 30)
+    odd_b = np.clip(np.round(1 / (1.05 * np.clip(1 - probability_a - noise, 0.02, 0.98)), 3), 1.01, 30)
+
+    names = np.array([f"Player{tour.upper()}{i:07d} {chr(65 + i % 26)}." for i in range(n_players)], dtype=object)
+    df = pd.DataFrame({
+        'date': start + days.astype('timedelta64[D]'),
+        'winner': names[np.where(a_wins, player_a, player_b)],
+        'loser': names[np.where(a_wins, player_b, player_a)],
+        'wrank': np.where(a_wins, rank_a, rank_b),
+        'lrank': np.where(a_wins, rank_b, rank_a),
+        'b365w': np.where(a_wins, odd_a, odd_b),
+        'b365l': np.where(a_wins, odd_b, odd_a),
+        'surface': rng.choice(list(SURFACES), size=n_matches, p=np.array(list(SURFACES.values())) / sum(SURFACES.values())),
+        'comment': np.where(rng.random(n_matches) < 0.97, 'Completed', 'Retired'),
+    })
+
+    # Some matches have no odds, as in the source files
+    missing_odds = rng.random(n_matches) < 0.02
+    df.loc[missing_odds, ['b365w', 'b365l']] = np.nan
+
+    return df
+
+
+def write_raw_data(root_dir: str, n_matches: int, seed: int = 0) -> dict:
+    """Generate ATP and WTA matches and save them as yearly raw CSV files, as in data/raw/.
+
+    Args:
+        root_dir (str): Directory receiving the atp/ and wta/ folders.
+        n_matches (int): Total number of matches, shared between the tours.
+        seed (int): Seed of the random generator.
+
+    Returns:
+        dict: Number of matches written for each tour.
+    """
+    written = {}
+    for i, (tour, layout) in enumerate(RAW_LAYOUTS.items()):
+        n_tour = int(round(n_matches * layout['share'])) if i == 0 else n_matches - sum(written.values())
+        df = generate_matches(n_tour, seed=seed + i, tour=tour)
+        years = df['date'].dt.year
+        df['date'] = df['date'].dt.strftime(layout['date_format'])
+        df = df.rename(columns=layout['columns'])
+
+        tour_dir = os.path.join(root_dir, tour)
+        os.makedirs(tour_dir, exist_ok=True)
+        for year, year_df in df.groupby(years):
+            year_df.to_csv(os.path.join(tour_dir, f'{year}.csv'), index=False)
+        written[tour] = n_tour
+        logging.info(f"Wrote {n_tour} synthetic {tour.upper()} matches to {tour_dir}")
+    return written
+
+
+if __name__ == "__main__": # Won't be executed when module is imported
+    parser = argparse.ArgumentParser(description="Generate synthetic raw match data")
+    parser.add_argument('--n_matches', type=int, required=True, help='Total number of matches.')
+    parser.add_argument('--root_dir', required=True, help='Directory receiving the atp/ and wta/ folders.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random generator.')
+    args = parser.parse_args()
+
+    write_raw_data(args.root_dir, args.n_matches, args.seed)
@@ -1,15 +1,19 @@
 import os
 import glob
+import json
 import yaml
+import hashlib
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
 import pickle
-from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import MinMaxScaler
 from ensure import ensure_annotations
 from box import ConfigBox
 from box.exceptions import BoxValueError
 
 from pathlib import Path
+from typing import Tuple
 
 import logging
 import sys
@@ -41,6 +45,9 @@ def read_yaml(path_to_yaml: Path) -> ConfigBox:
     except Exception as e:
         raise e
     
+# Columnar binary formats supported by read_data and save_data (require pyarrow)
+BINARY_FORMATS = ('.parquet', '.feather')
+
 def upload_csvfile(csv_file, local_path: str) -> pd.DataFrame:
     """Get a CSV file and store it in a local folder.
 
@@ -72,12 +79,22 @@ def upload_csvfile(csv_file, local_path: str) -> pd.DataFrame:
         logging.error(f'Error reading raw_data as df using read_raw_data: {e}')
 
 
-def read_data(path: str) -> pd.DataFrame:
+def read_data(path: str, columns: dict = None, n_jobs: int = None, cache_dir: str = None, date_format: str = None,
+              na_values: list = None, replacements: dict = None) -> pd.DataFrame:
     """
-    Read data from CSV or pickle files in the specified directory or read a specific file.
+    Read data from CSV, pickle, Parquet or Feather files in the specified directory or read a specific file.
 
     Args:
         path (str): The path to the directory containing CSV and pickle files.
+        columns (dict, optional): Schema {column: dtype} of the columns to keep. When given, in directory mode the
+            CSV files are parsed concurrently and only these columns are parsed (see read_csv_files).
+        n_jobs (int, optional): Number of processes used to parse the CSV files when columns is given.
+            None or -1 uses all the available cores.
+        cache_dir (str, optional): When given, a single CSV file is parsed once and then loaded from a Parquet copy
+            in cache_dir for as long as the content of the CSV file does not change.
+        date_format (str, optional): Known format of the dates when columns is given. Inferred per file if None.
+        na_values (list, optional): Additional tokens parsed as missing values when columns is given.
+        replacements (dict, optional): {typo: fix} replaced in the numeric columns that can't be parsed as they are.
 
     Raises:
         FileNotFoundError: Raised if the specified data_path does not exist.
@@ -90,32 +107,52 @@ def read_data(path: str) -> pd.DataFrame:
     try:
         if path.endswith('.csv'):
             logging.info(f"Reading {path}...")
-            dataset = read_csv(path)
+            if cache_dir is not None:
+                name = os.path.splitext(os.path.basename(path))[0]
+                cache_key = hash_inputs(files=[path])
+                dataset = read_cache(name, cache_key, cache_dir)
+                if dataset is None:
+                    dataset = read_csv(path)
+                    dataset = dataset.drop(columns=[col for col in dataset.columns if col.startswith('Unnamed')])
+                    save_cache(dataset, name, cache_key, cache_dir)
+            else:
+                dataset = read_csv(path)
 
         elif path.endswith('.pkl'):
             dataset = read_pkl(path)
 
+        elif path.endswith(BINARY_FORMATS):
+            logging.info(f"Reading {path}...")
+            dataset = read_binary(path)
+
         elif path.endswith('/'):
             logging.info(f"Reading all files in {path}...")
-            data_files = glob.glob(os.path.join(path, '*.csv')) + glob.glob(os.path.join(path, '*.pkl'))
+            # Files are concatenated in a deterministic order, which sets the index and the order of same-day matches
+            data_files = sorted(glob.glob(os.path.join(path, '*.csv'))) + sorted(glob.glob(os.path.join(path, '*.pkl')))
+            data_files += [file_path for ext in BINARY_FORMATS for file_path in sorted(glob.glob(os.path.join(path, f'*{ext}')))]
 
             if not data_files:
                 raise FileNotFoundError(f"No CSV or pickle files found in {path}")
             
-            dataset = []
-            for file_path in data_files:
-                if file_path.endswith('.csv'):
-                    df = read_csv(file_path)
-                elif file_path.endswith('.pkl'):
-                    df = read_pkl(file_path)
-                else:
-                    logging.error(f"Unsupported file type for {file_path}")
-                    continue
-                dataset.append(df)  
-            dataset = pd.concat(dataset, ignore_index=True)
+            if columns is not None:
+                dataset = read_csv_files(data_files, columns, n_jobs, date_format, na_values, replacements)
+            else:
+                dataset = []
+                for file_path in data_files:
+                    if file_path.endswith('.csv'):
+                        df = read_csv(file_path)
+                    elif file_path.endswith('.pkl'):
+                        df = read_pkl(file_path)
+                    elif file_path.endswith(BINARY_FORMATS):
+                        df = read_binary(file_path)
+                    else:
+                        logging.error(f"Unsupported file type for {file_path}")
+                        continue
+                    dataset.append(df)  
+                dataset = pd.concat(dataset, ignore_index=True)
                               
         else:
-            logging.error(f"Unsupported file type for {file_path}")
+            logging.error(f"Unsupported file type for {path}")
             return pd.DataFrame()
         
         dataset = dataset.drop(columns=[col for col in dataset.columns if col.startswith('Unnamed')])
@@ -152,6 +189,267 @@ def read_csv(file_path: str) -> pd.DataFrame:
     return pd.DataFrame()
 
 
+# Dtypes given to the CSV parser for each schema dtype. Numeric columns are left to the parser's own inference, which
+# types clean files directly; columns with tokens such as '1..5' come out as strings and are fixed by type_columns.
+PARSER_DTYPES = {'string': 'string', 'datetime64': str}
+
+# Date formats tried when the format of a file is not known, and the formats found so far for each file version
+DATE_FORMATS = ["%Y-%m-%d", "%d-%m-%Y", "%Y/%m/%d", "%d/%m/%Y"]
+DATE_FORMAT_CACHE = {}
+
+
+def file_signature(file_path: str) -> tuple:
+    """Identify a version of a file by its path, modification time and size."""
+    stat = os.stat(file_path)
+    return (os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size)
+
+
+def infer_date_format(values: pd.Series, sample_size: int = 1000) -> str:
+    """
+    Find the format of a column of dates from a sample spread over the whole column, rather than from its first row.
+
+    Args:
+        values (pd.Series): Dates as strings.
+        sample_size (int, optional): Number of dates checked. Defaults to 1000.
+
+    Returns:
+        str: The first format of DATE_FORMATS parsing every sampled date, or None.
+    """
+    values = values.dropna()
+    if values.empty:
+        return None
+    sample = values.iloc[np.linspace(0, len(values) - 1, min(sample_size, len(values))).astype(int)]
+    for date_format in DATE_FORMATS:
+        if pd.to_datetime(sample, format=date_format, errors='coerce').notna().all():
+            return date_format
+    return None
+
+
+def type_columns(df: pd.DataFrame, columns: dict, date_format: str = None, replacements: dict = None) -> pd.DataFrame:
+    """
+    Convert freshly parsed columns to their schema dtypes: nullable Int64 for integers, float64, string and datetime.
+
+    Args:
+        df (pd.DataFrame): Parsed data with the lowercase schema columns.
+        columns (dict): Schema {column: dtype}.
+        date_format (str, optional): Known format of the dates. If None, or if some dates don't match it, the format
+            is inferred (see infer_date_format).
+        replacements (dict, optional): {typo: fix} replaced in the numeric columns the parser could not type.
+            Values that still aren't numbers, or aren't integers in integer columns, become missing values.
+
+    Returns:
+        pd.DataFrame: The typed DataFrame. The date format used is stored in df.attrs['date_format'].
+    """
+    for col, dtype in columns.items():
+        if col not in df.columns:
+            continue
+        if 'datetime' in dtype:
+            if pd.api.types.is_datetime64_any_dtype(df[col]):
+                continue
+            dates = None
+            if date_format is not None:
+                dates = pd.to_datetime(df[col], format=date_format, errors='coerce')
+                if dates.isna().sum() > df[col].isna().sum():
+                    dates = None
+            if dates is None:
+                date_format = infer_date_format(df[col])
+                dates = pd.to_datetime(df[col], format=date_format)
+            df[col] = dates
+            df.attrs['date_format'] = date_format
+
+        elif 'int' in dtype or 'float' in dtype:
+            values = df[col]
+            if not pd.api.types.is_numeric_dtype(values):
+                values = values.astype('string')
+                for typo, fix in (replacements or {}).items():
+                    values = values.str.replace(typo, fix, regex=False)
+                values = pd.to_numeric(values, errors='coerce')
+            if 'int' in dtype:
+                # Non-integral values (e.g. a rank of 12.5) are no more valid than 'unr': they become missing values
+                integral = values.isna() | (values % 1 == 0)
+                if not integral.all():
+                    logging.warning(f"{int((~integral).sum())} non-integral values in column {col} read as missing values")
+                    values = values.where(integral)
+            df[col] = values.astype('Int64' if 'int' in dtype else dtype)
+
+        elif dtype == 'string' and not isinstance(df[col].dtype, pd.StringDtype):
+            df[col] = df[col].astype('string')
+    return df
+
+
+def normalize_column_name(col: str) -> str:
+    """Normalize a raw header so that files from different years and sources share column names."""
+    return col.replace('\ufeff', '').strip().lower()
+
+
+def projected_columns(file_path: str, columns: dict) -> Tuple[list, dict]:
+    """Return the headers of a CSV file matching the schema columns, and the dtypes to parse them with."""
+    header = pd.read_csv(file_path, nrows=0).columns
+    usecols = [col for col in header if normalize_column_name(col) in columns]
+    dtype = {col: PARSER_DTYPES[columns[normalize_column_name(col)]] for col in usecols
+             if columns[normalize_column_name(col)] in PARSER_DTYPES}
+    return usecols, dtype
+
+
+def read_csv_projected(file_path: str, columns: dict, date_format: str = None, na_values: list = None,
+                       replacements: dict = None) -> pd.DataFrame:
+    """
+    Read only the schema columns from a CSV file, matching headers case-insensitively, already typed (see type_columns).
+
+    Args:
+        file_path (str): The path to the CSV file.
+        columns (dict): Schema {column: dtype} of the columns to keep.
+        date_format (str, optional): Known format of the dates. Inferred if None.
+        na_values (list, optional): Additional tokens parsed as missing values.
+        replacements (dict, optional): {typo: fix} replaced in the numeric columns the parser could not type.
+
+    Raises:
+        ERROR log: If an error occurs while reading empty data from the CSV file.
+        ERROR log: If an error occurs while reading the CSV file.
+
+    Returns:
+        pd.DataFrame: The DataFrame with the lowercase schema columns, in schema order. Columns missing from the
+            file are filled with NaN.
+    """
+    try:
+        usecols, dtype = projected_columns(file_path, columns)
+        df = pd.read_csv(file_path, usecols=usecols, dtype=dtype, na_values=na_values)
+        df = df.rename(columns=normalize_column_name)
+        return type_columns(df.reindex(columns=list(columns)), columns, date_format, replacements)
+    except pd.errors.EmptyDataError as empty_data_error:
+        logging.error(f"Error reading empty data from file {file_path}: {empty_data_error}")
+    except Exception as e:
+        logging.error(f"Error reading CSV file {file_path}: {str(e)}")
+
+    return pd.DataFrame(columns=list(columns))
+
+
+def count_rows(file_path: str) -> int:
+    """Number of rows read from a CSV or pickle file. Only the first column of a CSV file is parsed."""
+    if file_path.endswith('.csv'):
+        with pd.read_csv(file_path, usecols=[0], dtype=str, chunksize=1 << 16) as reader:
+            return sum(len(chunk) for chunk in reader)
+    return len(read_data(file_path))
+
+
+def read_csv_chunks(file_path: str, columns: dict, chunk_rows: int, date_format: str = None, na_values: list = None,
+                    replacements: dict = None):
+    """
+    Read the schema columns of a CSV file chunk_rows rows at a time, each chunk typed as in read_csv_projected.
+
+    The date format inferred on the first chunk is reused for the next ones.
+
+    Args:
+        file_path (str): The path to the CSV file.
+        columns (dict): Schema {column: dtype} of the columns to keep.
+        chunk_rows (int): Number of rows per chunk.
+        date_format (str, optional): Known format of the dates. Inferred if None.
+        na_values (list, optional): Additional tokens parsed as missing values.
+        replacements (dict, optional): {typo: fix} replaced in the numeric columns the parser could not type.
+
+    Yields:
+        pd.DataFrame: Chunks with the lowercase schema columns, in schema order, indexed by their row number in the file.
+    """
+    columns = {normalize_column_name(col): dtype for col, dtype in dict(columns).items()}
+    usecols, dtype = projected_columns(file_path, columns)
+    with pd.read_csv(file_path, usecols=usecols, dtype=dtype, na_values=na_values, chunksize=chunk_rows) as reader:
+        for chunk in reader:
+            chunk = chunk.rename(columns=normalize_column_name)
+            chunk = type_columns(chunk.reindex(columns=list(columns)), columns, date_format, replacements)
+            date_format = chunk.attrs.get('date_format', date_format)
+            yield chunk
+
+
+def rows_per_chunk(file_path: str, columns: dict, memory_limit_mb: float, copies: int = 4, sample_rows: int = 1000,
+                   date_format: str = None, na_values: list = None) -> int:
+    """
+    Number of rows of a CSV file that can be processed at once within a memory ceiling.
+
+    The size of a typed row is measured on the first sample_rows rows of the file.
+
+    Args:
+        file_path (str): The path to the CSV file.
+        columns (dict): Schema {column: dtype} of the columns to keep.
+        memory_limit_mb (float): Memory available to process a chunk, in MB.
+        copies (int, optional): Number of copies of a chunk alive at the same time while it is processed.
+        sample_rows (int, optional): Number of rows measured.
+        date_format (str, optional): Known format of the dates.
+        na_values (list, optional): Additional tokens parsed as missing values.
+
+    Returns:
+        int: Number of rows per chunk (at least 1000, with a warning if the memory ceiling is too low for them).
+    """
+    chunks = read_csv_chunks(file_path, columns, sample_rows, date_format, na_values)
+    sample = next(chunks, None)
+    chunks.close()
+    if sample is None or sample.empty:
+        return sample_rows
+    row_bytes = sample.memory_usage(deep=True).sum() / len(sample)
+    chunk_rows = int(memory_limit_mb * 2**20 / (row_bytes * copies))
+    if chunk_rows < 1000:
+        logging.warning(f"{memory_limit_mb} MB only fits {chunk_rows} rows of {file_path}: reading 1000 rows per "
+                        f"chunk, which needs {1000 * row_bytes * copies / 2**20:.1f} MB")
+    return max(1000, chunk_rows)
+
+
+def read_csv_files(file_paths: list, columns: dict, n_jobs: int = None, date_format: str = None,
+                   na_values: list = None, replacements: dict = None) -> pd.DataFrame:
+    """
+    Read the schema columns of several CSV or pickle files concurrently, typed, and concatenate them once.
+
+    The date format inferred for each file is cached for as long as the file does not change, so that files are
+    only inferred once per process.
+
+    Args:
+        file_paths (list): Paths to the CSV and pickle files, concatenated in this order.
+        columns (dict): Schema {column: dtype} of the columns to keep.
+        n_jobs (int, optional): Number of worker processes. None or -1 uses all the available cores.
+        date_format (str, optional): Known format of the dates. Inferred per file if None.
+        na_values (list, optional): Additional tokens parsed as missing values.
+        replacements (dict, optional): {typo: fix} replaced in the numeric columns the parser could not type.
+
+    Returns:
+        pd.DataFrame: The concatenated DataFrame.
+    """
+    columns = {normalize_column_name(col): dtype for col, dtype in dict(columns).items()}
+    csv_files = [file_path for file_path in file_paths if file_path.endswith('.csv')]
+
+    if n_jobs is None or n_jobs < 0:
+        n_jobs = os.cpu_count() or 1
+    n_jobs = min(n_jobs, len(csv_files)) or 1
+
+    signatures = {file_path: file_signature(file_path) for file_path in csv_files}
+    date_formats = [date_format or DATE_FORMAT_CACHE.get(signatures[file_path]) for file_path in csv_files]
+    arguments = [csv_files, [columns] * len(csv_files), date_formats,
+                 [na_values] * len(csv_files), [replacements] * len(csv_files)]
+
+    if n_jobs > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            csv_data = dict(zip(csv_files, executor.map(read_csv_projected, *arguments)))
+    else:
+        csv_data = dict(zip(csv_files, map(read_csv_projected, *arguments)))
+
+    for file_path, df in csv_data.items():
+        if df.attrs.get('date_format'):
+            DATE_FORMAT_CACHE[signatures[file_path]] = df.attrs['date_format']
+
+    dataset = []
+    for file_path in file_paths:
+        if file_path.endswith('.csv'):
+            df = csv_data[file_path]
+        elif file_path.endswith('.pkl'):
+            df = read_pkl(file_path)
+            df = df.rename(columns=normalize_column_name).reindex(columns=list(columns))
+            df = type_columns(df, columns, date_format, replacements)
+        else:
+            logging.error(f"Unsupported file type for {file_path}")
+            continue
+        dataset.append(df)
+
+    logging.info(f"-> Read {len(dataset)} files with {n_jobs} processes")
+    return pd.concat(dataset, ignore_index=True)
+
+
 def read_pkl(file_path: str) -> pd.DataFrame:
     """
     Read data from a pickle file.
@@ -178,12 +476,184 @@ def read_pkl(file_path: str) -> pd.DataFrame:
     return pd.DataFrame()
 
 
-def format_data(df: pd.DataFrame, schema: dict) -> pd.DataFrame:
+def read_binary(file_path: str) -> pd.DataFrame:
+    """
+    Read data from a Parquet or Feather file, with the dtypes it was saved with.
+
+    Args:
+        file_path (str): The path to the Parquet or Feather file.
+
+    Raises:
+        ERROR log: If an error occurs while reading the file.
+
+    Returns:
+        pd.DataFrame: The DataFrame read from the file.
+    """
+    try:
+        if file_path.endswith('.parquet'):
+            return pd.read_parquet(file_path)
+        return pd.read_feather(file_path)
+    except Exception as e:
+        logging.error(f"Error reading binary file {file_path}: {str(e)}")
+
+    return pd.DataFrame()
+
+
+def file_hash(file_path: str, chunk_size: int = 1 << 20, size: int = None) -> str:
+    """Hash the content of a file, or only its first size bytes."""
+    h = hashlib.blake2b(digest_size=16)
+    remaining = size if size is not None else float('inf')
+    with open(file_path, 'rb') as file:
+        while remaining > 0:
+            chunk = file.read(int(min(chunk_size, remaining)))
+            if not chunk:
+                break
+            h.update(chunk)
+            remaining -= len(chunk)
+    return h.hexdigest()
+
+
+def frame_hash(df: pd.DataFrame) -> str:
+    """Hash the content, index, column names and dtypes of a DataFrame."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(json.dumps([[str(col), str(dtype)] for col, dtype in df.dtypes.items()]).encode())
+    h.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+def row_hashes(df: pd.DataFrame, columns: list = None) -> np.ndarray:
+    """Hash each row of a DataFrame from the values of columns (all the columns by default), ignoring the index."""
+    return pd.util.hash_pandas_object(df[list(columns or df.columns)], index=False).to_numpy(dtype=np.uint64)
+
+
+def hash_inputs(files: list = (), params: list = (), frames: list = ()) -> str:
+    """
+    Build a cache key from everything a stage depends on.
+
+    Args:
+        files (list): Paths of the input files (data and source code). Their names and contents are hashed.
+        params (list): Parameters (e.g. sections of params.yaml), hashed through their JSON representation.
+        frames (list): Input DataFrames.
+
+    Returns:
+        str: Hexadecimal cache key.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    for file_path in files:
+        h.update(os.path.basename(file_path).encode())
+        h.update(file_hash(file_path).encode())
+    for param in params:
+        h.update(json.dumps(param, sort_keys=True, default=str).encode())
+    for df in frames:
+        h.update(frame_hash(df).encode())
+    return h.hexdigest()
+
+
+def read_cache(name: str, cache_key: str, cache_dir: str) -> pd.DataFrame:
+    """
+    Load the cached DataFrame saved under name for cache_key.
+
+    Args:
+        name (str): Name of the cached artifact (e.g. 'cleaned_data').
+        cache_key (str): Key returned by hash_inputs for the current inputs.
+        cache_dir (str): Directory of the cache.
+
+    Returns:
+        pd.DataFrame: The cached DataFrame, or None if the inputs changed since it was saved.
+    """
+    file_path = os.path.join(cache_dir, f'{name}-{cache_key}.parquet')
+    if not os.path.isfile(file_path):
+        return None
+
+    try:
+        df = pd.read_parquet(file_path)
+        logging.info(f"-> Loaded {name} from cache ({cache_key})")
+        return df
+    except Exception as e:
+        logging.error(f"Error reading cache file {file_path}: {e}")
+        return None
+
+
+def save_cache(df: pd.DataFrame, name: str, cache_key: str, cache_dir: str):
+    """
+    Save a DataFrame in the cache under name for cache_key, replacing older entries of name.
+
+    Args:
+        df (pd.DataFrame): DataFrame to be cached.
+        name (str): Name of the cached artifact (e.g. 'cleaned_data').
+        cache_key (str): Key returned by hash_inputs for the inputs that produced df.
+        cache_dir (str): Directory of the cache.
+
+    Raises:
+        ERROR log: If an error occurs while saving the file.
+    """
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        for old_file in glob.glob(os.path.join(cache_dir, f'{name}-*.parquet')):
+            os.remove(old_file)
+
+        df.to_parquet(os.path.join(cache_dir, f'{name}-{cache_key}.parquet'))
+        logging.info(f"-> Cached {name} ({cache_key})")
+    except Exception as e:
+        logging.error(f"Error caching {name}: {e}")
+
+
+def save_cache_files(file_paths: list, name: str, cache_key: str, cache_dir: str):
+    """
+    Copy files into the cache under name for cache_key, replacing older entries of name.
+
+    Used for the artifacts written next to a cached DataFrame, so that a cache hit can write them again.
+
+    Args:
+        file_paths (list): Files to be cached. Their names must be distinct.
+        name (str): Name of the cached artifacts (e.g. 'features_artifacts').
+        cache_key (str): Key returned by hash_inputs for the inputs that produced the files.
+        cache_dir (str): Directory of the cache.
+    """
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        for old_file in glob.glob(os.path.join(cache_dir, f'{name}-*')):
+            os.remove(old_file)
+
+        for file_path in file_paths:
+            shutil.copyfile(file_path, os.path.join(cache_dir, f'{name}-{cache_key}-{os.path.basename(file_path)}'))
+        logging.info(f"-> Cached {name} ({cache_key})")
+    except Exception as e:
+        logging.error(f"Error caching {name}: {e}")
+
+
+def restore_cache_files(file_paths: list, name: str, cache_key: str, cache_dir: str) -> bool:
+    """
+    Copy the files cached with save_cache_files back to their paths, replacing each file atomically.
+
+    Args:
+        file_paths (list): Files to be restored, as given to save_cache_files.
+        name (str): Name of the cached artifacts.
+        cache_key (str): Key returned by hash_inputs for the current inputs.
+        cache_dir (str): Directory of the cache.
+
+    Returns:
+        bool: True if the files were restored, False if one of them is not cached for cache_key.
+    """
+    cached_paths = [os.path.join(cache_dir, f'{name}-{cache_key}-{os.path.basename(path)}') for path in file_paths]
+    if not all(os.path.isfile(path) for path in cached_paths):
+        return False
+
+    for cached_path, file_path in zip(cached_paths, file_paths):
+        shutil.copyfile(cached_path, f'{file_path}.tmp')
+        os.replace(f'{file_path}.tmp', file_path)
+    logging.info(f"-> Restored {name} from cache ({cache_key})")
+    return True
+
+
+def format_data(df: pd.DataFrame, schema: dict, compact: bool = False) -> pd.DataFrame:
     """Convert DataFrame columns according to a specified schema.
 
     Args:
         df (pd.DataFrame): DataFrame to be formatted.
         schema (dict): Dictionary defining the desired data types for the columns.
+        compact (bool, optional): Store the columns with the smallest dtypes (see compact_dtypes) and log the
+            memory usage of each column before and after. Defaults to False.
 
     Raises:
         WARNING log: If columns with object type were not formatted.
@@ -192,23 +662,15 @@ def format_data(df: pd.DataFrame, schema: dict) -> pd.DataFrame:
         pd.DataFrame: The formatted DataFrame.
     """
     try:
-        df = df.astype('string')
+        memory_before = df.memory_usage(index=False, deep=True) if compact else None
 
-        cols_to_format = {col: dtype for col, dtype in schema.items() if col in df.columns}
+        # Columns typed at parse time (see read_csv_projected) are kept as they are, the others go through strings
+        cols_to_format = {col: dtype for col, dtype in schema.items() if col in df.columns and not has_dtype(df[col], dtype)}
         for col, dtype in cols_to_format.items():
+            df[col] = df[col].astype('string')
             if 'datetime' in dtype:
-                # Determine the date format
-                if df[col].iloc[0][4] == '-':
-                    format = "%Y-%m-%d"
-                elif df[col].iloc[0][2] == '-':
-                    format = "%d-%m-%Y"
-                elif df[col].iloc[0][4] == '/':
-                    format = "%Y/%m/%d"
-                elif df[col].iloc[0][2] == '/':
-                    format = "%d/%m/%Y"
-
-                # Convert datetime columns
-                df[col] = pd.to_datetime(df[col], format=format)
+                # Determine the date format from a sample of the dates and convert datetime columns
+                df[col] = pd.to_datetime(df[col], format=infer_date_format(df[col]))
 
             elif 'int' in dtype:
                 df[col] = df[col].str.replace('.0', '')
@@ -218,6 +680,10 @@ def format_data(df: pd.DataFrame, schema: dict) -> pd.DataFrame:
                 # Convert other columns
                 df[col] = df[col].astype(dtype)
 
+        if compact:
+            df = compact_dtypes(df, schema)
+            log_memory_usage(memory_before, df)
+
         # Check for columns with object type and give warnings
         object_cols = df.select_dtypes(include=['object']).columns
         if not object_cols.empty:
@@ -231,6 +697,133 @@ def format_data(df: pd.DataFrame, schema: dict) -> pd.DataFrame:
         return df
 
 
+def has_dtype(values: pd.Series, dtype: str) -> bool:
+    """Check if a column already has the dtype a schema gives it."""
+    if 'datetime' in dtype:
+        return pd.api.types.is_datetime64_any_dtype(values)
+    if 'int' in dtype:
+        return pd.api.types.is_integer_dtype(values)
+    if 'float' in dtype:
+        return pd.api.types.is_float_dtype(values)
+    if dtype == 'string':
+        return isinstance(values.dtype, pd.StringDtype)
+    return values.dtype == dtype
+
+
+NS_PER_DAY = 86_400_000_000_000
+
+
+def smallest_int_dtype(values: pd.Series) -> str:
+    """Smallest integer dtype holding all the values, nullable (e.g. 'Int16') if some are missing."""
+    nullable = values.isna().any()
+    if values.notna().any():
+        low, high = int(values.min()), int(values.max())
+    else:
+        low = high = 0
+    for dtype in ['int8', 'int16', 'int32', 'int64']:
+        if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+            return dtype.capitalize() if nullable else dtype
+
+
+def to_day_number(dates: pd.Series) -> pd.Series:
+    """Convert dates to the number of days since 1970-01-01, as int32 (Int32 if some dates are missing)."""
+    days = (pd.to_datetime(dates) - pd.Timestamp('1970-01-01')).dt.days
+    return days.astype('Int32' if days.isna().any() else 'int32')
+
+
+def to_ns(dates) -> np.ndarray:
+    """Convert dates, or day numbers from to_day_number, to int64 nanoseconds since 1970-01-01."""
+    dates = pd.Series(dates) if not isinstance(dates, pd.Series) else dates
+    if pd.api.types.is_integer_dtype(dates):
+        return dates.to_numpy(dtype=np.int64) * NS_PER_DAY
+    return pd.to_datetime(dates).to_numpy(dtype='datetime64[ns]').astype(np.int64)
+
+
+def compact_dtypes(df: pd.DataFrame, schema: dict) -> pd.DataFrame:
+    """Store the schema columns with the smallest dtypes.
+
+    String columns become categoricals, integers the smallest integer type holding their values, floats float32 and
+    dates int32 day numbers (see to_day_number). Columns already compact are left as they are, so the function can
+    be applied again, e.g. after concatenating frames whose categories differ.
+
+    Args:
+        df (pd.DataFrame): Formatted DataFrame.
+        schema (dict): Dictionary defining the data types of the columns.
+
+    Returns:
+        pd.DataFrame: The DataFrame with compact columns.
+    """
+    for col, dtype in schema.items():
+        if col not in df.columns:
+            continue
+        if 'datetime' in dtype:
+            if pd.api.types.is_integer_dtype(df[col]):
+                df[col] = df[col].astype('Int32' if df[col].isna().any() else 'int32')
+            else:
+                df[col] = to_day_number(df[col])
+        elif 'int' in dtype:
+            df[col] = df[col].astype(smallest_int_dtype(df[col]))
+        elif 'float' in dtype:
+            df[col] = df[col].astype('float32')
+        elif dtype == 'string' and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+    return df
+
+
+def round_significant(values: np.ndarray, digits: int) -> np.ndarray:
+    """Round values to a number of significant digits. Zeros, NaN and infinities are returned as they are."""
+    values = np.asarray(values, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        exponent = digits - 1 - np.floor(np.log10(np.abs(values)))
+        # Only positive powers of ten are exact: small values are multiplied by the scale, large ones divided by it
+        scale = 10.0 ** np.abs(exponent)
+        rounded = np.where(exponent >= 0, np.round(values * scale) / scale, np.round(values / scale) * scale)
+    return np.where(np.isfinite(rounded), rounded, values)
+
+
+def restore_dtypes(df: pd.DataFrame, schema: dict) -> pd.DataFrame:
+    """Undo compact_dtypes on the numeric and date columns, so that computations don't depend on the storage mode.
+
+    Integers become int64 (Int64 if some are missing), day numbers datetimes and float32 floats float64. A float32
+    holds 6 significant digits exactly, so float32 values are rounded to 6 significant digits: decimals such as the
+    odds come back as the float64 they were parsed to. Categorical strings are left as they are.
+
+    Args:
+        df (pd.DataFrame): DataFrame, compact or not.
+        schema (dict): Dictionary defining the data types of the columns.
+
+    Returns:
+        pd.DataFrame: The DataFrame with full-size numeric and date columns.
+    """
+    for col, dtype in schema.items():
+        if col not in df.columns:
+            continue
+        if 'datetime' in dtype and pd.api.types.is_integer_dtype(df[col]):
+            df[col] = pd.to_datetime(df[col].astype('float64'), unit='D')
+        elif 'int' in dtype and pd.api.types.is_integer_dtype(df[col]) and df[col].dtype.itemsize < 8:
+            df[col] = df[col].astype('Int64' if isinstance(df[col].dtype, pd.api.extensions.ExtensionDtype) else 'int64')
+        elif 'float' in dtype and df[col].dtype == np.float32:
+            df[col] = round_significant(df[col].to_numpy(), 6)
+    return df
+
+
+def downcast_integers(df: pd.DataFrame) -> pd.DataFrame:
+    """Store the integer columns of df with the smallest integer type holding their values (see smallest_int_dtype)."""
+    for col in df.columns:
+        if pd.api.types.is_integer_dtype(df[col]):
+            df[col] = df[col].astype(smallest_int_dtype(df[col]))
+    return df
+
+
+def log_memory_usage(memory_before: pd.Series, df: pd.DataFrame):
+    """Log the memory usage of each column of df, compared to memory_before (from DataFrame.memory_usage)."""
+    memory_after = df.memory_usage(index=False, deep=True)
+    for col in memory_after.index:
+        before = memory_before.get(col, np.nan) / 2**20
+        logging.info(f" -> {col} ({df[col].dtype}): {before:.2f} MB -> {memory_after[col] / 2**20:.2f} MB")
+    logging.info(f" -> Total: {memory_before.sum() / 2**20:.2f} MB -> {memory_after.sum() / 2**20:.2f} MB")
+
+
 def split_data(X, y, train_size, test_size, cv=False):
     """Split data into training, testing, and optionally validation sets.
 
@@ -249,6 +842,9 @@ def split_data(X, y, train_size, test_size, cv=False):
         tuple: If cv is True, returns (X_train, X_test, y_train, y_test).
                If cv is False, returns (X_train, X_val, X_test, y_train, y_val, y_test).
     """
+    # sklearn is imported here rather than at the top: serving imports this module and never needs it
+    from sklearn.model_selection import train_test_split
+
     if cv == True: 
         # Split data into training and testing sets
         X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=test_size, random_state=42)
@@ -268,6 +864,8 @@ def split_data(X, y, train_size, test_size, cv=False):
 
 
 def scaler_data(X_train, X_val, X_test):
+    from sklearn.preprocessing import MinMaxScaler
+
     # Initialize the scaler and fit it to the training data
     scaler = MinMaxScaler(feature_range=(0, 1))
     X_train_scaled = scaler.fit_transform(X_train)
@@ -280,11 +878,13 @@ def scaler_data(X_train, X_val, X_test):
 
 
 def save_data(data: pd.DataFrame, file_name: str, path: str):
-    """Save an object as a DataFrame in a pickle or CSV file in the given directory.
+    """Save an object as a DataFrame in a pickle, CSV, Parquet or Feather file in the given directory.
+
+    Parquet and Feather keep the dtypes of the columns. Feather does not store the index.
 
     Args:
         data (pd.DataFrame): DataFrame to be saved.
-        file_name (str): Must end with '.pkl' or '.csv'.
+        file_name (str): Must end with '.pkl', '.csv', '.parquet' or '.feather'.
         path (str): Directory where the file should be saved.
 
     Raises:
@@ -306,6 +906,10 @@ def save_data(data: pd.DataFrame, file_name: str, path: str):
             data.to_csv(file_path)
         elif file_name.endswith('.pkl'):
             data.to_pickle(file_path)
+        elif file_name.endswith('.parquet'):
+            data.to_parquet(file_path)
+        elif file_name.endswith('.feather'):
+            data.reset_index(drop=True).to_feather(file_path)
         else:
             logging.error(f"Unrecognized file type for {file_name}.")
             return
@@ -1,24 +1,49 @@
-from pipeline import logging
+from pipeline import logging, PARAMS
+from pipeline.profiling import profiler
 from pipeline.clean_data import DataCleaner
 from pipeline.features.build_features import FeaturesBuilder
-from pipeline.models.logistic_regression import LogisticRegressionTrainer
-import logging, argparse
+from libs.data_utils import hash_inputs
+import logging, argparse, functools, time, glob, json, os
 
 STAGE_NAME_01 = 'Data Preparation'
 STAGE_NAME_02 = 'Model Training'
 
-def preparing_data():
+def preparing_data(incremental=False, force=False):
     """
     Executes the data preparation stage, including data cleaning and feature building.
+
+    Parameters:
+        incremental (bool): Only clean and featurize the matches of the raw files added or appended to since the
+            last run, resuming from the players' state it saved. Falls back to a full preparation when the last run
+            can't be continued (see DataCleaner.incremental and FeaturesBuilder.incremental).
+        force (bool): Recompute the cleaned data and the features even if they are cached.
     """
     try:
         logging.info(f">>>>>> Stage: {STAGE_NAME_01} started <<<<<<")
-        
-        # Data cleaning
-        cleaned_data = DataCleaner.main()
-        
-        # Feature building
-        features = FeaturesBuilder.main(cleaned_data)
+
+        features = None
+        if incremental:
+            increment = DataCleaner.incremental()
+            if increment is not None:
+                cleaned_data, manifest = increment
+                features = FeaturesBuilder.incremental(cleaned_data)
+                if features is not None:
+                    # The new matches are only recorded as ingested once their features are saved
+                    DataCleaner.save_increment(cleaned_data, manifest)
+            if features is None:
+                logging.info("Incremental preparation not possible, running a full preparation")
+
+        if features is None:
+            # Data cleaning, in memory or chunk by chunk into on-disk partitions. The features are built in memory
+            # from all the cleaned matches in both cases
+            if PARAMS.ingestion.chunked.enabled:
+                DataCleaner.chunked()
+                cleaned_data = DataCleaner.read_partitions()
+            else:
+                cleaned_data = DataCleaner.main(force)
+
+            # Feature building
+            features = FeaturesBuilder.main(cleaned_data, force)
         
         logging.info(f">>>>>> Stage: {STAGE_NAME_01} completed <<<<<<\n\nx==========x")
         return features
@@ -37,6 +62,9 @@ def model_training():
     try:
         logging.info(f">>>>>> Stage: {STAGE_NAME_02} started <<<<<<")
         
+        # Imported here so that importing main (e.g. from app.py for the stage names) doesn't load sklearn
+        from pipeline.models.logistic_regression import LogisticRegressionTrainer
+
         # Initialize the trainer
         logistic_regression = LogisticRegressionTrainer()
         
@@ -52,37 +80,233 @@ def model_training():
         logging.error(f"Error during {STAGE_NAME_02}: {e}", exc_info=True)
         raise e
 
-def main(stage_name=None):
+def run_step(step_name, step_function, progress=None):
+    """
+    Executes a pipeline stage, reporting its start and its duration.
+
+    Parameters:
+        step_name (str): Name of the stage.
+        step_function (callable): Function executing the stage.
+        progress (callable, optional): Called with (stage name, event, seconds), where event is 'started',
+            'completed' or 'failed' and seconds is the duration of the stage (None when it starts).
+    """
+    if progress:
+        progress(step_name, 'started', None)
+    begin_time = time.perf_counter()
+    try:
+        with profiler.step(step_name):
+            result = step_function()
+    except Exception:
+        if progress:
+            progress(step_name, 'failed', time.perf_counter() - begin_time)
+        raise
+    if progress:
+        progress(step_name, 'completed', time.perf_counter() - begin_time)
+    return result
+
+
+# Pipeline stages in execution order, with the inputs they depend on and the artifacts they produce.
+# 'files' and 'outputs' are paths or glob patterns (raw data, upstream artifacts and source code), 'params' are
+# params.yaml sections.
+# 'incremental' stages can continue their last run instead of starting over (main.py --incremental).
+# 'cached' stages keep intermediate results in the cache (see data_utils.read_cache), bypassed by main.py --force.
+PROCESSED_DATA_PATH = PARAMS.data_path.processed.root_dir
+STAGES = {
+    STAGE_NAME_01: {
+        'function': preparing_data,
+        'files': [
+            PARAMS.data_path.raw.root_dir + PARAMS.data_path.raw.atp + '*',
+            PARAMS.data_path.raw.root_dir + PARAMS.data_path.raw.wta + '*',
+            'pipeline/clean_data.py',
+            'pipeline/players.py',
+            'pipeline/ingestion.py',
+            'pipeline/features/*.py',
+            'libs/data_utils.py',
+        ],
+        'params': ['data_path', 'data_schemas', 'ingestion'],
+        'incremental': True,
+        'cached': True,
+        'outputs': [
+            PARAMS.data_path.interim.root_dir + 'features.csv',
+            PARAMS.ingestion.manifest_path,
+            PROCESSED_DATA_PATH + PARAMS.data_path.processed.player_state,
+            PROCESSED_DATA_PATH + PARAMS.data_path.processed.players,
+            PARAMS.logistic_regression.transformations_path,
+            PARAMS.ingestion.history_path,
+        ],
+    },
+    STAGE_NAME_02: {
+        'function': model_training,
+        'files': [
+            PROCESSED_DATA_PATH + PARAMS.data_path.processed.X_train,
+            PROCESSED_DATA_PATH + PARAMS.data_path.processed.y_train,
+            PROCESSED_DATA_PATH + PARAMS.data_path.processed.X_val,
+            PROCESSED_DATA_PATH + PARAMS.data_path.processed.y_val,
+            PARAMS.logistic_regression.transformations_path,
+            'pipeline/models/logistic_regression.py',
+            'pipeline/models/numpy_scorer.py',
+            'pipeline/features/transformations.py',
+        ],
+        'params': ['logistic_regression'],
+        # The NumPy scorer (a JSON file and the .npy file of its coefficients) is the model the API serves
+        'outputs': [
+            PARAMS.logistic_regression.model_path,
+            PARAMS.logistic_regression.scorer_path,
+            os.path.splitext(PARAMS.logistic_regression.scorer_path)[0] + '-*.npy',
+        ],
+    },
+}
+
+
+def stage_hash(stage_name):
+    """
+    Hashes the current content of the inputs of a stage.
+
+    Parameters:
+        stage_name (str): Name of the stage.
+
+    Returns:
+        str: Hexadecimal hash of the input files and params.yaml sections of the stage.
+    """
+    stage = STAGES[stage_name]
+    files = [path for pattern in stage['files'] for path in sorted(glob.glob(pattern))]
+    params = [{section: PARAMS.get(section)} for section in stage['params']]
+    return hash_inputs(files=files, params=params)
+
+
+def read_stages_state():
+    """
+    Reads the input hashes recorded after the last successful run of each stage.
+    """
+    state_path = PARAMS.stages.state_path
+    if not os.path.isfile(state_path):
+        return {}
+    with open(state_path) as file:
+        return json.load(file)
+
+
+def save_stage_state(stage_name, inputs_hash):
+    """
+    Records the input hash of a stage that ran successfully.
+    """
+    state_path = PARAMS.stages.state_path
+    state = read_stages_state()
+    state[stage_name] = inputs_hash
+    os.makedirs(os.path.dirname(state_path) or '.', exist_ok=True)
+    with open(f'{state_path}.tmp', 'w') as file:
+        json.dump(state, file, indent=4)
+    os.replace(f'{state_path}.tmp', state_path)
+
+
+def plan(stage_names, force=False):
+    """
+    Decides which stages need to run.
+
+    A stage runs if it is forced, if it never ran, if one of its outputs is missing, if its inputs changed since its
+    last successful run, or if an upstream stage producing one of its inputs runs.
+
+    Parameters:
+        stage_names (list): Names of the stages to consider, in execution order.
+        force (bool): Run every stage regardless of its inputs.
+
+    Returns:
+        list: (stage name, run, reason) tuples.
+    """
+    state = read_stages_state()
+    produced = set()
+    decisions = []
+    for stage_name in stage_names:
+        stage = STAGES[stage_name]
+        missing_outputs = [path for path in stage['outputs'] if not glob.glob(path)]
+        upstream_inputs = [path for path in stage['files'] if path in produced]
+
+        if force:
+            run, reason = True, 'forced'
+        elif stage_name not in state:
+            run, reason = True, 'never ran'
+        elif missing_outputs:
+            run, reason = True, f"missing outputs: {missing_outputs}"
+        elif upstream_inputs:
+            run, reason = True, f"upstream artifacts will change: {upstream_inputs}"
+        elif stage_hash(stage_name) != state[stage_name]:
+            run, reason = True, 'inputs changed'
+        else:
+            run, reason = False, 'inputs unchanged'
+
+        if run:
+            produced.update(stage['outputs'])
+        decisions.append((stage_name, run, reason))
+    return decisions
+
+
+def main(stage_name=None, progress=None, force=False, dry_run=False, incremental=False):
     """
     Main function to execute the specified pipeline stage(s) using a steps approach.
 
+    Stages whose inputs did not change since their last successful run are skipped (see plan).
+
     Parameters:
         stage_name (str, optional): Name of the stage to execute. If None, all stages are executed in order.
-    """
-    # Define pipeline steps in sequence
-    steps = {
-        STAGE_NAME_01: preparing_data,
-        STAGE_NAME_02: model_training,
-    }
+        progress (callable, optional): Called when each stage starts and ends (see run_step), and with
+            (stage name, 'skipped', None) for the skipped stages.
+        force (bool): Run the stage(s) even if their inputs did not change, recomputing their cached results.
+        dry_run (bool): Only log which stages would run and why.
+        incremental (bool): Run the incremental stages on the new inputs only (see preparing_data).
 
+    A JSON report with the duration, memory and rows of every stage and step is written to logs/ at the end of the run.
+    """
+    profiler.reset()
     try:
+        if stage_name and stage_name not in STAGES:
+            logging.error(f"Invalid stage name: {stage_name}. Valid options: {list(STAGES.keys())}")
+            return
+
         if stage_name:
             # Run only the specified stage
-            if stage_name in steps:
-                logging.info(f"Executing stage: {stage_name}")
-                steps[stage_name]()
-            else:
-                logging.error(f"Invalid stage name: {stage_name}. Valid options: {list(steps.keys())}")
+            logging.info(f"Executing stage: {stage_name}")
+            stage_names = [stage_name]
         else:
             # Run all stages sequentially
             logging.info("Executing all pipeline stages sequentially.")
-            for step_name, step_function in steps.items():
-                logging.info(f"Starting stage: {step_name}")
-                step_function()
+            stage_names = list(STAGES)
+
+        decisions = plan(stage_names, force)
+        for step_name, run, reason in decisions:
+            logging.info(f"Plan: {'run' if run else 'skip'} stage '{step_name}' ({reason})")
+        if dry_run:
+            return
+
+        for step_name, run, reason in decisions:
+            if not run:
+                logging.info(f"Skipping stage: {step_name} ({reason})")
+                if progress:
+                    progress(step_name, 'skipped', None)
+                continue
+
+            # Upstream stages have run, so the inputs are hashed as this stage will read them. A stage planned
+            # because of its upstream stages is still skipped if they rewrote identical artifacts.
+            inputs_hash = stage_hash(step_name)
+            if not force and read_stages_state().get(step_name) == inputs_hash \
+                    and all(glob.glob(path) for path in STAGES[step_name]['outputs']):
+                logging.info(f"Skipping stage: {step_name} (upstream artifacts unchanged)")
+                if progress:
+                    progress(step_name, 'skipped', None)
+                continue
+
+            logging.info(f"Starting stage: {step_name}")
+            function = STAGES[step_name]['function']
+            if incremental and STAGES[step_name].get('incremental'):
+                function = functools.partial(function, incremental=True)
+            if force and STAGES[step_name].get('cached'):
+                function = functools.partial(function, force=True)
+            run_step(step_name, function, progress)
+            save_stage_state(step_name, inputs_hash)
 
     except Exception as e:
         logging.error(f"Pipeline execution failed at stage '{stage_name}': {e}", exc_info=True)
         raise e
+    finally:
+        profiler.write_report()
 
 
 if __name__ == "__main__":
@@ -90,10 +314,13 @@ if __name__ == "__main__":
         # Parse command-line arguments
         parser = argparse.ArgumentParser(description="Pipeline Stage Execution")
         parser.add_argument('--stage_name', required=False, help='Stage name to execute (e.g., "Data Preparation", "Model Training"). Leave empty to run all stages.')
+        parser.add_argument('--force', action='store_true', help='Run the stage(s) even if their inputs did not change, bypassing the cache.')
+        parser.add_argument('--dry_run', action='store_true', help='Only show which stages would run and why.')
+        parser.add_argument('--incremental', action='store_true', help='Only ingest the new or appended raw files.')
         args = parser.parse_args()
         
         # Run the pipeline
-        main(stage_name=args.stage_name)
+        main(stage_name=args.stage_name, force=args.force, dry_run=args.dry_run, incremental=args.incremental)
     except SystemExit as e:
         logging.error(
             f"An error occurred while parsing arguments or executing the script: {e}. "
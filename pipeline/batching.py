@@ -0,0 +1,108 @@
+import asyncio
+import collections
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+
+class RequestBatcher():
+    """Group concurrent requests into batches scored with a single vectorized call.
+
+    Requests submitted from the event loop wait until max_batch_size requests are pending or max_wait seconds have
+    passed since the first one arrived. The batch is then scored on a worker thread, so the event loop keeps
+    accepting requests, and each caller gets its own result. Requests arriving while a batch is being scored form
+    the next batch: under load, batches grow instead of requests queueing one by one.
+
+    Args:
+        score (callable): Function taking one list per argument of submit() and returning one result per request.
+            A result that is an exception is raised to its caller only.
+        max_batch_size (int, optional): Largest number of requests scored at once. Defaults to 256.
+        max_wait (float, optional): Seconds the first request of a batch waits for others. Defaults to 0.002.
+    """
+    def __init__(self, score, max_batch_size: int = 256, max_wait: float = 0.002):
+        self.score = score
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.batch_sizes = collections.Counter()
+        self._pending = collections.deque()  # (arguments, future)
+        self._arrived = None
+        self._full = None
+        self._task = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='batcher')
+
+    def start(self):
+        """Start collecting batches on the running event loop."""
+        if self._task is None or self._task.done():
+            self._arrived = asyncio.Event()
+            self._full = asyncio.Event()
+            if self._pending:
+                self._arrived.set()
+            self._task = asyncio.get_running_loop().create_task(self._collect())
+
+    async def stop(self):
+        """Stop collecting batches, failing the requests still pending."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while self._pending:
+            _, future = self._pending.popleft()
+            if not future.done():
+                future.set_exception(RuntimeError("The request batcher was stopped"))
+
+    async def submit(self, *args):
+        """Queue a request and wait for its result.
+
+        Args:
+            *args: Arguments of the request, one per list passed to score.
+
+        Returns:
+            The result of the request.
+        """
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((args, future))
+        self._arrived.set()
+        if len(self._pending) >= self.max_batch_size:
+            self._full.set()
+        return await future
+
+    async def _collect(self):
+        while True:
+            await self._arrived.wait()
+            if len(self._pending) < self.max_batch_size:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.max_wait)
+                except asyncio.TimeoutError:
+                    pass
+
+            batch = [self._pending.popleft() for _ in range(min(self.max_batch_size, len(self._pending)))]
+            if not self._pending:
+                self._arrived.clear()
+            if len(self._pending) < self.max_batch_size:
+                self._full.clear()
+
+            # Callers that went away (e.g. cancelled requests) are not scored
+            batch = [(args, future) for args, future in batch if not future.done()]
+            if batch:
+                await self._run(batch)
+
+    async def _run(self, batch: list):
+        """Score a batch on the worker thread and resolve the futures of its requests."""
+        self.batch_sizes[len(batch)] += 1
+        columns = [list(column) for column in zip(*(args for args, _ in batch))]
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(self._executor, self.score, *columns)
+        except Exception as e:
+            logging.error(f"Error scoring a batch of {len(batch)} requests: {e}", exc_info=True)
+            results = [e] * len(batch)
+
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
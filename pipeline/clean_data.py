@@ -1,24 +1,84 @@
 # Usage: python -m pipeline.clean_data
+import glob
 import logging
+import os
+import shutil
+import numpy as np
 import pandas as pd
+from typing import Tuple
 from libs import data_utils
 from . import PARAMS
+from .ingestion import IngestionManifest
+from .players import PlayerDictionary
+from .profiling import profiler
 
 class DataCleaner():
     @staticmethod
-    def main() -> pd.DataFrame:
+    @profiler.profiled()
+    def main(force: bool = False) -> pd.DataFrame:
         """Transform ATP and WTA raw data into a single cleaned DataFrame.
-        Saves data in cleaned_data.csv located in interim_data_path.
+        Saves data in cleaned_data.csv located in interim_data_path, and the manifest of the ingested raw files.
+
+        Args:
+            force (bool, optional): Clean the raw data even if it is cached. The result is still cached.
 
         Returns:
             pd.DataFrame: Transformed data.
         """
-        # Read data
+        # Read only the schema columns (and the ATP 'comment' used to filter matches), parsing files concurrently
+        schema = PARAMS.data_schemas.raw
         raw_data_path = PARAMS.data_path.raw.root_dir
         atp_file_path = raw_data_path + PARAMS.data_path.raw.atp
         wta_file_path = raw_data_path + PARAMS.data_path.raw.wta
-        atp_df = data_utils.read_data(atp_file_path)
-        wta_df = data_utils.read_data(wta_file_path)
+        n_jobs = PARAMS.ingestion.n_jobs
+        compact = PARAMS.ingestion.compact_dtypes
+        date_formats = PARAMS.ingestion.date_formats
+        na_values = list(PARAMS.ingestion.na_values)
+        replacements = dict(PARAMS.ingestion.replacements)
+        atp_files, wta_files = DataCleaner.raw_files()
+
+        # Load the cleaned data from cache if neither the raw files, the schema nor the cleaning code changed
+        if PARAMS.cache.enabled:
+            cache_key = data_utils.hash_inputs(files=atp_files + wta_files + [__file__, data_utils.__file__], params=[schema, compact, date_formats, na_values, replacements])
+            df = None if force else data_utils.read_cache('cleaned_data', cache_key, PARAMS.cache.root_dir)
+            if df is not None:
+                df = DataCleaner.add_player_ids(df)
+                DataCleaner.save_manifest(df, atp_files + wta_files)
+                return df
+
+        # Columns come out of the parser typed according to the schema, typos in the odds (e.g. '5..5') fixed
+        atp_df = data_utils.read_data(atp_file_path, columns={**schema, 'comment': 'string'}, n_jobs=n_jobs,
+                                      date_format=date_formats.atp, na_values=na_values, replacements=replacements)
+        wta_df = data_utils.read_data(wta_file_path, columns=schema, n_jobs=n_jobs,
+                                      date_format=date_formats.wta, na_values=na_values, replacements=replacements)
+
+        df = DataCleaner.clean(atp_df, wta_df)
+
+        # Identify the players by their ids in the persistent players' dictionary
+        df = DataCleaner.add_player_ids(df)
+
+        interim_data_path = PARAMS.data_path.interim.root_dir
+        df.to_csv(interim_data_path + 'cleaned_data.csv')
+        DataCleaner.save_manifest(df, atp_files + wta_files)
+
+        if PARAMS.cache.enabled:
+            data_utils.save_cache(df, 'cleaned_data', cache_key, PARAMS.cache.root_dir)
+
+        return df
+
+    @staticmethod
+    def clean(atp_df: pd.DataFrame, wta_df: pd.DataFrame) -> pd.DataFrame:
+        """Filter, type and concatenate the raw ATP and WTA matches, and add the P1/P2 columns.
+
+        Args:
+            atp_df (pd.DataFrame): Raw ATP matches, with the 'comment' column.
+            wta_df (pd.DataFrame): Raw WTA matches.
+
+        Returns:
+            pd.DataFrame: Cleaned matches.
+        """
+        schema = PARAMS.data_schemas.raw
+        compact = PARAMS.ingestion.compact_dtypes
 
         # Rename columns to lowercase
         atp_df.rename(columns=lambda x: x.lower(), inplace=True)
@@ -26,54 +86,337 @@ class DataCleaner():
         # Drop matches that aren't completed
         atp_df = atp_df[atp_df['comment'] == "Completed"]
 
-        # Correct typos: Replace occurrences of '..' with '.0'
-        wta_df['b365l'] = wta_df['b365l'].apply(lambda x: str(x).replace('..', '.0') if isinstance(x, str) and '..' in x else x)
-
         # Select relevant columns
-        schema = PARAMS.data_schemas.raw
         atp_df = atp_df[schema.keys()]
         wta_df = wta_df[schema.keys()]
 
         # Format data according to data schemas toml file
         logging.info('Formating atp data according to the imported schema...')
-        atp_df = data_utils.format_data(atp_df, schema)
+        atp_df = data_utils.format_data(atp_df, schema, compact)
 
         logging.info('Formating wta data according to the imported schema...')
-        wta_df = data_utils.format_data(wta_df, schema)
+        wta_df = data_utils.format_data(wta_df, schema, compact)
 
-        # Concat datasets
-        df = pd.concat([atp_df, wta_df])
+        # Concat datasets (a tour may be empty, e.g. in a chunk of the other tour's file)
+        df = pd.concat([frame for frame in (atp_df, wta_df) if not frame.empty] or [atp_df])
 
         # Drop null values
         df = df.dropna()
 
-        df['winner_is_p1'] = df.apply(DataCleaner.winner_is_p1, axis=1)
-        df['odd_p1'] = df.apply(lambda row: row['b365w'] if row['winner_is_p1'] == 1 else row['b365l'], axis=1)
-        df['odd_p2'] = df.apply(lambda row: row['b365w'] if row['winner_is_p1'] == 0 else row['b365l'], axis=1)
+        # Merge the categories of both datasets and drop the nullable integer types, as there are no nulls left
+        if compact:
+            df = data_utils.compact_dtypes(df, schema)
 
-        interim_data_path = PARAMS.data_path.interim.root_dir
-        df.to_csv(interim_data_path + 'cleaned_data.csv')
+        df['winner_is_p1'] = DataCleaner.winner_is_p1(df)
+        df['odd_p1'] = np.where(df['winner_is_p1'] == 1, df['b365w'], df['b365l'])
+        df['odd_p2'] = np.where(df['winner_is_p1'] == 0, df['b365w'], df['b365l'])
+        return df
+
+    @staticmethod
+    def raw_files() -> Tuple[list, list]:
+        """Return the sorted ATP and WTA raw files."""
+        raw_data_path = PARAMS.data_path.raw.root_dir
+        atp_files = sorted(glob.glob(raw_data_path + PARAMS.data_path.raw.atp + '*'))
+        wta_files = sorted(glob.glob(raw_data_path + PARAMS.data_path.raw.wta + '*'))
+        return atp_files, wta_files
+
+    @staticmethod
+    def source_files() -> list:
+        """Return the modules the cleaned matches and their features are computed with."""
+        pipeline_dir = os.path.dirname(__file__)
+        source_files = [__file__, data_utils.__file__, os.path.join(pipeline_dir, 'players.py')]
+        return source_files + sorted(glob.glob(os.path.join(pipeline_dir, 'features', '*.py')))
+
+    @staticmethod
+    def ingestion_key() -> str:
+        """Hash the code and params the ingested matches depend on, features included.
+
+        A manifest recorded with another key can't be continued: the next run must be a full one.
+        """
+        ingestion = PARAMS.ingestion
+        return data_utils.hash_inputs(files=DataCleaner.source_files(), params=[PARAMS.data_schemas.raw, ingestion.compact_dtypes,
+                                                                  ingestion.date_formats, list(ingestion.na_values),
+                                                                  dict(ingestion.replacements)])
+
+    @staticmethod
+    def save_manifest(df: pd.DataFrame, raw_files: list):
+        """Record the raw files and the hashes of the matches of a full run in a new manifest."""
+        manifest = IngestionManifest(DataCleaner.ingestion_key(), next_index=int(df.index.max()) + 1 if len(df) else 0)
+        for file_path in raw_files:
+            manifest.record(file_path, data_utils.count_rows(file_path))
+        manifest.add(data_utils.row_hashes(df, list(PARAMS.data_schemas.raw)))
+        manifest.save(PARAMS.ingestion.manifest_path, PARAMS.ingestion.hash_index_path)
+
+    @staticmethod
+    @profiler.profiled()
+    def incremental() -> Tuple[pd.DataFrame, IngestionManifest]:
+        """Clean only the raw files added or appended to since the last run, skipping the matches already ingested.
+
+        Nothing is saved: once the features of the new matches are built, save_increment() appends them to
+        cleaned_data.csv and saves the manifest.
+
+        Returns:
+            Tuple[pd.DataFrame, IngestionManifest]: The new cleaned matches, indexed as main() would index them, and
+                the manifest recording them. None if a full run is needed: no manifest, other cleaning code or
+                params, raw files removed or rewritten, new raw files sorting before ingested ones, or new index
+                labels already taken by the other tour.
+        """
+        schema = PARAMS.data_schemas.raw
+        n_jobs = PARAMS.ingestion.n_jobs
+        date_formats = PARAMS.ingestion.date_formats
+        na_values = list(PARAMS.ingestion.na_values)
+        replacements = dict(PARAMS.ingestion.replacements)
+        atp_files, wta_files = DataCleaner.raw_files()
+
+        manifest = IngestionManifest.load(PARAMS.ingestion.manifest_path, PARAMS.ingestion.hash_index_path)
+        chunked = PARAMS.ingestion.chunked.enabled
+        if not os.path.exists(PARAMS.ingestion.chunked.output_dir if chunked else PARAMS.data_path.interim.root_dir + 'cleaned_data.csv'):
+            logging.info("No cleaned data to continue: full run needed")
+            return None
+        if manifest.key != DataCleaner.ingestion_key():
+            logging.info("No manifest of the ingested files for the current cleaning code and params: full run needed")
+            return None
+
+        statuses = manifest.changes(atp_files + wta_files)
+        modified = [file_path for file_path, status in statuses.items() if status in ('removed', 'rewritten')]
+        if modified:
+            logging.info(f"Raw files removed or rewritten since the last run ({', '.join(modified)}): full run needed")
+            return None
+
+        # Matches are indexed as in main(): by their row in the raw files of their tour, concatenated in sorted order.
+        # The rows of the files already ingested come first, so new or appended files must sort after them
+        tour_files = {'atp': atp_files, 'wta': wta_files}
+        changed, first_label = {}, {}
+        for tour, file_paths in tour_files.items():
+            changed[tour] = [file_path for file_path in file_paths if statuses[file_path] in ('new', 'appended')]
+            ingested = [file_path for file_path in file_paths if statuses[file_path] == 'unchanged']
+            if changed[tour] and ingested and file_paths.index(changed[tour][0]) < file_paths.index(ingested[-1]):
+                logging.info(f"New or appended raw files sort before files already ingested ({changed[tour][0]}): "
+                             "full run needed")
+                return None
+            first_label[tour] = sum(manifest.files[file_path]['rows'] for file_path in ingested)
+        logging.info(f"Cleaning {len(changed['atp']) + len(changed['wta'])} new or appended raw files...")
+
+        # Tours without new files contribute an empty frame, typed as the others
+        atp_columns = {**schema, 'comment': 'string'}
+        atp_df = (data_utils.read_csv_files(changed['atp'], atp_columns, n_jobs, date_formats.atp, na_values, replacements)
+                  if changed['atp'] else DataCleaner.empty_frame(atp_columns))
+        wta_df = (data_utils.read_csv_files(changed['wta'], schema, n_jobs, date_formats.wta, na_values, replacements)
+                  if changed['wta'] else DataCleaner.empty_frame(schema))
+        atp_df.index += first_label['atp']
+        wta_df.index += first_label['wta']
+
+        # Both tours share the labels of their first rows. New labels taken by the other tour would change the features
+        # of its matches (see PlayerStateEngine.broadcast_duplicate_labels)
+        last_label = {'atp': first_label['atp'] + len(atp_df), 'wta': first_label['wta'] + len(wta_df)}
+        for tour, other in (('atp', 'wta'), ('wta', 'atp')):
+            if changed[tour] and first_label[tour] < last_label[other]:
+                logging.info(f"New {tour.upper()} matches would share index labels with {other.upper()} matches: "
+                             "full run needed")
+                return None
+
+        df = DataCleaner.clean(atp_df, wta_df)
 
+        # Skip the matches already ingested, e.g. the first lines of an appended file
+        hashes = data_utils.row_hashes(df, list(schema))
+        new_matches = ~manifest.ingested(hashes)
+        df, hashes = df[new_matches], hashes[new_matches]
+        df = DataCleaner.add_player_ids(df)
+        logging.info(f" -> {len(df)} new matches, {int((~new_matches).sum())} already ingested")
+
+        manifest.add(hashes)
+        if len(df):
+            manifest.next_index = max(manifest.next_index, int(df.index.max()) + 1)
+        for file_path in changed['atp'] + changed['wta']:
+            manifest.record(file_path, data_utils.count_rows(file_path))
+        return df, manifest
+
+    @staticmethod
+    def save_increment(df: pd.DataFrame, manifest: IngestionManifest):
+        """Append the matches cleaned by incremental() to the cleaned data and save the manifest recording them.
+
+        The matches are appended to cleaned_data.csv, or written as new partitions in chunked mode.
+        """
+        if PARAMS.ingestion.chunked.enabled:
+            DataCleaner.write_partitions(df, f'increment-{int(df.index.min()) if len(df) else 0:09d}')
+        else:
+            cleaned_data_path = PARAMS.data_path.interim.root_dir + 'cleaned_data.csv'
+            columns = pd.read_csv(cleaned_data_path, nrows=0).columns[1:]
+            df.reindex(columns=columns).to_csv(cleaned_data_path, mode='a', header=False)
+        manifest.save(PARAMS.ingestion.manifest_path, PARAMS.ingestion.hash_index_path)
+
+    @staticmethod
+    @profiler.profiled()
+    def chunked() -> list:
+        """Clean the raw data chunk by chunk, within a memory ceiling, into Parquet partitions by year.
+
+        Raw CSV files are streamed in chunks small enough for a chunk and its copies during the cleaning to fit in
+        PARAMS.ingestion.chunked.memory_limit_mb. Each chunk is filtered, typed, stripped of null values and given
+        its P1/P2 columns and player ids as in main(), then written to <output_dir>/year=<year>/ before the next one
+        is read, so that the whole history is never held in memory. Matches keep the index labels main() gives them.
+
+        Returns:
+            list: Paths of the partition files written.
+        """
+        schema = PARAMS.data_schemas.raw
+        date_formats = PARAMS.ingestion.date_formats
+        na_values = list(PARAMS.ingestion.na_values)
+        replacements = dict(PARAMS.ingestion.replacements)
+        memory_limit_mb = PARAMS.ingestion.chunked.memory_limit_mb
+        output_dir = PARAMS.ingestion.chunked.output_dir
+        players_path = PARAMS.data_path.processed.root_dir + PARAMS.data_path.processed.players
+        raw_data_path = PARAMS.data_path.raw.root_dir
+
+        # Start from an empty output, partitions of an older run would be read with the new ones
+        shutil.rmtree(output_dir, ignore_errors=True)
+        os.makedirs(output_dir)
+
+        atp_columns = {**schema, 'comment': 'string'}
+        players = PlayerDictionary.load(players_path)
+        manifest = IngestionManifest(DataCleaner.ingestion_key())
+        partitions = []
+        for tour, columns in (('atp', atp_columns), ('wta', schema)):
+            # Files in the order read_data concatenates them, so that index labels are the same as in main()
+            tour_path = raw_data_path + PARAMS.data_path.raw[tour]
+            offset = 0
+            for file_path in sorted(glob.glob(os.path.join(tour_path, '*.csv'))):
+                first_row = offset
+                chunk_rows = data_utils.rows_per_chunk(file_path, columns, memory_limit_mb,
+                                                       date_format=date_formats[tour], na_values=na_values)
+                logging.info(f"Cleaning {file_path} in chunks of {chunk_rows} rows...")
+                chunks = data_utils.read_csv_chunks(file_path, columns, chunk_rows, date_formats[tour], na_values, replacements)
+                for i, chunk in enumerate(chunks):
+                    chunk.index = pd.RangeIndex(offset, offset + len(chunk))
+                    offset += len(chunk)
+
+                    if tour == 'atp':
+                        df = DataCleaner.clean(chunk, DataCleaner.empty_frame(schema))
+                    else:
+                        df = DataCleaner.clean(DataCleaner.empty_frame(atp_columns), chunk)
+                    df = DataCleaner.add_player_ids(df, players)
+
+                    manifest.add(data_utils.row_hashes(df, list(schema)))
+                    if len(df):
+                        manifest.next_index = max(manifest.next_index, int(df.index.max()) + 1)
+                    name = f"{tour}-{os.path.splitext(os.path.basename(file_path))[0]}-{i:05d}"
+                    partitions.extend(DataCleaner.write_partitions(df, name))
+                manifest.record(file_path, offset - first_row)
+
+        players.save(players_path)
+        manifest.save(PARAMS.ingestion.manifest_path, PARAMS.ingestion.hash_index_path)
+        logging.info(f" -> Cleaned {manifest.n_matches} matches into {len(partitions)} partitions in {output_dir}")
+        return partitions
+
+    @staticmethod
+    def write_partitions(df: pd.DataFrame, name: str) -> list:
+        """Write cleaned matches to <output_dir>/year=<year>/<name>.parquet, one file per year.
+
+        Returns:
+            list: Paths of the files written.
+        """
+        output_dir = PARAMS.ingestion.chunked.output_dir
+        years = pd.DatetimeIndex(data_utils.to_ns(df['date'])).year
+        paths = []
+        for year, part in df.groupby(years):
+            os.makedirs(os.path.join(output_dir, f'year={year}'), exist_ok=True)
+            paths.append(os.path.join(output_dir, f'year={year}', f'{name}.parquet'))
+            part.to_parquet(paths[-1])
+        return paths
+
+    @staticmethod
+    def read_partitions(columns: list = None) -> pd.DataFrame:
+        """Read the cleaned matches written by chunked() and save_increment().
+
+        Partitions are read in the order main() concatenates the matches: ATP then WTA files, chunk by chunk, then
+        the increments, so that matches played on the same day are in the same order as in main().
+
+        Args:
+            columns (list, optional): Columns to read. Defaults to all the columns.
+
+        Returns:
+            pd.DataFrame: Cleaned matches.
+        """
+        output_dir = PARAMS.ingestion.chunked.output_dir
+        paths = sorted(glob.glob(os.path.join(output_dir, 'year=*', '*.parquet')), key=DataCleaner.partition_order)
+        if not paths:
+            raise FileNotFoundError(f"No cleaned partitions found in {output_dir}")
+        df = pd.concat([pd.read_parquet(path, columns=columns) for path in paths])
+
+        # Categories differ from one partition to another
+        if PARAMS.ingestion.compact_dtypes:
+            df = data_utils.compact_dtypes(df, PARAMS.data_schemas.raw)
         return df
-    
+
+    @staticmethod
+    def partition_order(path: str) -> tuple:
+        """Sort key of a partition: (tour, raw file, chunk, year) for chunked(), (increment, first label, year) after."""
+        year = int(os.path.basename(os.path.dirname(path)).split('=')[1])
+        name = os.path.splitext(os.path.basename(path))[0]
+        if name.startswith('increment-'):
+            return 2, '', int(name.split('-')[1]), year
+        tour, name = name.split('-', 1)
+        file_stem, chunk = name.rsplit('-', 1)
+        return ('atp', 'wta').index(tour), file_stem, int(chunk), year
+
     @staticmethod
-    def winner_is_p1(row: pd.Series) -> int:
-        """Determine if P1 is the winner based on odds and ranking.
+    def empty_frame(columns: dict) -> pd.DataFrame:
+        """Return an empty raw DataFrame with the schema columns, typed."""
+        return data_utils.type_columns(pd.DataFrame(columns=list(columns)), columns)
+
+    @staticmethod
+    def add_player_ids(df: pd.DataFrame, players: PlayerDictionary = None) -> pd.DataFrame:
+        """Add the winner_id and loser_id columns, extending the players' dictionary with the new players.
+
+        Ids are looked up on every run, cached data included, so that they always match the saved dictionary.
 
         Args:
-            row (pd.Series): Row of match data.
+            df (pd.DataFrame): Match data.
+            players (PlayerDictionary, optional): Dictionary to extend, saved by the caller. Defaults to the saved
+                dictionary, saved again if players were added.
 
         Returns:
-            int: 1 if P1 is the winner, 0 otherwise.
+            pd.DataFrame: Match data with the int32 winner_id and loser_id columns.
         """
-        if row['b365w'] < row['b365l']:  # winner is P1
-            return 1
-        elif row['b365w'] == row['b365l']:
-            return 1 if row['wrank'] < row['lrank'] else 0  # winner is P1 if wrank < lrank
-        else:  # winner is P2
-            return 0
+        if players is not None:
+            df['winner_id'] = players.encode(df['winner'])
+            df['loser_id'] = players.encode(df['loser'])
+            return df
+
+        players_path = PARAMS.data_path.processed.root_dir + PARAMS.data_path.processed.players
+        players = PlayerDictionary.load(players_path)
+        n_players = len(players)
+
+        df['winner_id'] = players.encode(df['winner'])
+        df['loser_id'] = players.encode(df['loser'])
+
+        if len(players) > n_players or not os.path.isfile(players_path):
+            logging.info(f"Added {len(players) - n_players} players to the players' dictionary")
+            players.save(players_path)
+        return df
+
+    @staticmethod
+    def winner_is_p1(df: pd.DataFrame) -> np.ndarray:
+        """Determine for each match if P1 is the winner based on odds and ranking.
+
+        Args:
+            df (pd.DataFrame): Match data.
+
+        Returns:
+            np.ndarray: 1 if P1 is the winner, 0 otherwise.
+        """
+        b365w = df['b365w'].to_numpy(dtype=np.float64)
+        b365l = df['b365l'].to_numpy(dtype=np.float64)
+        wrank_is_lower = (df['wrank'] < df['lrank']).to_numpy(dtype=bool, na_value=False)
+
+        return np.select(
+            [b365w < b365l,  # winner is P1
+             b365w == b365l],  # winner is P1 if wrank < lrank
+            [1, wrank_is_lower.astype(np.int64)],
+            default=0  # winner is P2
+        ).astype(np.int64)
         
     @staticmethod
+    @profiler.profiled()
     def remove_outliers(df: pd.DataFrame):
         # Define the conditions
         conditions = [
@@ -1,28 +1,96 @@
 # Usage: python -m pipeline.features.build_features
+import logging
+import os
+import numpy as np
 import pandas as pd
+from typing import Tuple
 from ..clean_data import DataCleaner
-from pipeline.features.h2h_features import H2HFeatures
 from pipeline.features.odds_features import OddsFeatures
+from pipeline.features.player_state import PlayerStateEngine
 from pipeline.features.rank_features import RankFeatures
 from pipeline.features.results_features import ResultsFeatures
 from pipeline.features.surface_features import SurfaceFeatures
-from pipeline.features.transformations import Transformations
+from pipeline.features.transformations import FittedTransformer, Transformations
+from pipeline.players import PlayerDictionary
 from .. import PARAMS
+from ..profiling import profiler
 from libs import data_utils
 
 
 class FeaturesBuilder():
     @staticmethod
-    def main(df: pd.DataFrame = pd.DataFrame()) -> pd.DataFrame:
+    @profiler.profiled()
+    def main(df: pd.DataFrame = pd.DataFrame(), force: bool = False) -> pd.DataFrame:
         # save features list for analysis
         features = []
         interim_data_path = PARAMS.data_path.interim.root_dir
+        player_state_path = PARAMS.data_path.processed.root_dir + PARAMS.data_path.processed.player_state
+        players_path = PARAMS.data_path.processed.root_dir + PARAMS.data_path.processed.players
+        transformations_path = PARAMS.logistic_regression.transformations_path
+        history_path = PARAMS.ingestion.history_path
+        cache_dir = PARAMS.cache.root_dir if PARAMS.cache.enabled else None
 
         if df.empty:
-            df = data_utils.read_data(interim_data_path + 'cleaned_data.csv')
+            df = data_utils.read_data(interim_data_path + 'cleaned_data.csv', cache_dir=cache_dir)
 
-        # Ensure df is in chronological order
-        df = df.sort_values(by="date")
+        # Load the features from cache if neither the cleaned data nor the code building them changed (the cleaning
+        # modules included: remove_outliers runs here). The artifacts saved with them are restored too, so that a
+        # cache hit leaves the same files as a run
+        artifacts = [player_state_path, players_path, transformations_path, history_path]
+        if cache_dir is not None:
+            cache_key = data_utils.hash_inputs(files=DataCleaner.source_files(), frames=[df])
+            cached_features = None if force else data_utils.read_cache('features', cache_key, cache_dir)
+            if cached_features is not None and data_utils.restore_cache_files(artifacts, 'features_artifacts', cache_key, cache_dir):
+                cached_features.to_csv(interim_data_path + 'features.csv')
+                return cached_features
+
+        # Player's state and transformations are learned on this data
+        player_state = PlayerStateEngine(PlayerDictionary.load(players_path))
+        df, features = FeaturesBuilder.build_history(df, features, player_state)
+
+        # Persist the players' state at the end of the history, and the dictionary in case the sweep added players
+        player_state.save(player_state_path)
+        player_state.players.save(players_path)
+
+        # Save the features before transformation, for incremental runs to fit the transformations again
+        FeaturesBuilder.save_history(df, history_path)
+
+        transformer = FittedTransformer()
+        df, features = FeaturesBuilder.transform(df, features, transformer)
+
+        # Save the shifts and bin boundaries next to the model to transform new matches at prediction time
+        transformer.save(transformations_path)
+
+        # Save data
+        print(interim_data_path)
+        df.to_csv(interim_data_path + 'features.csv')
+
+        if cache_dir is not None:
+            data_utils.save_cache(df, 'features', cache_key, cache_dir)
+            data_utils.save_cache_files(artifacts, 'features_artifacts', cache_key, cache_dir)
+
+        return df
+
+    @staticmethod
+    def build_history(df: pd.DataFrame, features: list, player_state: PlayerStateEngine) -> Tuple[pd.DataFrame, list]:
+        """Build the features of cleaned matches, before the fitted transformations (see transform).
+
+        Args:
+            df (pd.DataFrame): Cleaned matches.
+            features (list): List to store feature names.
+            player_state (PlayerStateEngine): State of the players before the first match of df, updated up to
+                the last one.
+
+        Returns:
+            Tuple[pd.DataFrame, list]: Features without outliers, in chronological order, and feature names.
+        """
+        # Compact columns (see data_utils.compact_dtypes) only save memory: the features are computed from the full-size
+        # odds, ranks and dates, as at prediction time
+        df = data_utils.restore_dtypes(df, PARAMS.data_schemas.raw)
+
+        # Ensure df is in chronological order. The sort is stable so that matches played on the same day keep the order
+        # of the raw files: a full run and an incremental one then sweep them in the same order
+        df = df.sort_values(by="date", kind="stable")
 
         # Add match_id column
         df['match_id'] = df.index
@@ -35,8 +103,10 @@ class FeaturesBuilder():
         df, features = RankFeatures.add_rank_ratio(df, features)
 
         # Add player's odds
-        df['odd_p1'] = df.apply(lambda row: row['b365w'] if row['b365w'] < row['b365l'] else row['b365l'], axis=1)
-        df['odd_p2'] = df.apply(lambda row: row['b365w'] if row['b365w'] > row['b365l'] else row['b365l'], axis=1)
+        with profiler.step('FeaturesBuilder.add_odds', rows_in=len(df)) as record:
+            df['odd_p1'] = np.where(df['b365w'] < df['b365l'], df['b365w'], df['b365l'])
+            df['odd_p2'] = np.where(df['b365w'] > df['b365l'], df['b365w'], df['b365l'])
+            record['rows_out'] = len(df)
 
         # Add the difference and ratio between players
         df, features = OddsFeatures.add_odd_dif(df, features)
@@ -45,77 +115,112 @@ class FeaturesBuilder():
         # Add a binary column for each surface
         df, features = SurfaceFeatures.OHE_surface(df, features)  
 
-        # Add player's head-to-head
-        df, features = H2HFeatures.add_h2h(df, features)  
-
-        df, features = ResultsFeatures.add_consecutive_wins_and_losses(df, features)
+        # Add player's head-to-head, consecutive wins and losses, ranking's evolution and records (total wins - total losses)
+        # in a single sweep over the matches. Players are identified by the ids the cleaning gave them
+        df, features = PlayerStateEngine.add_player_state(df, features, player_state)
 
         # Add combined consecutive results (consecutive_wins_p1 - consecutive_wins_p2 - consecutive_losses_p1 + consecutive_losses_p2)
         df, features = ResultsFeatures.add_consecutive_results(df, features)
 
-        # Add ranking's evolution for each player
-        df, features = RankFeatures.add_rank_evolution(df, features)
-
         # Add combined rankings and rankings evolution (- rank_p1 + rank_p2 + rank_evol_p1 - rank_evol_p2)
         df, features = RankFeatures.add_rank_combined(df, features) 
 
-        # Add players' records (total wins - total losses)
-        df, features = ResultsFeatures.add_records(df, features)
-
         df = DataCleaner.remove_outliers(df)
 
+        return df, features
+
+    @staticmethod
+    def transform(df: pd.DataFrame, features: list, transformer: FittedTransformer) -> Tuple[pd.DataFrame, list]:
+        """Apply the logaritmic transformations, the bins and the inversions to the features of build_history.
+
+        Args:
+            df (pd.DataFrame): Features returned by build_history. Transformed columns are added to it.
+            features (list): Feature names returned by build_history.
+            transformer (FittedTransformer): Transformations to apply, fitted on df if not fitted yet.
+
+        Returns:
+            Tuple[pd.DataFrame, list]: Features and feature names.
+        """
         # Performed logaritmic transformations to the skewed features 
-        df, features = Transformations.logaritmic_trasformation(df, features)
+        df, features = Transformations.logaritmic_trasformation(df, features, transformer)
         
         # Bin features that have consistent distributions but uneven frequencies among their values.
-        df, features = Transformations.bin_features(df, features)
+        df, features = Transformations.bin_features(df, features, transformer)
 
         # Invert features with a negative impact on the target
-        df, features = Transformations.invert_features(df, features)
+        df, features = Transformations.invert_features(df, features, transformer)
 
-        # Save data
-        print(interim_data_path)
-        df.to_csv(interim_data_path + 'features.csv')
+        # Ranks, streaks and the other integer features are stored with the smallest integer types
+        if PARAMS.ingestion.compact_dtypes:
+            df = data_utils.downcast_integers(df)
 
-        return df
+        return df, features
 
+    @staticmethod
+    @profiler.profiled()
+    def incremental(df: pd.DataFrame) -> pd.DataFrame:
+        """Build the features of new matches only, resuming from the players' state saved by the last run.
+
+        Only the new matches go through the sweep over the players' history. They are appended to the features saved
+        before transformation by the last run, and the transformations are fitted again on the whole history, as in
+        a full run: features.csv and the transformations are then the same as after a full run on all the matches.
+
+        Args:
+            df (pd.DataFrame): New cleaned matches (see DataCleaner.incremental), all played after the matches
+                already featurized.
+
+        Returns:
+            pd.DataFrame: Features of the new matches, or None if a full run is needed: no saved state, new matches
+                played before the end of the saved history, or a players' dictionary that doesn't continue the
+                saved state's.
+        """
+        features = []
+        features_path = PARAMS.data_path.interim.root_dir + 'features.csv'
+        player_state_path = PARAMS.data_path.processed.root_dir + PARAMS.data_path.processed.player_state
+        players_path = PARAMS.data_path.processed.root_dir + PARAMS.data_path.processed.players
+        transformations_path = PARAMS.logistic_regression.transformations_path
+        history_path = PARAMS.ingestion.history_path
+
+        if not all(os.path.isfile(path) for path in [player_state_path, history_path]):
+            logging.info("No saved players' state to resume from: full run needed")
+            return None
+        if df.empty:
+            return df
+
+        player_state = PlayerStateEngine.load(player_state_path)
+        players = PlayerDictionary.load(players_path)
+        if players.names[:player_state.n_players] != player_state.players.names:
+            logging.info("The players' dictionary doesn't continue the saved players' state: full run needed")
+            return None
+        player_state.players = players
+
+        last_date = player_state.last_date[player_state.seen].max(initial=np.iinfo(np.int64).min)
+        if data_utils.to_ns(df['date']).min() <= last_date:
+            logging.info("New matches played before the end of the saved history: full run needed")
+            return None
+
+        df, features = FeaturesBuilder.build_history(df, features, player_state)
+        n_new = len(df)
+        df = pd.concat([pd.read_parquet(history_path), df])
 
-def build_features_by_steps(df: pd.DataFrame, steps: list = None) -> pd.DataFrame:
-    """
-    Orchestrates the feature-building process.
-
-    Args:
-        df (pd.DataFrame): Input DataFrame.
-        steps (list): List of steps to execute (e.g., ['add_ranks', 'add_odd_ratio']).
-                      If None, all steps are executed.
-    
-    Returns:
-        pd.DataFrame: DataFrame with engineered features.
-    """
-    features = []
-    steps = steps or [
-        "add_ranks",
-        "add_rank_dif",
-        "add_rank_ratio",
-        "add_odd_dif",
-        "add_odd_ratio",
-        "OHE_surface",
-        "add_h2h",
-        "add_consecutive_wins_and_losses",
-        "add_consecutive_results",
-        "add_rank_evolution",
-        "add_rank_combined",
-        "add_records",
-        "logarithmic_transformation",
-        "bin_features",
-        "invert_features",
-    ]
-
-    for step in steps:
-        step_func = getattr(FeaturesBuilder, step)
-        df, features = step_func(df, features)
-
-    return df
+        player_state.save(player_state_path)
+        players.save(players_path)
+        FeaturesBuilder.save_history(df, history_path)
+
+        transformer = FittedTransformer()
+        df, features = FeaturesBuilder.transform(df, features, transformer)
+        transformer.save(transformations_path)
+
+        df.to_csv(features_path)
+        logging.info(f" -> Added the features of {n_new} matches to {features_path}")
+        return df.iloc[len(df) - n_new:]
+
+    @staticmethod
+    def save_history(df: pd.DataFrame, path: str):
+        """Save the features returned by build_history as Parquet, replacing the file atomically."""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        df.to_parquet(f'{path}.tmp')
+        os.replace(f'{path}.tmp', path)
 
 
 if __name__ == "__main__": # Won't be executed when module is imported
@@ -1,8 +1,10 @@
 import logging
 from datetime import datetime
+from pipeline.profiling import profiler
 
 class H2HFeatures():
     @staticmethod
+    @profiler.profiled()
     def add_h2h(dataset, features):
         """Add column 'h2h' to df.
 
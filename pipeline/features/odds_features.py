@@ -1,10 +1,12 @@
 import logging
 import pandas as pd
 from typing import Tuple
+from pipeline.profiling import profiler
 from datetime import datetime
 
 class OddsFeatures():
     @staticmethod
+    @profiler.profiled()
     def add_odd_dif(df: pd.DataFrame, features: list) -> Tuple[pd.DataFrame, list]:
         """Add column 'odd_diff' to df with odd_p2 - odd_p1.
 
@@ -28,6 +30,7 @@ class OddsFeatures():
         return df, features
 
     @staticmethod
+    @profiler.profiled()
     def add_odd_ratio(df: pd.DataFrame, features: list) -> Tuple[pd.DataFrame, list]:
         """Add column 'Odd_ratio' to df with odd_p2 / odd_p1.
 
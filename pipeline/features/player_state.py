@@ -0,0 +1,572 @@
+import logging
+import os
+import numpy as np
+import pandas as pd
+from typing import Tuple
+from pipeline.players import PlayerDictionary
+from pipeline.profiling import profiler
+from libs import data_utils
+from datetime import datetime
+
+
+class H2HTable():
+    """Read-only head-to-head counts held in two arrays: the sorted pair keys and their counts.
+
+    Offers the get() of the dict used by PlayerStateEngine.h2h_counts, with a binary search instead of hashing, and a
+    vectorized lookup(). Unlike a dict of Python ints, whose reference counts are written on every access, arrays
+    memory-mapped from a file are shared by all the processes serving them.
+    """
+    def __init__(self, keys: np.ndarray, counts: np.ndarray):
+        self._keys = keys
+        self._counts = counts
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def keys(self) -> np.ndarray:
+        return self._keys
+
+    def values(self) -> np.ndarray:
+        return self._counts
+
+    def get(self, key: int, default: int = 0) -> int:
+        position = int(np.searchsorted(self._keys, key))
+        if position < len(self._keys) and self._keys[position] == key:
+            return int(self._counts[position])
+        return default
+
+    def lookup(self, keys: np.ndarray) -> np.ndarray:
+        """Return the count of each key, 0 for the keys not in the table."""
+        keys = np.asarray(keys, dtype=np.int64)
+        if not len(self._keys):
+            return np.zeros(len(keys), dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self._keys, keys), len(self._keys) - 1)
+        return np.where(self._keys[positions] == keys, self._counts[positions], 0).astype(np.int64)
+
+
+class PlayerStateEngine():
+    """Single chronological sweep that computes every feature depending on the players' history.
+
+    Replaces the four iterrows loops of H2HFeatures.add_h2h, ResultsFeatures.add_consecutive_wins_and_losses,
+    ResultsFeatures.add_records and RankFeatures.add_rank_evolution. Players are identified by their dense ids in
+    the players' dictionary shared with the cleaning and the serving, and their state is kept in NumPy arrays indexed
+    by id, so the sweep never hashes player names.
+
+    State per player:
+        seen: True once the player has played a match.
+        consecutive_wins / consecutive_losses: current winning and losing streaks.
+        record: total wins - total losses.
+        last_date: date (ns since epoch) of the last match.
+        last_rank: ranking in the last match.
+        last_rank_evol: ranking evolution computed in the last match.
+
+    State per pair of players:
+        h2h_counts: {(winner_id << 32) | loser_id: number of wins of winner over loser}
+
+    The state at the end of the history can be saved with save() and loaded with load(), then kept up to date with
+    update() and queried for upcoming matches with match_features(), both in constant time. For serving from several
+    processes, save_mapped() and load_mapped() give a read-only state whose arrays are memory-mapped and shared.
+    """
+    columns = ['h2h', 'consecutive_wins_p1', 'consecutive_losses_p1', 'consecutive_wins_p2', 'consecutive_losses_p2',
+               'rank_evol_p1', 'rank_evol_p2', 'record_p1', 'record_p2']
+    player_arrays = ['consecutive_wins', 'consecutive_losses', 'record', 'last_date', 'last_rank', 'last_rank_evol']
+
+    def __init__(self, players: PlayerDictionary = None):
+        self.players = players if players is not None else PlayerDictionary()
+        self.seen = np.zeros(0, dtype=bool)
+        self.consecutive_wins = np.zeros(0, dtype=np.int64)
+        self.consecutive_losses = np.zeros(0, dtype=np.int64)
+        self.record = np.zeros(0, dtype=np.int64)
+        self.last_date = np.zeros(0, dtype=np.int64)
+        self.last_rank = np.zeros(0, dtype=np.int64)
+        self.last_rank_evol = np.zeros(0, dtype=np.int64)
+        self.h2h_counts = {}
+        self._reserve()
+
+    @property
+    def n_players(self) -> int:
+        return len(self.players)
+
+    def known(self, player_id: int) -> bool:
+        """Return True if the player has played a match."""
+        return 0 <= player_id < len(self.seen) and bool(self.seen[player_id])
+
+    def rank(self, player_id: int) -> int:
+        """Return the ranking of a player in the player's last match.
+
+        Raises:
+            KeyError: If the player has no history.
+        """
+        if not self.known(player_id):
+            raise KeyError(f"Unknown player id: {player_id}")
+        return int(self.last_rank[player_id])
+
+    def encode_players(self, names: np.ndarray) -> np.ndarray:
+        """Map player names to their ids in the players' dictionary, registering unknown players.
+
+        Args:
+            names (np.ndarray): Player names.
+
+        Returns:
+            np.ndarray: Player ids (int32).
+        """
+        ids = self.players.encode(names)
+        self._reserve()
+        return ids
+
+    def register_player(self, name: str) -> int:
+        """Return the id of a player, registering the player if unknown."""
+        player_id = self.players.add(name)
+        self._reserve()
+        return player_id
+
+    def _reserve(self):
+        """Make room in the per-player state arrays for every player of the dictionary."""
+        if len(self.players) > len(self.seen):
+            self._grow(max(2 * len(self.seen), len(self.players), 1024))
+
+    def _grow(self, capacity: int):
+        """Extend the per-player state arrays to hold capacity players."""
+        missing = capacity - len(self.seen)
+        if missing <= 0:
+            return
+        self.seen = np.concatenate([self.seen, np.zeros(missing, dtype=bool)])
+        for attr in PlayerStateEngine.player_arrays:
+            setattr(self, attr, np.concatenate([getattr(self, attr), np.zeros(missing, dtype=np.int64)]))
+
+    def player_ids(self, df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the ids of the winners and losers of df.
+
+        The winner_id and loser_id columns added by the cleaning are used as they are, as long as they come from
+        the same dictionary as the engine's. Without them, the names are encoded.
+
+        Raises:
+            ValueError: If the id columns refer to players missing from the engine's dictionary.
+        """
+        if 'winner_id' not in df.columns or 'loser_id' not in df.columns:
+            return self.encode_players(df['winner'].to_numpy()), self.encode_players(df['loser'].to_numpy())
+
+        winner_ids = df['winner_id'].to_numpy(dtype=np.int32)
+        loser_ids = df['loser_id'].to_numpy(dtype=np.int32)
+        if len(df) and max(winner_ids.max(), loser_ids.max()) >= len(self.players):
+            raise ValueError("The player ids of the matches don't match the players' dictionary")
+        self._reserve()
+        return winner_ids, loser_ids
+
+    def sweep(self, df: pd.DataFrame) -> dict:
+        """Walk the matches once, in the order of df, and return the history-based features of each row.
+
+        The state of the engine is updated with every match, so consecutive calls continue the history.
+
+        Args:
+            df (pd.DataFrame): Chronologically sorted match data with winner and loser (or winner_id and
+                loser_id), wrank, lrank, rank_p1, winner_is_p1 and date columns.
+
+        Returns:
+            dict: {column: np.ndarray} for every column in PlayerStateEngine.columns, plus
+                'rank_evol_p1_written' and 'rank_evol_p2_written', 'record_p1_written' and 'record_p2_written'
+                masks flagging the rows where the legacy functions wrote a value.
+        """
+        n = len(df)
+        winner_ids, loser_ids = self.player_ids(df)
+        winner_ids, loser_ids = winner_ids.tolist(), loser_ids.tolist()
+        wranks = df['wrank'].to_numpy(dtype=np.int64).tolist()
+        lranks = df['lrank'].to_numpy(dtype=np.int64).tolist()
+        dates = data_utils.to_ns(df['date']).tolist()
+        winner_is_p1 = (df['winner_is_p1'].to_numpy(dtype=np.int64) == 1).tolist()
+
+        # Python lists are much faster than NumPy arrays for scalar access inside the loop
+        seen = self.seen.tolist()
+        wins = self.consecutive_wins.tolist()
+        losses = self.consecutive_losses.tolist()
+        record = self.record.tolist()
+        last_date = self.last_date.tolist()
+        last_rank = self.last_rank.tolist()
+        last_rank_evol = self.last_rank_evol.tolist()
+        h2h_counts = self.h2h_counts
+
+        h2h = [0] * n
+        winner_streak = [0] * n
+        loser_streak = [0] * n
+        winner_evol = [0] * n
+        loser_evol = [0] * n
+        winner_evol_written = [False] * n
+        loser_evol_written = [False] * n
+        winner_record = [0] * n
+        loser_record = [0] * n
+        winner_record_written = [False] * n
+        loser_record_written = [False] * n
+
+        for i in range(n):
+            w = winner_ids[i]
+            l = loser_ids[i]
+            date = dates[i]
+
+            # Head-to-head: previous wins of the winner over the loser minus the opposite
+            key = (w << 32) | l
+            wins_count = h2h_counts.get(key, 0)
+            h2h[i] = wins_count - h2h_counts.get((l << 32) | w, 0)
+            h2h_counts[key] = wins_count + 1
+
+            # Consecutive wins and losses
+            wins[w] += 1
+            losses[l] += 1
+            wins[l] = 0
+            losses[w] = 0
+            winner_streak[i] = wins[w] - 1
+            loser_streak[i] = losses[l] - 1
+
+            # The winner is marked as seen first, so the loser is already seen if both are the same player
+            winner_seen = seen[w]
+            seen[w] = True
+            loser_seen = seen[l]
+            seen[l] = True
+
+            # Ranking evolution, winner first and then loser
+            for player, player_seen, rank, evol, written in ((w, winner_seen, wranks[i], winner_evol, winner_evol_written),
+                                                             (l, loser_seen, lranks[i], loser_evol, loser_evol_written)):
+                if player_seen:
+                    evol[i] = last_rank[player] - rank if date > last_date[player] else last_rank_evol[player]
+                    written[i] = True
+                    last_rank_evol[player] = last_rank[player] - rank
+                else:
+                    last_rank_evol[player] = 0
+                last_date[player] = date
+                last_rank[player] = rank
+
+            # Records (total wins - total losses), winner first and then loser
+            if winner_seen:
+                winner_record[i] = record[w]
+                winner_record_written[i] = True
+            record[w] += 1
+
+            if loser_seen:
+                loser_record[i] = record[l]
+                loser_record_written[i] = True
+            record[l] -= 1
+
+        self.seen = np.array(seen, dtype=bool)
+        self.consecutive_wins = np.array(wins, dtype=np.int64)
+        self.consecutive_losses = np.array(losses, dtype=np.int64)
+        self.record = np.array(record, dtype=np.int64)
+        self.last_date = np.array(last_date, dtype=np.int64)
+        self.last_rank = np.array(last_rank, dtype=np.int64)
+        self.last_rank_evol = np.array(last_rank_evol, dtype=np.int64)
+
+        # Map winner/loser columns to p1/p2 columns
+        winner_is_p1 = np.array(winner_is_p1, dtype=bool)
+        h2h = np.array(h2h, dtype=np.int64)
+        winner_streak = np.array(winner_streak, dtype=np.int64)
+        loser_streak = np.array(loser_streak, dtype=np.int64)
+        winner_evol = np.array(winner_evol, dtype=np.int64)
+        loser_evol = np.array(loser_evol, dtype=np.int64)
+        winner_record = np.array(winner_record, dtype=np.int64)
+        loser_record = np.array(loser_record, dtype=np.int64)
+        winner_evol_written = np.array(winner_evol_written, dtype=bool)
+        loser_evol_written = np.array(loser_evol_written, dtype=bool)
+        winner_record_written = np.array(winner_record_written, dtype=bool)
+        loser_record_written = np.array(loser_record_written, dtype=bool)
+
+        # h2h is signed from p1's point of view, p1 being the player whose ranking is rank_p1
+        p1_is_winner_rank = df['wrank'].to_numpy(dtype=np.int64) == df['rank_p1'].to_numpy(dtype=np.int64)
+
+        return {
+            'h2h': np.where(p1_is_winner_rank, h2h, -h2h),
+            'consecutive_wins_p1': np.where(winner_is_p1, winner_streak, 0),
+            'consecutive_losses_p1': np.where(winner_is_p1, 0, loser_streak),
+            'consecutive_wins_p2': np.where(winner_is_p1, 0, winner_streak),
+            'consecutive_losses_p2': np.where(winner_is_p1, loser_streak, 0),
+            'rank_evol_p1': np.where(winner_is_p1, winner_evol, loser_evol),
+            'rank_evol_p2': np.where(winner_is_p1, loser_evol, winner_evol),
+            'rank_evol_p1_written': np.where(winner_is_p1, winner_evol_written, loser_evol_written),
+            'rank_evol_p2_written': np.where(winner_is_p1, loser_evol_written, winner_evol_written),
+            'record_p1': np.where(winner_is_p1, winner_record, loser_record),
+            'record_p2': np.where(winner_is_p1, loser_record, winner_record),
+            'record_p1_written': np.where(winner_is_p1, winner_record_written, loser_record_written),
+            'record_p2_written': np.where(winner_is_p1, loser_record_written, winner_record_written),
+        }
+
+    def update(self, winner: str, loser: str, wrank: int, lrank: int, date, winner_is_p1: int = 1) -> dict:
+        """Add one match result to the state in constant time.
+
+        Args:
+            winner (str): Name of the winner.
+            loser (str): Name of the loser.
+            wrank (int): Ranking of the winner.
+            lrank (int): Ranking of the loser.
+            date: Date of the match (anything accepted by pd.Timestamp).
+            winner_is_p1 (int, optional): 1 if the winner is P1. Defaults to 1.
+
+        Returns:
+            dict: The features of the match, as sweep() computes them for a row.
+        """
+        w = self.register_player(winner)
+        l = self.register_player(loser)
+        date = pd.Timestamp(date).value
+
+        key = (w << 32) | l
+        wins_count = self.h2h_counts.get(key, 0)
+        h2h = wins_count - self.h2h_counts.get((l << 32) | w, 0)
+        self.h2h_counts[key] = wins_count + 1
+
+        self.consecutive_wins[w] += 1
+        self.consecutive_losses[l] += 1
+        self.consecutive_wins[l] = 0
+        self.consecutive_losses[w] = 0
+        winner_streak = int(self.consecutive_wins[w]) - 1
+        loser_streak = int(self.consecutive_losses[l]) - 1
+
+        winner_seen = bool(self.seen[w])
+        self.seen[w] = True
+        loser_seen = bool(self.seen[l])
+        self.seen[l] = True
+
+        evols = []
+        for player, player_seen, rank in ((w, winner_seen, wrank), (l, loser_seen, lrank)):
+            evol = 0
+            if player_seen:
+                evol = int(self.last_rank[player] - rank if date > self.last_date[player] else self.last_rank_evol[player])
+                self.last_rank_evol[player] = self.last_rank[player] - rank
+            else:
+                self.last_rank_evol[player] = 0
+            self.last_date[player] = date
+            self.last_rank[player] = rank
+            evols.append(evol)
+
+        winner_record = int(self.record[w]) if winner_seen else 0
+        self.record[w] += 1
+        loser_record = int(self.record[l]) if loser_seen else 0
+        self.record[l] -= 1
+
+        rank_p1 = wrank if winner_is_p1 == 1 else lrank
+        winner_is_p1 = winner_is_p1 == 1
+        return {
+            'h2h': h2h if wrank == rank_p1 else -h2h,
+            'consecutive_wins_p1': winner_streak if winner_is_p1 else 0,
+            'consecutive_losses_p1': 0 if winner_is_p1 else loser_streak,
+            'consecutive_wins_p2': 0 if winner_is_p1 else winner_streak,
+            'consecutive_losses_p2': loser_streak if winner_is_p1 else 0,
+            'rank_evol_p1': evols[0] if winner_is_p1 else evols[1],
+            'rank_evol_p2': evols[1] if winner_is_p1 else evols[0],
+            'record_p1': winner_record if winner_is_p1 else loser_record,
+            'record_p2': loser_record if winner_is_p1 else winner_record,
+        }
+
+    def match_features(self, p1: int, p2: int, rank_p1: int = None, rank_p2: int = None, date=None) -> dict:
+        """Compute the history-based features of an upcoming match in constant time, without changing the state.
+
+        As the result is unknown, each player's streaks are the current ones instead of being set from the
+        result as in sweep(). Unknown players have no history.
+
+        Args:
+            p1 (int): Id of P1 in the players' dictionary, -1 if unknown.
+            p2 (int): Id of P2 in the players' dictionary, -1 if unknown.
+            rank_p1 (int, optional): Current ranking of P1. Defaults to the ranking in P1's last match, in which
+                case the ranking evolution is the last one computed for P1.
+            rank_p2 (int, optional): Current ranking of P2. Defaults as rank_p1.
+            date (optional): Date of the match (anything accepted by pd.Timestamp). Defaults to now.
+
+        Returns:
+            dict: {column: value} for every column in PlayerStateEngine.columns.
+        """
+        p1, p2 = int(p1), int(p2)
+        date = pd.Timestamp(date if date is not None else 'now').value
+
+        features = {'h2h': 0}
+        if p1 >= 0 and p2 >= 0:
+            features['h2h'] = self.h2h_counts.get((p1 << 32) | p2, 0) - self.h2h_counts.get((p2 << 32) | p1, 0)
+
+        for player, rank, suffix in ((p1, rank_p1, 'p1'), (p2, rank_p2, 'p2')):
+            if not self.known(player):
+                features.update({f'consecutive_wins_{suffix}': 0, f'consecutive_losses_{suffix}': 0,
+                                 f'rank_evol_{suffix}': 0, f'record_{suffix}': 0})
+                continue
+            features[f'consecutive_wins_{suffix}'] = int(self.consecutive_wins[player])
+            features[f'consecutive_losses_{suffix}'] = int(self.consecutive_losses[player])
+            if rank is None:
+                features[f'rank_evol_{suffix}'] = int(self.last_rank_evol[player])
+            elif date > self.last_date[player]:
+                features[f'rank_evol_{suffix}'] = int(self.last_rank[player] - rank)
+            else:
+                features[f'rank_evol_{suffix}'] = int(self.last_rank_evol[player])
+            features[f'record_{suffix}'] = int(self.record[player])
+
+        return {col: features[col] for col in PlayerStateEngine.columns}
+
+    def match_features_batch(self, ids_1: np.ndarray, ids_2: np.ndarray) -> dict:
+        """Compute the history-based features of a batch of upcoming matches, without changing the state.
+
+        Vectorized version of match_features() with each player's last ranking and ranking evolution.
+
+        Args:
+            ids_1 (np.ndarray): Ids of P1 in the players' dictionary, -1 if unknown.
+            ids_2 (np.ndarray): Ids of P2 in the players' dictionary, -1 if unknown.
+
+        Returns:
+            dict: {column: np.ndarray} for every column in PlayerStateEngine.columns, plus 'rank_p1', 'rank_p2'
+                and 'known', False for the matches where one of the players has no history.
+        """
+        ids = {'p1': np.asarray(ids_1, dtype=np.int64), 'p2': np.asarray(ids_2, dtype=np.int64)}
+        known = (ids['p1'] >= 0) & (ids['p2'] >= 0)
+        known[known] = self.seen[ids['p1'][known]] & self.seen[ids['p2'][known]]
+
+        p1, p2 = ids['p1'][known], ids['p2'][known]
+        features = {'known': known, 'h2h': np.zeros(len(known), dtype=np.int64)}
+        features['h2h'][known] = self.h2h_lookup((p1 << 32) | p2) - self.h2h_lookup((p2 << 32) | p1)
+
+        for suffix, player_ids in ids.items():
+            player_ids = np.where(known, player_ids, 0)
+            for col, array in ((f'consecutive_wins_{suffix}', self.consecutive_wins),
+                               (f'consecutive_losses_{suffix}', self.consecutive_losses),
+                               (f'rank_evol_{suffix}', self.last_rank_evol),
+                               (f'record_{suffix}', self.record),
+                               (f'rank_{suffix}', self.last_rank)):
+                features[col] = np.where(known, array[player_ids], 0)
+
+        return features
+
+    def h2h_lookup(self, keys: np.ndarray) -> np.ndarray:
+        """Return the number of wins for each (winner_id << 32) | loser_id key, 0 for the pairs that never met."""
+        if isinstance(self.h2h_counts, H2HTable):
+            return self.h2h_counts.lookup(keys)
+        h2h_counts = self.h2h_counts
+        return np.fromiter((h2h_counts.get(key, 0) for key in keys.tolist()), dtype=np.int64, count=len(keys))
+
+    def save(self, path: str):
+        """Save the state to a compressed .npz file.
+
+        Args:
+            path (str): Path of the .npz file.
+        """
+        n = self.n_players
+        np.savez_compressed(
+            path,
+            names=np.array(self.players.names, dtype=str),
+            seen=self.seen[:n],
+            h2h_keys=np.fromiter(self.h2h_counts.keys(), dtype=np.int64, count=len(self.h2h_counts)),
+            h2h_counts=np.fromiter(self.h2h_counts.values(), dtype=np.int64, count=len(self.h2h_counts)),
+            **{attr: getattr(self, attr)[:n] for attr in PlayerStateEngine.player_arrays}
+        )
+        logging.info(f"Saved the state of {n} players and {len(self.h2h_counts)} pairs to {path}")
+
+    @classmethod
+    def load(cls, path: str) -> 'PlayerStateEngine':
+        """Load a state saved with save().
+
+        Args:
+            path (str): Path of the .npz file.
+
+        Returns:
+            PlayerStateEngine: Engine continuing the saved history.
+        """
+        with np.load(path) as state:
+            engine = cls(PlayerDictionary(state['names'].tolist()))
+            engine.seen = state['seen'].copy()
+            for attr in PlayerStateEngine.player_arrays:
+                setattr(engine, attr, state[attr].copy())
+            engine.h2h_counts = dict(zip(state['h2h_keys'].tolist(), state['h2h_counts'].tolist()))
+        return engine
+
+    def save_mapped(self, directory: str):
+        """Save the state as uncompressed .npy files that load_mapped() can memory-map.
+
+        Args:
+            directory (str): Directory receiving one file per array and the players' dictionary.
+        """
+        os.makedirs(directory, exist_ok=True)
+        n = self.n_players
+        h2h_keys = np.fromiter(self.h2h_counts.keys(), dtype=np.int64, count=len(self.h2h_counts))
+        h2h_counts = np.fromiter(self.h2h_counts.values(), dtype=np.int64, count=len(self.h2h_counts))
+        order = np.argsort(h2h_keys)
+        arrays = {'seen': self.seen[:n], 'h2h_keys': h2h_keys[order], 'h2h_counts': h2h_counts[order],
+                  **{attr: getattr(self, attr)[:n] for attr in PlayerStateEngine.player_arrays}}
+        for name, array in arrays.items():
+            path = os.path.join(directory, f'{name}.npy')
+            with open(f'{path}.tmp', 'wb') as file:
+                np.save(file, array)
+            os.replace(f'{path}.tmp', path)
+        self.players.save(os.path.join(directory, 'players.json'))
+
+    @classmethod
+    def load_mapped(cls, directory: str) -> 'PlayerStateEngine':
+        """Load a state saved with save_mapped(), with its arrays memory-mapped read-only.
+
+        The pages of the arrays are shared by every process mapping the same files. The state can be queried with
+        match_features() and match_features_batch() but not updated.
+
+        Args:
+            directory (str): Directory written by save_mapped().
+
+        Returns:
+            PlayerStateEngine: Read-only engine.
+        """
+        def load(name):
+            # A plain ndarray view keeps the mapping without the indexing overhead of np.memmap
+            return np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r').view(np.ndarray)
+
+        engine = cls(PlayerDictionary.load(os.path.join(directory, 'players.json')))
+        engine.seen = load('seen')
+        for attr in PlayerStateEngine.player_arrays:
+            setattr(engine, attr, load(attr))
+        engine.h2h_counts = H2HTable(load('h2h_keys'), load('h2h_counts'))
+        return engine
+
+    @staticmethod
+    def broadcast_duplicate_labels(index: pd.Index, values: np.ndarray, written: np.ndarray = None) -> np.ndarray:
+        """Reproduce the label-based write-back of the legacy loops on an index with duplicate labels.
+
+        The legacy functions write with df.loc/df.at, which set every row sharing the label. Each row therefore
+        ends up with the value of the last row of its label where a value was written (0 if there is none).
+
+        Args:
+            index (pd.Index): Index of the DataFrame, in sweep order.
+            values (np.ndarray): Value computed for each row.
+            written (np.ndarray, optional): Mask of the rows where the legacy function wrote a value.
+                Defaults to every row.
+
+        Returns:
+            np.ndarray: Values as the legacy functions would have left them.
+        """
+        if written is None:
+            written = np.ones(len(values), dtype=bool)
+        if not index.has_duplicates:
+            return np.where(written, values, 0)
+
+        codes, uniques = pd.factorize(index)
+        last_written = np.full(len(uniques), -1, dtype=np.int64)
+        positions = np.flatnonzero(written)
+        np.maximum.at(last_written, codes[positions], positions)
+
+        source = last_written[codes]
+        return np.where(source >= 0, values[np.maximum(source, 0)], 0)
+
+    @staticmethod
+    @profiler.profiled()
+    def add_player_state(df: pd.DataFrame, features: list, engine: 'PlayerStateEngine' = None) -> Tuple[pd.DataFrame, list]:
+        """Add columns 'h2h', consecutive wins and losses, rankings' evolution and records to df in one sweep.
+
+        Args:
+            df (pd.DataFrame): Chronologically sorted DataFrame containing match data.
+            features (list): List to store feature names.
+            engine (PlayerStateEngine, optional): Engine to sweep with, holding the state at the end of df
+                afterwards. Defaults to a new engine.
+
+        Returns:
+            Tuple[pd.DataFrame, list]: DataFrame with added columns and updated features list.
+        """
+        begin_time = datetime.now()
+
+        logging.info("Adding h2h, consecutives wins and losses, ranking evolution and players' records...")
+
+        engine = engine if engine is not None else PlayerStateEngine()
+        state = engine.sweep(df)
+
+        df = df.copy()
+        for col in PlayerStateEngine.columns:
+            df[col] = PlayerStateEngine.broadcast_duplicate_labels(df.index, state[col], state.get(f'{col}_written'))
+
+        features.extend(PlayerStateEngine.columns)
+        end_time = datetime.now()
+        logging.info(f" -> Added h2h, consecutives wins and losses, ranking evolution and players' records. ({(end_time-begin_time).total_seconds()})")
+
+        return df, features
@@ -1,10 +1,13 @@
 import logging
+import numpy as np
 import pandas as pd
 from typing import Tuple
+from pipeline.profiling import profiler
 from datetime import datetime
 
 class RankFeatures():
     @staticmethod
+    @profiler.profiled()
     def add_ranks(df: pd.DataFrame, features: list) -> Tuple[pd.DataFrame, list]:
         """For each row, get the ranking of P1 and P2.
 
@@ -18,8 +21,8 @@ class RankFeatures():
         begin_time = datetime.now()
         logging.info("Adding player's rankings...")
         
-        df['rank_p1'] = df.apply(lambda row: row['wrank'] if row['winner_is_p1'] == 1 else row['lrank'], axis=1)
-        df['rank_p2'] = df.apply(lambda row: row['wrank'] if row['winner_is_p1'] == 0 else row['lrank'], axis=1)
+        df['rank_p1'] = np.where(df['winner_is_p1'] == 1, df['wrank'].to_numpy(), df['lrank'].to_numpy())
+        df['rank_p2'] = np.where(df['winner_is_p1'] == 0, df['wrank'].to_numpy(), df['lrank'].to_numpy())
 
         features.extend(['rank_p1', 'rank_p2'])
 
@@ -28,6 +31,7 @@ class RankFeatures():
         return df, features
 
     @staticmethod
+    @profiler.profiled()
     def add_rank_dif(df: pd.DataFrame, features: list) -> Tuple[pd.DataFrame, list]:
         """Add column 'rank_diff' to df with rank_p2 - rank_p1.
 
@@ -52,6 +56,7 @@ class RankFeatures():
 
 
     @staticmethod
+    @profiler.profiled()
     def add_rank_ratio(df: pd.DataFrame, features: list) -> Tuple[pd.DataFrame, list]:
         """Add column 'rank_ratio' to df with rank_p2 / rank_p1.
 
@@ -76,6 +81,7 @@ class RankFeatures():
 
 
     @staticmethod
+    @profiler.profiled()
     def add_rank_evolution(df: pd.DataFrame, features: list) -> Tuple[pd.DataFrame, list]:
         """Apply update_rank_evol_and_df for each player.
 
@@ -125,6 +131,7 @@ class RankFeatures():
         return df, features
 
     @staticmethod
+    @profiler.profiled()
     def add_rank_combined(df: pd.DataFrame, features: list) -> Tuple[pd.DataFrame, list]:
         """Add columns for the combined rankings and rankings evolution.
 
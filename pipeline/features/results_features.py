@@ -1,10 +1,12 @@
 import logging
 import pandas as pd
 from typing import Tuple
+from pipeline.profiling import profiler
 from datetime import datetime
 
 class ResultsFeatures():
     @staticmethod
+    @profiler.profiled()
     def add_consecutive_wins_and_losses(df: pd.DataFrame, features: list) -> Tuple[pd.DataFrame, list]:
         """Add columns for the consecutives wins and losses for each player.
 
@@ -65,6 +67,7 @@ class ResultsFeatures():
 
 
     @staticmethod
+    @profiler.profiled()
     def add_consecutive_results(df: pd.DataFrame, features: list) -> Tuple[pd.DataFrame, list]:
         """Add columns for the consecutives results for each couple of players.
 
@@ -89,6 +92,7 @@ class ResultsFeatures():
 
 
     @staticmethod
+    @profiler.profiled()
     def add_records(df: pd.DataFrame, features: list) -> Tuple[pd.DataFrame, list]:
         """Add columns for players' records.
 
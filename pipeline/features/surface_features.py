@@ -3,9 +3,14 @@ import logging
 import pandas as pd
 from datetime import datetime
 from typing import Tuple
+from pipeline.profiling import profiler
 
 class SurfaceFeatures():
+    # Surfaces always encoded, even when a batch of matches (e.g. an incremental run) doesn't have all of them
+    surfaces = ['Clay', 'Grass', 'Hard']
+
     @staticmethod
+    @profiler.profiled()
     def OHE_surface(df: pd.DataFrame, features: list) -> Tuple[pd.DataFrame, list]:
         """Replace column 'Surface' with one-hot encoded columns.
 
@@ -21,12 +26,19 @@ class SurfaceFeatures():
         logging.info("One-hot-encoding surface...")
 
         try:
+            # Categories can't be merged with replace, so compact (categorical) surfaces are converted back first
+            if isinstance(df['surface'].dtype, pd.CategoricalDtype):
+                df['surface'] = df['surface'].astype(object)
+
             # Replace Carpet per Grass (same surface)
             df['surface'] = df['surface'].replace({'Carpet': 'Grass'})
             df['surface'] = df['surface'].replace({'Greenset': 'Grass'})
 
             # One hot encoding 'Surface column
             df = pd.get_dummies(df, columns=['surface'], prefix='surface')
+            for surface in SurfaceFeatures.surfaces:
+                if f'surface_{surface}' not in df.columns:
+                    df[f'surface_{surface}'] = 0
             # Convert the columns containing 'surface_' to 0 and 1
             df[df.filter(like='surface_').columns] = df.filter(like='surface_').astype(int)
 
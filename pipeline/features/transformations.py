@@ -1,71 +1,204 @@
+import json
 import logging
+import os
 import pandas as pd
 import numpy as np
+from pipeline.profiling import profiler
+
+
+class FittedTransformer():
+    """Transformations learned once on the training features and applied unchanged to new matches.
+
+    The shifts of the logaritmic transformation and the bin boundaries are fitted on the training data, saved next
+    to the model and loaded at prediction time, so that training and serving transform the features the same way.
+    """
+    skewed_features = ['rank_p1', 'rank_p2', 'rank_ratio', 'odd_diff', 'odd_ratio', 'record_p1', 'record_p2']
+    binning_features = {'rank_diff': 14,
+                        'h2h': 2,
+                        'rank_evol_p1': 2,
+                        'rank_evol_p2': 2,
+                        'rank_combined': 14}
+    inverse_features = ['log_rank_p1']
+
+    def __init__(self, log_shift: dict = None, bin_boundaries: dict = None):
+        self.log_shift = dict(log_shift or {})
+        self.bin_boundaries = dict(bin_boundaries or {})
+
+    def fit_log_shift(self, df: pd.DataFrame) -> 'FittedTransformer':
+        """Learn the shift that makes each skewed feature strictly positive before the logaritmic transformation."""
+        minimums = df[self.skewed_features].min()
+        self.log_shift = {col: 1.0 if minimums[col] == 0 else float(1 + abs(minimums[col])) for col in self.skewed_features}
+        return self
+
+    def log_transform(self, x):
+        """Add log_<feature> for every skewed feature, shifted and transformed in a single NumPy operation.
+
+        Args:
+            x (pd.DataFrame | dict): Features, as a DataFrame or as {column: array}.
+
+        Returns:
+            pd.DataFrame | dict: x with the log_<feature> columns added.
+        """
+        columns = list(self.log_shift)
+        values = np.column_stack([np.asarray(x[col], dtype=np.float64) for col in columns])
+        logs = np.log(values + np.array([self.log_shift[col] for col in columns]))
+        for i, col in enumerate(columns):
+            x[f'log_{col}'] = logs[:, i]
+        return x
+
+    def fit_bin_boundaries(self, df: pd.DataFrame) -> 'FittedTransformer':
+        """Learn the quantile boundaries of each binned feature."""
+        for col, bin in self.binning_features.items():
+            quantiles = np.linspace(0, 100, bin+1)
+            self.bin_boundaries[col] = np.percentile(df[col], quantiles).tolist()
+        return self
+
+    def bin(self, x):
+        """Add <feature>_binned for every binned feature, using the fitted boundaries.
+
+        Same bins as pd.cut(..., include_lowest=True); values out of the fitted range go to the closest bin.
+        """
+        for col, boundaries in self.bin_boundaries.items():
+            bins = np.digitize(np.asarray(x[col]), boundaries, right=True) - 1
+            x[f'{col}_binned'] = np.clip(bins, 0, len(boundaries) - 2)
+        return x
+
+    @staticmethod
+    def threshold_streaks(x):
+        """Convert the consecutive results into binned features based on the previous vizualisation."""
+        cw_p1, cl_p2 = np.asarray(x['consecutive_wins_p1']), np.asarray(x['consecutive_losses_p2'])
+        x['consecutive_wins_p1'] = np.select([cw_p1 < 0, cw_p1 <= 1], [0, 0.5], 1)
+        x['consecutive_losses_p2'] = np.select([cl_p2 < 0.9, cl_p2 <= 1.1], [0, 0.5], 1)
+        x['consecutive_results'] = np.select([np.asarray(x['consecutive_results']) < 1], [0], 1)
+        x['consecutive_wins_p2'] = np.select([np.asarray(x['consecutive_wins_p2']) > 1], [0], 1)
+        x['consecutive_losses_p1'] = np.select([np.asarray(x['consecutive_losses_p1']) >= 1], [0], 1)
+        return x
+
+    def invert(self, x):
+        """Add inverted_<feature> for every feature with a negative impact on the target."""
+        for col in self.inverse_features:
+            x[f'inverted_{col}'] = 1 / np.asarray(x[col], dtype=np.float64)
+        return x
+
+    def to_dict(self) -> dict:
+        return {'log_shift': self.log_shift, 'bin_boundaries': self.bin_boundaries}
+
+    def save(self, path: str):
+        """Save the fitted transformations as JSON, replacing the file atomically."""
+        with open(f'{path}.tmp', 'w') as file:
+            json.dump(self.to_dict(), file, indent=4)
+        os.replace(f'{path}.tmp', path)
+        logging.info(f"Fitted transformations saved to {path}")
+
+    @classmethod
+    def load(cls, path: str) -> 'FittedTransformer':
+        with open(path) as file:
+            return cls(**json.load(file))
+
 
 class Transformations():
     @staticmethod
-    def logaritmic_trasformation(df: pd.DataFrame, features: list):
+    @profiler.profiled()
+    def logaritmic_trasformation(df: pd.DataFrame, features: list, transformer: FittedTransformer = None):
 
-        skewed_features = ['rank_p1', 'rank_p2', 'rank_ratio', 'odd_diff', 'odd_ratio', 'record_p1', 'record_p2']
+        # Learn the shifts on this data unless they were already fitted
+        if transformer is None:
+            transformer = FittedTransformer()
+        if not transformer.log_shift:
+            transformer.fit_log_shift(df)
 
         # Apply logaritmic trasformation to skewed features
-        for col in skewed_features:
-            if df[col].min() == 0:
-                df[col] = df[col].apply(lambda x: x + 1)
-            else:
-                df[col] = df[col].apply(lambda x: x + 1 + abs(df[col].min()))
-            df[f'log_{col}'] = df[col].apply(lambda x: np.log(x))
-
-            # Updating features list
+        df = transformer.log_transform(df)
+
+        # Updating features list
+        for col in transformer.skewed_features:
             i = features.index(col)
             features[i] = f'log_{col}'
 
-        return df.drop(columns=skewed_features), features
+        return df.drop(columns=transformer.skewed_features), features
     
     @staticmethod
-    def bin_features(df: pd.DataFrame, features: list):
+    @profiler.profiled()
+    def bin_features(df: pd.DataFrame, features: list, transformer: FittedTransformer = None):
         
-        binning_features = {'rank_diff': 14,
-                            'h2h': 2,
-                            'rank_evol_p1': 2,
-                            'rank_evol_p2': 2,
-                            'rank_combined': 14}
-
-        # Iterate over each feature in binning_features
-        for col, bin in binning_features.items():
-            # Calculate quantile boundaries
-            quantiles = np.linspace(0, 100, bin+1)
-            bin_boundaries = np.percentile(df[col], quantiles)
-
-            # Apply binning transformation
-            df[f'{col}_binned'] = pd.cut(df[col], bins=bin_boundaries, labels=False, include_lowest=True)
+        # Calculate quantile boundaries on this data unless they were already fitted
+        if transformer is None:
+            transformer = FittedTransformer()
+        if not transformer.bin_boundaries:
+            transformer.fit_bin_boundaries(df)
 
-            binning_features[col] = (bin, (bin_boundaries))
+        # Apply binning transformation
+        df = transformer.bin(df)
 
+        for col in transformer.binning_features:
             i = features.index(col) 
             features[i] = f'{col}_binned'
         
-        df = df.drop(columns=binning_features)
+        df = df.drop(columns=list(transformer.binning_features))
 
         # Convert into a binned feature based on the previous vizualisation
-        df['consecutive_wins_p1'] = df['consecutive_wins_p1'].apply(lambda x: 0 if x < 0 else (0.5 if 0 <= x <= 1 else 1))          
-        df['consecutive_losses_p2'] = df['consecutive_losses_p2'].apply(lambda x: 0 if x < 0.9 else (0.5 if 0.9 <= x <= 1.1 else 1))
-        df['consecutive_results'] = df['consecutive_results'].apply(lambda x: 0 if x < 1 else 1)
-        df['consecutive_wins_p2'] = df['consecutive_wins_p2'].apply(lambda x: 0 if x > 1 else 1)
-        df['consecutive_losses_p1'] = df['consecutive_losses_p1'].apply(lambda x: 0 if x >= 1 else 1)
+        df = transformer.threshold_streaks(df)
 
         unclear_association_features =  ['log_rank_p2', 'log_rank_ratio', 'log_odd_diff', 'log_record_p1', 'log_record_p2']
         
         return df.drop(columns=unclear_association_features), features
     
     @staticmethod
-    def invert_features(df: pd.DataFrame, features: list):
+    @profiler.profiled()
+    def invert_features(df: pd.DataFrame, features: list, transformer: FittedTransformer = None):
         # Invert features that have a negative impact 
-        inverse_features = ['log_rank_p1']
+        transformer = transformer or FittedTransformer()
+        df = transformer.invert(df)
 
-        for col in inverse_features:
-            df[f'inverted_{col}'] = 1 / df[col]
+        for col in transformer.inverse_features:
             i = features.index(col) 
             features[i] = f'inverted_{col}'
 
-        return df.drop(columns=inverse_features), features
\ No newline at end of file
+        return df.drop(columns=transformer.inverse_features), features
+
+    @staticmethod
+    def transform_matches(matches: dict, transformer: FittedTransformer) -> dict:
+        """Build the model features of a batch of matches, transformed as in training.
+
+        Args:
+            matches (dict): {column: array} with rank_p1, rank_p2, odd_p1, odd_p2, surface and the
+                PlayerStateEngine columns of the matches (a DataFrame works too).
+            transformer (FittedTransformer): Shifts and bin boundaries fitted on the training features.
+
+        Returns:
+            dict: {feature: np.ndarray} with every feature of the model.
+        """
+        x = {col: np.asarray(matches[col]) for col in matches}
+        x['rank_diff'] = x['rank_p2'] - x['rank_p1']
+        x['rank_ratio'] = x['rank_p2'] / x['rank_p1']
+        x['odd_diff'] = x['odd_p2'] - x['odd_p1']
+        x['odd_ratio'] = x['odd_p2'] / x['odd_p1']
+        x['consecutive_results'] = x['consecutive_wins_p1'] - x['consecutive_wins_p2'] - x['consecutive_losses_p1'] + x['consecutive_losses_p2']
+        x['rank_combined'] = - x['rank_p1'] + x['rank_p2'] + x['rank_evol_p1'] - x['rank_evol_p2']
+
+        # One-hot encoded surface (Carpet and Greenset are played as Grass)
+        surface = np.where(np.isin(x['surface'], ['Carpet', 'Greenset']), 'Grass', x['surface'])
+        for name in ['Clay', 'Hard', 'Grass']:
+            x[f'surface_{name}'] = (surface == name).astype(np.int64)
+
+        x = transformer.log_transform(x)
+
+        x = transformer.bin(x)
+        x = transformer.threshold_streaks(x)
+        x = transformer.invert(x)
+
+        return x
+
+    @staticmethod
+    def transform_match(match: dict, transformer: FittedTransformer) -> dict:
+        """Build the model features of a single match, transformed as in training.
+
+        Args:
+            match (dict): rank_p1, rank_p2, odd_p1, odd_p2, surface and the PlayerStateEngine columns of the match.
+            transformer (FittedTransformer): Shifts and bin boundaries fitted on the training features.
+
+        Returns:
+            dict: {feature: value} with every feature of the model.
+        """
+        features = Transformations.transform_matches({col: [value] for col, value in match.items()}, transformer)
+        return {col: values[0].item() if isinstance(values[0], np.generic) else values[0] for col, values in features.items()}
@@ -0,0 +1,109 @@
+import json
+import logging
+import os
+import numpy as np
+from libs import data_utils
+
+
+class IngestionManifest():
+    """Raw files already ingested by the cleaning, and the hash index of the matches cleaned from them.
+
+    Each file is recorded with its size, modification time, content hash and number of rows. A file whose size and modification time
+    did not change is not read again. Otherwise its hash tells whether it changed at all and, if it did, whether lines
+    were only appended to it (its previous content is a prefix of the new one): only then can its new matches be
+    ingested on top of the previous ones. The hash index holds a hash of every cleaned match, so that the matches
+    read again from a file that grew, or found in several files, are ingested once.
+
+    Statuses returned by changes(): 'unchanged', 'new', 'appended', 'rewritten' and 'removed'.
+    """
+    def __init__(self, key: str = None, files: dict = None, hashes: np.ndarray = None, next_index: int = 0):
+        self.key = key
+        self.files = dict(files or {})
+        self.hashes = hashes if hashes is not None else np.zeros(0, dtype=np.uint64)
+        self.next_index = next_index
+
+    @property
+    def n_matches(self) -> int:
+        return len(self.hashes)
+
+    def changes(self, file_paths: list) -> dict:
+        """Compare files with the manifest.
+
+        Args:
+            file_paths (list): Raw files currently found.
+
+        Returns:
+            dict: {file path: status} for the given files and the recorded files that no longer exist.
+        """
+        statuses = {file_path: 'removed' for file_path in self.files if file_path not in file_paths}
+        for file_path in file_paths:
+            entry = self.files.get(file_path)
+            if entry is None:
+                statuses[file_path] = 'new'
+                continue
+
+            stat = os.stat(file_path)
+            if stat.st_size == entry['size'] and stat.st_mtime_ns == entry['mtime_ns']:
+                statuses[file_path] = 'unchanged'
+            elif stat.st_size == entry['size'] and data_utils.file_hash(file_path) == entry['hash']:
+                # Touched but not modified: remember the new modification time to skip hashing it next time
+                entry['mtime_ns'] = stat.st_mtime_ns
+                statuses[file_path] = 'unchanged'
+            elif stat.st_size > entry['size'] and self._is_appended(file_path, entry):
+                statuses[file_path] = 'appended'
+            else:
+                statuses[file_path] = 'rewritten'
+        return statuses
+
+    @staticmethod
+    def _is_appended(file_path: str, entry: dict) -> bool:
+        """True if the recorded content of the file is a prefix of its content, ending with a complete line."""
+        if data_utils.file_hash(file_path, size=entry['size']) != entry['hash']:
+            return False
+        if entry['size'] == 0:
+            return True
+        with open(file_path, 'rb') as file:
+            file.seek(entry['size'] - 1)
+            return file.read(1) == b'\n'
+
+    def record(self, file_path: str, rows: int):
+        """Record the current size, modification time and hash of a file, and the number of rows read from it."""
+        stat = os.stat(file_path)
+        self.files[file_path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                                 'hash': data_utils.file_hash(file_path), 'rows': int(rows)}
+
+    def ingested(self, hashes: np.ndarray) -> np.ndarray:
+        """Return a mask of the matches already in the hash index."""
+        return np.isin(hashes, self.hashes)
+
+    def add(self, hashes: np.ndarray):
+        """Add the hashes of newly ingested matches to the hash index."""
+        self.hashes = np.concatenate([self.hashes, np.asarray(hashes, dtype=np.uint64)])
+
+    def save(self, manifest_path: str, hash_index_path: str):
+        """Save the manifest as JSON and the hash index as .npy, replacing both files atomically."""
+        for path in (manifest_path, hash_index_path):
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+        with open(f'{hash_index_path}.tmp', 'wb') as file:
+            np.save(file, self.hashes)
+        os.replace(f'{hash_index_path}.tmp', hash_index_path)
+
+        with open(f'{manifest_path}.tmp', 'w') as file:
+            json.dump({'key': self.key, 'next_index': self.next_index, 'n_matches': self.n_matches,
+                       'files': self.files}, file, indent=4)
+        os.replace(f'{manifest_path}.tmp', manifest_path)
+        logging.info(f"Saved the manifest of {len(self.files)} files and {self.n_matches} matches to {manifest_path}")
+
+    @classmethod
+    def load(cls, manifest_path: str, hash_index_path: str) -> 'IngestionManifest':
+        """Load a manifest saved with save(), or start an empty one if it is missing or incomplete."""
+        if not os.path.isfile(manifest_path) or not os.path.isfile(hash_index_path):
+            return cls()
+        with open(manifest_path) as file:
+            manifest = json.load(file)
+        hashes = np.load(hash_index_path)
+        if len(hashes) != manifest['n_matches']:
+            logging.warning(f"The hash index {hash_index_path} doesn't match the manifest {manifest_path}, ignoring both")
+            return cls()
+        return cls(manifest['key'], manifest['files'], hashes, manifest['next_index'])
@@ -0,0 +1,241 @@
+import fcntl
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+
+def run_training(events: multiprocessing.Queue, stage_name: str = None, force: bool = False):
+    """Run the pipeline in a training process, sending its progress through events.
+
+    Args:
+        events (multiprocessing.Queue): Queue receiving (stage name, event, seconds) tuples, and ('', 'error', message)
+            if the pipeline fails.
+        stage_name (str, optional): Name of the stage to execute. If None, all stages are executed in order.
+        force (bool): Run the stage(s) even if their inputs did not change.
+    """
+    import main
+
+    try:
+        main.main(stage_name=stage_name, progress=lambda stage, event, seconds: events.put((stage, event, seconds)),
+                  force=force)
+    except Exception as e:
+        events.put(('', 'error', str(e)))
+        raise
+
+
+def pid_alive(pid: int) -> bool:
+    """Return True if a process with this pid exists."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class TrainingJob():
+    """State of a training process, updated from its progress events."""
+    def __init__(self, job_id: str, stages: list):
+        self.job_id = job_id
+        self.status = 'running'
+        self.stages = {stage: {'status': 'pending', 'seconds': None} for stage in stages}
+        self.error = None
+        self.created_at = datetime.now()
+        self.finished_at = None
+        self.pid = None
+        self.owner_pid = None
+        self.cancel_requested = False
+
+    @property
+    def progress(self) -> float:
+        """Fraction of the stages completed or skipped."""
+        completed = sum(stage['status'] in ('completed', 'skipped') for stage in self.stages.values())
+        return completed / len(self.stages) if self.stages else 1.0
+
+    def to_dict(self) -> dict:
+        return {
+            'job_id': self.job_id,
+            'status': self.status,
+            'progress': self.progress,
+            'stages': self.stages,
+            'error': self.error,
+            'created_at': self.created_at.isoformat(),
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+    def to_record(self) -> dict:
+        """State saved in the job store."""
+        return {**self.to_dict(), 'pid': self.pid, 'owner_pid': self.owner_pid, 'cancel_requested': self.cancel_requested}
+
+    @classmethod
+    def from_record(cls, record: dict) -> 'TrainingJob':
+        job = cls(record['job_id'], [])
+        job.status = record['status']
+        job.stages = record['stages']
+        job.error = record['error']
+        job.created_at = datetime.fromisoformat(record['created_at'])
+        job.finished_at = datetime.fromisoformat(record['finished_at']) if record['finished_at'] else None
+        job.pid = record['pid']
+        job.owner_pid = record['owner_pid']
+        job.cancel_requested = record['cancel_requested']
+        return job
+
+
+class TrainingJobs():
+    """Run main.main() in background processes so that the API keeps serving while a model is trained.
+
+    Only one job runs at a time, as every run writes the same data and model files. The jobs are kept in a JSON store
+    shared by every worker serving the API (see pipeline.serving), read and written under an exclusive lock on a
+    lock file: whichever worker receives a request sees the same jobs, and the one-job-at-a-time rule holds across
+    workers. Each job is watched by a thread of the worker that started it, which records the status and duration
+    of each stage. A running job left behind by a worker that no longer exists (e.g. killed) is marked as failed once
+    its process has exited too.
+    """
+    def __init__(self, stages: list, store_path: str):
+        self.stages = stages
+        self.store_path = store_path
+        self._context = multiprocessing.get_context('spawn')
+
+    @contextmanager
+    def _store(self, write: bool = True):
+        """Yield the {job_id: TrainingJob} of the store, holding the lock, and save them back if write."""
+        os.makedirs(os.path.dirname(self.store_path) or '.', exist_ok=True)
+        with open(f'{self.store_path}.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                jobs = {}
+                if os.path.isfile(self.store_path):
+                    with open(self.store_path) as file:
+                        jobs = {job_id: TrainingJob.from_record(record) for job_id, record in json.load(file).items()}
+                write = self._reap(jobs) or write
+                yield jobs
+                if write:
+                    with open(f'{self.store_path}.tmp', 'w') as file:
+                        json.dump({job_id: job.to_record() for job_id, job in jobs.items()}, file, indent=4)
+                    os.replace(f'{self.store_path}.tmp', self.store_path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _reap(jobs: dict) -> bool:
+        """Mark the running jobs whose worker and process are gone as failed. Return True if a job was updated."""
+        reaped = False
+        for job in jobs.values():
+            if job.status == 'running' and not pid_alive(job.owner_pid) and not pid_alive(job.pid):
+                job.status = 'failed'
+                job.error = job.error or "The worker watching the training process exited"
+                job.finished_at = datetime.now()
+                reaped = True
+        return reaped
+
+    @property
+    def jobs(self) -> dict:
+        """{job_id: TrainingJob} of every job started so far."""
+        with self._store(write=False) as jobs:
+            return jobs
+
+    def running(self) -> TrainingJob:
+        """Return the running job, if any."""
+        return next((job for job in self.jobs.values() if job.status == 'running'), None)
+
+    def start(self, stage_name: str = None, force: bool = False) -> TrainingJob:
+        """Start a training process.
+
+        Args:
+            stage_name (str, optional): Name of the stage to execute. If None, all stages are executed in order.
+            force (bool): Run the stage(s) even if their inputs did not change.
+
+        Raises:
+            RuntimeError: If a job is already running.
+            ValueError: If stage_name is not a stage of the pipeline.
+
+        Returns:
+            TrainingJob: The started job.
+        """
+        if stage_name is not None and stage_name not in self.stages:
+            raise ValueError(f"Invalid stage name: {stage_name}. Valid options: {self.stages}")
+
+        with self._store() as jobs:
+            running_job = next((job for job in jobs.values() if job.status == 'running'), None)
+            if running_job is not None:
+                raise RuntimeError(f"Training job {running_job.job_id} is already running")
+
+            job = TrainingJob(uuid.uuid4().hex, [stage_name] if stage_name else self.stages)
+            events = self._context.Queue()
+            process = self._context.Process(target=run_training, args=(events, stage_name, force), daemon=True)
+            process.start()
+            job.pid = process.pid
+            job.owner_pid = os.getpid()
+            jobs[job.job_id] = job
+
+        threading.Thread(target=self._watch, args=(job.job_id, process, events), daemon=True).start()
+        logging.info(f"Started training job {job.job_id} (pid {job.pid})")
+        return job
+
+    def cancel(self, job_id: str) -> TrainingJob:
+        """Terminate a running training process, whichever worker started it.
+
+        Raises:
+            KeyError: If the job does not exist.
+
+        Returns:
+            TrainingJob: The job.
+        """
+        with self._store() as jobs:
+            job = jobs[job_id]
+            if job.status == 'running':
+                job.cancel_requested = True
+                try:
+                    os.kill(job.pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+                logging.info(f"Cancelling training job {job_id}")
+        return job
+
+    def _update(self, job_id: str, update):
+        """Apply update(job) to a job of the store."""
+        with self._store() as jobs:
+            update(jobs[job_id])
+
+    def _watch(self, job_id: str, process: multiprocessing.Process, events: multiprocessing.Queue):
+        """Record the progress events of a job until its process exits."""
+        while True:
+            try:
+                stage, event, value = events.get(timeout=0.5)
+            except queue.Empty:
+                if not process.is_alive():
+                    break
+                continue
+
+            if event == 'error':
+                self._update(job_id, lambda job: setattr(job, 'error', value))
+            else:
+                status = {'status': 'running' if event == 'started' else event, 'seconds': value}
+                self._update(job_id, lambda job: job.stages.__setitem__(stage, status))
+
+        process.join()
+
+        def finish(job: TrainingJob):
+            job.finished_at = datetime.now()
+            for stage in job.stages.values():
+                if stage['status'] == 'running':
+                    stage['status'] = 'cancelled' if job.cancel_requested else 'failed'
+
+            if job.cancel_requested:
+                job.status = 'cancelled'
+            elif process.exitcode == 0 and job.error is None:
+                job.status = 'completed'
+            else:
+                job.status = 'failed'
+                job.error = job.error or f"Training process exited with code {process.exitcode}"
+            logging.info(f"Training job {job.job_id} {job.status}")
+
+        self._update(job_id, finish)
@@ -0,0 +1,158 @@
+import bisect
+import glob
+import json
+import logging
+import os
+import time
+from datetime import datetime
+
+# Upper bounds of the request latency buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def format_labels(labels: dict) -> str:
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + '}'
+
+
+def format_family(name: str, kind: str, description: str, samples: list) -> list:
+    """Lines of a metric family in the Prometheus text exposition format.
+
+    Args:
+        name (str): Metric name.
+        kind (str): 'counter', 'gauge' or 'histogram'.
+        description (str): Help text.
+        samples (list): (suffix, labels, value) tuples, e.g. ('_bucket', {'le': '0.1'}, 3) for a histogram.
+
+    Returns:
+        list: Lines of the family, without trailing newlines.
+    """
+    lines = [f'# HELP {name} {description}', f'# TYPE {name} {kind}']
+    for suffix, labels, value in samples:
+        lines.append(f'{name}{suffix}{format_labels(labels)} {float(value)!r}' if value is not None
+                     else f'{name}{suffix}{format_labels(labels)} NaN')
+    return lines
+
+
+class Histogram():
+    """Counts of observations per bucket. Observing is a bisection and three additions, without locking."""
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float, count: int = 1):
+        self.counts[bisect.bisect_left(self.buckets, value)] += count
+        self.sum += value * count
+        self.count += count
+
+    def samples(self, labels: dict = None) -> list:
+        """(suffix, labels, value) samples with cumulative buckets, as expected by format_family."""
+        labels = labels or {}
+        samples, cumulative = [], 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            samples.append(('_bucket', {**labels, 'le': '+Inf' if bound == float('inf') else repr(float(bound))}, cumulative))
+        samples += [('_sum', labels, self.sum), ('_count', labels, self.count)]
+        return samples
+
+
+class RequestMetrics():
+    """Latency, status and in-flight count of the HTTP requests, recorded by MetricsMiddleware.
+
+    Requests are labelled with their route template (e.g. /train/{job_id}) rather than their path, so that the number
+    of series stays bounded. The counters are only updated from the event loop, between awaits, so no lock is needed.
+    """
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.latency = {}  # (method, route): Histogram
+        self.responses = {}  # (method, route, status): count
+        self.in_flight = 0
+
+    def observe(self, method: str, route: str, status: int, seconds: float):
+        histogram = self.latency.get((method, route))
+        if histogram is None:
+            histogram = self.latency[(method, route)] = Histogram(self.buckets)
+        histogram.observe(seconds)
+        self.responses[(method, route, status)] = self.responses.get((method, route, status), 0) + 1
+
+    def collect(self) -> list:
+        """Lines of the request metrics."""
+        latency = [sample for (method, route), histogram in list(self.latency.items())
+                   for sample in histogram.samples({'method': method, 'route': route})]
+        responses = [('', {'method': method, 'route': route, 'status': status}, count)
+                     for (method, route, status), count in list(self.responses.items())]
+        return (format_family('http_request_duration_seconds', 'histogram', 'Latency of the HTTP requests.', latency)
+                + format_family('http_responses_total', 'counter', 'HTTP responses by status.', responses)
+                + format_family('http_requests_in_flight', 'gauge', 'HTTP requests being served.',
+                                [('', {}, self.in_flight)]))
+
+
+class MetricsMiddleware():
+    """ASGI middleware recording every HTTP request in a RequestMetrics."""
+    def __init__(self, app, metrics: RequestMetrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        self.metrics.in_flight += 1
+        begin_time = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            self.metrics.in_flight -= 1
+            # The router stores the matched route in the scope
+            route = getattr(scope.get('route'), 'path', None) or getattr(scope.get('endpoint'), '__name__', 'unmatched')
+            self.metrics.observe(scope['method'], route, status, time.perf_counter() - begin_time)
+
+
+class PipelineRunMetrics():
+    """Durations of the stages of the last pipeline run, read from the newest profiling report of main.py.
+
+    The report is parsed again only when a newer one is written.
+    """
+    def __init__(self, report_dir: str, report_name: str = 'profile'):
+        self.pattern = os.path.join(report_dir, f'{report_name}-*.json')
+        self._report = (None, None, [])  # (path, modification time, lines)
+
+    def collect(self) -> list:
+        """Lines of the pipeline metrics, none if no report was written yet."""
+        reports = glob.glob(self.pattern)
+        if not reports:
+            return []
+        path = max(reports)  # Report names end with a sortable timestamp
+        try:
+            mtime = os.path.getmtime(path)
+            if (path, mtime) != self._report[:2]:
+                with open(path) as file:
+                    report = json.load(file)
+                self._report = (path, mtime, self._format(report))
+        except (OSError, ValueError) as e:
+            logging.warning(f"Can't read the profiling report {path}: {e}")
+        return self._report[2]
+
+    @staticmethod
+    def _format(report: dict) -> list:
+        stages = [step for step in report['steps'] if step.get('parent') is None]
+        durations = [('', {'stage': step['step'], 'status': step.get('status')}, step.get('wall_seconds'))
+                     for step in stages]
+        finished_at = datetime.fromisoformat(report['created_at']).timestamp()
+        return (format_family('pipeline_stage_duration_seconds', 'gauge',
+                              'Wall time of each stage of the last pipeline run.', durations)
+                + format_family('pipeline_last_run_timestamp_seconds', 'gauge',
+                                'End time of the last pipeline run (Unix time).', [('', {}, finished_at)]))
@@ -4,10 +4,15 @@ from sklearn.linear_model import LogisticRegression
 from sklearn.metrics import accuracy_score
 from sklearn.model_selection import train_test_split
 import joblib
+import os
+from ..features.transformations import FittedTransformer
+from .numpy_scorer import export_scorer
 from .. import PARAMS
+from ..profiling import profiler
 import logging
 
 class LogisticRegressionTrainer:
+    @profiler.profiled()
     def __init__(self):
         # Get paths
         self.processed_data_path = PARAMS.data_path.processed.root_dir
@@ -16,11 +21,12 @@ class LogisticRegressionTrainer:
         X_val_data_path = self.processed_data_path + PARAMS.data_path.processed.X_val
         y_val_data_path = self.processed_data_path + PARAMS.data_path.processed.y_val
 
-        # Read data
-        self.X_train = read_data(X_train_data_path)
-        self.y_train = read_data(y_train_data_path)
-        self.X_val = read_data(X_val_data_path)
-        self.y_val = read_data(y_val_data_path)
+        # Read data, from the Parquet cache when the CSV files did not change
+        cache_dir = PARAMS.cache.root_dir if PARAMS.cache.enabled else None
+        self.X_train = read_data(X_train_data_path, cache_dir=cache_dir)
+        self.y_train = read_data(y_train_data_path, cache_dir=cache_dir)
+        self.X_val = read_data(X_val_data_path, cache_dir=cache_dir)
+        self.y_val = read_data(y_val_data_path, cache_dir=cache_dir)
 
         # Get target
         self.y_train = self.y_train['winner_is_p1'].values
@@ -32,6 +38,7 @@ class LogisticRegressionTrainer:
         self.model_params = PARAMS.logistic_regression
         self.model_path = PARAMS.logistic_regression.model_path
 
+    @profiler.profiled()
     def create_model(self):
 
         logging.info(f'Creating model with params:\n' + '\n'.join([f'{key}: {value}' for key, value in self.model_params.items()]))
@@ -52,9 +59,11 @@ class LogisticRegressionTrainer:
                                     l1_ratio = self.model_params.l1_ratio
         )
     
+    @profiler.profiled(rows_in=lambda self, model: len(self.X_train))
     def train_model(self, model):
         return model.fit(self.X_train, self.y_train)
     
+    @profiler.profiled(rows_in=lambda self, trained_model: len(self.X_train) + len(self.X_val))
     def evaluate(self, trained_model):
         """
         Evaluate the model and return accuracy.
@@ -69,8 +78,19 @@ class LogisticRegressionTrainer:
         logging.info(f"Validation accuracy: {val_accuracy}")
 
 
+    @profiler.profiled()
     def save_model(self, trained_model):
         """
-        Save the trained model to disk.
+        Save the trained model to disk, with the transformations fitted on its training features, and export it
+        as a NumPy scorer for serving.
+
+        The model is written to a temporary file first and then renamed, so a serving process reloading the
+        model never reads a partially written file.
         """
-        joblib.dump(trained_model, self.model_path)
\ No newline at end of file
+        trained_model.transformations_ = FittedTransformer.load(self.model_params.transformations_path).to_dict()
+
+        tmp_path = f'{self.model_path}.tmp'
+        joblib.dump(trained_model, tmp_path)
+        os.replace(tmp_path, self.model_path)
+
+        export_scorer(trained_model, self.model_params.scorer_path, trained_model.transformations_)
@@ -0,0 +1,140 @@
+# Usage: python -m pipeline.models.numpy_scorer
+import argparse
+import glob
+import hashlib
+import json
+import logging
+import os
+import numpy as np
+import pandas as pd
+
+# Version of the exported file layout, increased whenever the layout changes
+FORMAT_VERSION = 1
+
+
+def export_scorer(trained_model, path: str, transformations: dict = None) -> str:
+    """Export a fitted binary LogisticRegression to the files loaded by NumpyScorer.
+
+    The metadata (feature order, intercept, classes and fitted transformations) is written to path as JSON and the
+    coefficients to a .npy file next to it, named after the content hash so that a scorer being loaded never
+    reads the coefficients of another version. The JSON file is replaced atomically, last.
+
+    Args:
+        trained_model: Fitted sklearn LogisticRegression with feature_names_in_.
+        path (str): Path of the JSON file.
+        transformations (dict, optional): Fitted transformations (see FittedTransformer.to_dict). Defaults to the
+            model's transformations_.
+
+    Raises:
+        ValueError: If the model isn't a binary classifier fitted on named features.
+
+    Returns:
+        str: Version of the exported scorer (content hash).
+    """
+    if len(trained_model.classes_) != 2 or not hasattr(trained_model, 'feature_names_in_'):
+        raise ValueError("Only binary models fitted on a DataFrame can be exported")
+
+    coef = np.ascontiguousarray(trained_model.coef_[0], dtype=np.float64)
+    metadata = {
+        'format_version': FORMAT_VERSION,
+        'feature_names': [str(name) for name in trained_model.feature_names_in_],
+        'intercept': float(trained_model.intercept_[0]),
+        'classes': [int(c) if isinstance(c, (int, np.integer)) else str(c) for c in trained_model.classes_],
+        # With multi_class='multinomial' sklearn applies a softmax over (-d, d), i.e. a sigmoid of 2d
+        'decision_scale': 2.0 if getattr(trained_model, 'multi_class', None) == 'multinomial' else 1.0,
+        'transformations': transformations if transformations is not None else getattr(trained_model, 'transformations_', None),
+    }
+
+    h = hashlib.blake2b(digest_size=8)
+    h.update(json.dumps(metadata, sort_keys=True).encode())
+    h.update(coef.tobytes())
+    version = h.hexdigest()
+
+    stem = os.path.splitext(path)[0]
+    coef_path = f'{stem}-{version}.npy'
+    np.save(coef_path, coef)
+    metadata.update({'version': version, 'coef_file': os.path.basename(coef_path)})
+
+    with open(f'{path}.tmp', 'w') as file:
+        json.dump(metadata, file, indent=4)
+    os.replace(f'{path}.tmp', path)
+
+    # Older coefficients can go: processes that mapped them keep reading them until they reload
+    for old_path in glob.glob(f'{stem}-*.npy'):
+        if old_path != coef_path:
+            os.remove(old_path)
+
+    logging.info(f"Exported the NumPy scorer {version} to {path}")
+    return version
+
+
+class NumpyScorer():
+    """Binary logistic regression scorer computed with NumPy only, loaded from the files written by export_scorer.
+
+    Exposes the parts of the sklearn API used for serving (feature_names_in_, transformations_, decision_function
+    and predict_proba), so that it can be served in place of the unpickled estimator. Probabilities match the
+    estimator's predict_proba to within floating point rounding.
+    """
+    def __init__(self, coef: np.ndarray, intercept: float, feature_names: list, classes: list = (0, 1),
+                 decision_scale: float = 1.0, transformations: dict = None, version: str = None):
+        self.coef_ = coef
+        self.intercept_ = intercept
+        self.feature_names_in_ = np.array(feature_names, dtype=object)
+        self.classes_ = np.array(classes)
+        self.decision_scale = decision_scale
+        self.transformations_ = transformations
+        self.version = version
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> 'NumpyScorer':
+        """Load a scorer exported with export_scorer.
+
+        Args:
+            path (str): Path of the JSON file.
+            mmap (bool, optional): Memory-map the coefficients instead of reading them. Defaults to True.
+
+        Raises:
+            ValueError: If the file was exported with another format version.
+        """
+        with open(path) as file:
+            metadata = json.load(file)
+        if metadata.get('format_version') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported scorer format version {metadata.get('format_version')} in {path}")
+
+        coef = np.load(os.path.join(os.path.dirname(path), metadata['coef_file']), mmap_mode='r' if mmap else None)
+        return cls(coef, metadata['intercept'], metadata['feature_names'], metadata['classes'],
+                   metadata['decision_scale'], metadata['transformations'], metadata['version'])
+
+    def _matrix(self, X) -> np.ndarray:
+        """Features as a float64 matrix in the feature order: a DataFrame, a {feature: values} dict or a matrix."""
+        if isinstance(X, (pd.DataFrame, dict)):
+            return np.column_stack([np.asarray(X[col], dtype=np.float64) for col in self.feature_names_in_])
+        return np.asarray(X, dtype=np.float64).reshape(-1, len(self.coef_))
+
+    def decision_function(self, X) -> np.ndarray:
+        return self._matrix(X) @ self.coef_ + self.intercept_
+
+    def predict_proba(self, X) -> np.ndarray:
+        """Probabilities of both classes, as LogisticRegression.predict_proba."""
+        probability = 1.0 / (1.0 + np.exp(-self.decision_scale * self.decision_function(X)))
+        return np.column_stack([1 - probability, probability])
+
+    def predict(self, X) -> np.ndarray:
+        return self.classes_[(self.decision_function(X) > 0).astype(int)]
+
+
+if __name__ == "__main__": # Won't be executed when module is imported
+    import joblib
+    from .. import PARAMS
+    from ..features.transformations import FittedTransformer
+
+    parser = argparse.ArgumentParser(description="Export the trained model to a NumPy scorer")
+    parser.add_argument('--model_path', default=PARAMS.logistic_regression.model_path, help='joblib model to export.')
+    parser.add_argument('--scorer_path', default=PARAMS.logistic_regression.scorer_path, help='JSON file to write.')
+    args = parser.parse_args()
+
+    model = joblib.load(args.model_path)
+    transformations = getattr(model, 'transformations_', None)
+    if transformations is None:
+        transformations = FittedTransformer.load(PARAMS.logistic_regression.transformations_path).to_dict()
+    export_scorer(model, args.scorer_path, transformations)
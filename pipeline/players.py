@@ -0,0 +1,85 @@
+import json
+import logging
+import os
+import numpy as np
+import pandas as pd
+
+
+class PlayerDictionary():
+    """Persistent mapping of player names to dense int32 ids, shared by the cleaning, the features and the serving.
+
+    Ids are assigned in order of first appearance and never change: the dictionary is only extended, so ids saved
+    in the cleaned data stay valid when new matches bring new players. Dense ids let the players' state live in
+    arrays indexed by id instead of dicts keyed by names.
+    """
+    def __init__(self, names: list = None):
+        self.names = list(names or [])
+        self.ids = {name: i for i, name in enumerate(self.names)}
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def get(self, name: str) -> int:
+        """Return the id of a player, -1 if unknown."""
+        return self.ids.get(name, -1)
+
+    def add(self, name: str) -> int:
+        """Return the id of a player, registering the player if unknown."""
+        player_id = self.ids.get(name)
+        if player_id is None:
+            player_id = len(self.names)
+            self.ids[name] = player_id
+            self.names.append(name)
+        return player_id
+
+    def encode(self, names) -> np.ndarray:
+        """Map player names to ids, registering unknown players. Each distinct name is looked up once.
+
+        Args:
+            names (array-like): Player names.
+
+        Raises:
+            ValueError: If a name is missing.
+
+        Returns:
+            np.ndarray: Player ids (int32).
+        """
+        codes, uniques = pd.factorize(self._values(names))
+        if (codes < 0).any():
+            raise ValueError("Missing player names can't be encoded")
+        ids = np.fromiter((self.add(name) for name in uniques), dtype=np.int32, count=len(uniques))
+        return ids[codes]
+
+    def lookup(self, names) -> np.ndarray:
+        """Map player names to ids without registering unknown players.
+
+        Args:
+            names (array-like): Player names.
+
+        Returns:
+            np.ndarray: Player ids (int32), -1 for unknown or missing names.
+        """
+        codes, uniques = pd.factorize(self._values(names))
+        ids = np.fromiter((self.get(name) for name in uniques), dtype=np.int32, count=len(uniques))
+        return np.where(codes >= 0, ids[codes], -1).astype(np.int32)
+
+    @staticmethod
+    def _values(names):
+        if isinstance(names, (pd.Series, pd.Index, np.ndarray)):
+            return names
+        return np.asarray(names, dtype=object)
+
+    def save(self, path: str):
+        """Save the names as JSON, in id order, replacing the file atomically."""
+        with open(f'{path}.tmp', 'w') as file:
+            json.dump(self.names, file)
+        os.replace(f'{path}.tmp', path)
+        logging.info(f"Saved the dictionary of {len(self)} players to {path}")
+
+    @classmethod
+    def load(cls, path: str) -> 'PlayerDictionary':
+        """Load a dictionary saved with save(), or start an empty one if the file does not exist yet."""
+        if not os.path.isfile(path):
+            return cls()
+        with open(path) as file:
+            return cls(json.load(file))
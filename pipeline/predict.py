@@ -1,73 +1,447 @@
 import argparse
 import joblib
 import logging
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from functools import lru_cache
+from libs.data_utils import file_hash
 from . import PARAMS
+from .features.player_state import PlayerStateEngine
+from .features.transformations import FittedTransformer, Transformations
+from .models.numpy_scorer import NumpyScorer
 
-# Define the predict function
-def predict(rank_p1, rank_p2, odd_p1, odd_p2, surface, h2h, consecutive_wins_p1, consecutive_wins_p2, 
-            consecutive_losses_p1, consecutive_losses_p2, rank_evol_p1, rank_evol_p2):
-    # Load the model
-    model_path = PARAMS.logistic_regression.model_path
-    model = joblib.load(model_path)
-
-    # Get features
-    features = [
-        rank_p1,
-        rank_p2,
-        odd_p1,
-        odd_p2,
-        surface,
-        h2h,
-        consecutive_wins_p1,
-        consecutive_wins_p2,
-        consecutive_losses_p1,
-        consecutive_losses_p2,
-        rank_evol_p1,
-        rank_evol_p2
-    ]
-
-    # Predict and return the result
-    if model.predict([features]) == 1:
-        return "Bet on player 1"
+
+class ModelHolder():
+    """Keep a model in memory and swap in the new version when its file changes.
+
+    The file is checked at most every check_interval seconds, by the first get() after the interval: that caller
+    loads the new version, while other threads keep getting the current model until it is fully loaded, and the swap
+    is a single attribute assignment. If the file is missing or cannot be loaded, the current model keeps being
+    served. The players' state is held the same way (see player_state_holder), so that it follows a new run of the
+    pipeline as the model does.
+
+    Once watch() is called, the file is checked and loaded by a background thread instead, and get() only returns
+    the current model: the API calls it from its event loop, which a load would stall.
+
+    Args:
+        model_path (str): Path of the model file.
+        check_interval (float, optional): Seconds between two checks of the file. Defaults to 1.0.
+        loader (callable, optional): Function loading the model from its path. Defaults to joblib.load.
+    """
+    def __init__(self, model_path: str, check_interval: float = 1.0, loader=joblib.load):
+        self.model_path = model_path
+        self.check_interval = check_interval
+        self.loader = loader
+        self.load_seconds = None
+        self._current = (None, None, None)  # (model, file signature, version)
+        self._last_check = float('-inf')
+        self._lock = threading.Lock()
+        self._watcher = None
+
+    @property
+    def version(self) -> str:
+        """Content hash of the model file being served."""
+        return self._current[2]
+
+    def get(self):
+        """Return the current model, loading it first if its file changed (unless watched)."""
+        now = time.monotonic()
+        if self._current[0] is None or (self._watcher is None and now - self._last_check >= self.check_interval):
+            self._last_check = now
+            self.reload()
+        return self._current[0]
+
+    def watch(self):
+        """Check the file every check_interval seconds from a daemon thread, loading its new versions.
+
+        Threads don't survive a fork: serving workers call it once forked.
+        """
+        if self._watcher is None or not self._watcher.is_alive():
+            self._watcher = threading.Thread(target=self._watch, name=f'watch-{os.path.basename(self.model_path)}',
+                                             daemon=True)
+            self._watcher.start()
+
+    def _watch(self):
+        while True:
+            time.sleep(self.check_interval)
+            try:
+                self.reload()
+            except Exception as e:
+                logging.error(f"Error checking {self.model_path}: {e}")
+
+    def reload(self, force: bool = False):
+        """Load the model file if it changed since the last load.
+
+        Args:
+            force (bool, optional): Load the file even if it did not change. Defaults to False.
+
+        Raises:
+            Exception: Raised if the file can't be read or loaded and no model was loaded yet. Otherwise the error is
+                logged and the current model kept, e.g. while the file is missing or being replaced.
+        """
+        try:
+            stat = os.stat(self.model_path)
+            signature = (stat.st_mtime_ns, stat.st_size)
+            if not force and signature == self._current[1]:
+                return
+
+            with self._lock:
+                if not force and signature == self._current[1]:
+                    return
+                begin_time = time.perf_counter()
+                model = self.loader(self.model_path)
+                version = file_hash(self.model_path)
+                self.load_seconds = time.perf_counter() - begin_time
+                self._current = (model, signature, version)
+        except Exception as e:
+            if self._current[0] is None:
+                raise
+            logging.error(f"Error loading {self.model_path}, keeping version {self.version}: {e}")
+            return
+        logging.info(f"Loaded {self.model_path} (version {version}) in {self.load_seconds:.3f}s")
+
+
+def serving_model_holder(check_interval: float = PARAMS.serving.model_reload_interval) -> ModelHolder:
+    """Hold the NumPy scorer exported with the model if enabled and available, the sklearn model otherwise."""
+    scorer_path = PARAMS.logistic_regression.scorer_path
+    if PARAMS.serving.numpy_scorer and os.path.isfile(scorer_path):
+        return ModelHolder(scorer_path, check_interval, loader=NumpyScorer.load)
+    if PARAMS.serving.numpy_scorer:
+        logging.warning(f"No NumPy scorer found at {scorer_path}, serving {PARAMS.logistic_regression.model_path}")
+    return ModelHolder(PARAMS.logistic_regression.model_path, check_interval)
+
+
+model_holder = serving_model_holder()
+
+
+def read_player_state(player_state_path: str) -> PlayerStateEngine:
+    """Load the players' state saved by the feature building.
+
+    With serving.shared_state_dir set, the state is served read-only from memory-mapped arrays, shared by every
+    process serving them. They are written once per version of the saved state, into a directory named after its
+    content hash, so that a new state never overwrites arrays that other processes still map.
+    """
+    shared_state_dir = PARAMS.serving.shared_state_dir
+    if not shared_state_dir:
+        logging.info(f"Loading players' state from {player_state_path}")
+        return PlayerStateEngine.load(player_state_path)
+
+    mapped_dir = os.path.join(shared_state_dir, file_hash(player_state_path))
+    if not os.path.isdir(mapped_dir):
+        logging.info(f"Writing players' state from {player_state_path} to {mapped_dir}")
+        tmp_dir = f'{mapped_dir}.tmp{os.getpid()}'
+        PlayerStateEngine.load(player_state_path).save_mapped(tmp_dir)
+        try:
+            os.rename(tmp_dir, mapped_dir)
+        except OSError:
+            # Written by another process in the meantime
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        # Remove the previous versions: the processes still serving one keep their mapping of its files
+        for entry in os.listdir(shared_state_dir):
+            path = os.path.join(shared_state_dir, entry)
+            if path != mapped_dir and '.tmp' not in entry:
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    os.remove(path)
+    logging.info(f"Mapping players' state from {mapped_dir}")
+    return PlayerStateEngine.load_mapped(mapped_dir)
+
+
+player_state_holder = ModelHolder(PARAMS.data_path.processed.root_dir + PARAMS.data_path.processed.player_state,
+                                  PARAMS.serving.model_reload_interval, loader=read_player_state)
+
+
+def load_player_state() -> PlayerStateEngine:
+    """Return the players' state being served, loading it first if its file changed."""
+    return player_state_holder.get()
+
+
+@lru_cache(maxsize=2)
+def load_transformations(model=None) -> FittedTransformer:
+    """Load the transformations fitted with a model, once per model.
+
+    Models saved by LogisticRegressionTrainer carry their shifts and bin boundaries, so a reloaded model always comes
+    with its own transformations. Older models fall back to the transformations saved by the feature building.
+    """
+    if getattr(model, 'transformations_', None) is not None:
+        return FittedTransformer(**model.transformations_)
+    return FittedTransformer.load(PARAMS.logistic_regression.transformations_path)
+
+
+def match_features(player_1: str, player_2: str, surface: str, odd_1: float, odd_2: float, model=None) -> dict:
+    """Build the model features of an upcoming match from the players' names.
+
+    As in training, P1 is the player with the lowest odd (or the best ranking if both odds are equal).
+
+    Args:
+        player_1 (str): Name of the first player.
+        player_2 (str): Name of the second player.
+        surface (str): Surface of the match.
+        odd_1 (float): Odd of the first player.
+        odd_2 (float): Odd of the second player.
+        model (optional): Model whose transformations are applied. Defaults to the model served by model_holder.
+
+    Raises:
+        KeyError: If one of the players has no history.
+
+    Returns:
+        dict: {feature: value} with every feature of the model, plus 'player_1_is_p1'.
+    """
+    # Names are resolved to ids once, the rest of the request works on ids
+    player_state = load_player_state()
+    id_1, id_2 = player_state.players.get(player_1), player_state.players.get(player_2)
+    for name, player_id in ((player_1, id_1), (player_2, id_2)):
+        if not player_state.known(player_id):
+            raise KeyError(f"Unknown player: {name}")
+    rank_1 = player_state.rank(id_1)
+    rank_2 = player_state.rank(id_2)
+
+    player_1_is_p1 = odd_1 < odd_2 or (odd_1 == odd_2 and rank_1 < rank_2)
+    if player_1_is_p1:
+        p1, p2, rank_p1, rank_p2, odd_p1, odd_p2 = id_1, id_2, rank_1, rank_2, odd_1, odd_2
     else:
-        return "Bet on player 2"
+        p1, p2, rank_p1, rank_p2, odd_p1, odd_p2 = id_2, id_1, rank_2, rank_1, odd_2, odd_1
+
+    match = player_state.match_features(p1, p2)
+    match.update({'rank_p1': rank_p1, 'rank_p2': rank_p2, 'odd_p1': odd_p1, 'odd_p2': odd_p2, 'surface': surface})
+
+    model = model if model is not None else model_holder.get()
+    features = Transformations.transform_match(match, load_transformations(model))
+    features['player_1_is_p1'] = player_1_is_p1
+    return features
+
+
+def predict_match(player_1: str, player_2: str, surface: str, odd_1: float, odd_2: float) -> dict:
+    """Predict the winning probabilities of an upcoming match from the players' names.
+
+    Args:
+        player_1 (str): Name of the first player.
+        player_2 (str): Name of the second player.
+        surface (str): Surface of the match.
+        odd_1 (float): Odd of the first player.
+        odd_2 (float): Odd of the second player.
+
+    Raises:
+        KeyError: If one of the players has no history.
+
+    Returns:
+        dict: Winning probability of each player and the recommended bet.
+    """
+    model = model_holder.get()
+    features = match_features(player_1, player_2, surface, odd_1, odd_2, model)
+
+    if isinstance(model, NumpyScorer):
+        X = np.array([[features[col] for col in model.feature_names_in_]], dtype=np.float64)
+    else:
+        X = pd.DataFrame([[features[col] for col in model.feature_names_in_]], columns=model.feature_names_in_)
+    probability_p1 = float(model.predict_proba(X)[0, 1])
+
+    probability_1 = probability_p1 if features['player_1_is_p1'] else 1 - probability_p1
+    return match_prediction(player_1, player_2, probability_1)
+
+
+def match_prediction(player_1: str, player_2: str, probability_1: float) -> dict:
+    """Prediction of a match as returned by predict_match."""
+    return {
+        'player_1': player_1,
+        'player_2': player_2,
+        'probability_player_1': probability_1,
+        'probability_player_2': 1 - probability_1,
+        'recommendation': f"Bet on {player_1 if probability_1 >= 0.5 else player_2}",
+    }
+
+
+def predict_matches(player_1: list, player_2: list, surface: list, odd_1: list, odd_2: list) -> list:
+    """Predict matches one by one as predict_match, but with a single predict_batch call.
+
+    Used to score together the single match requests received at the same time (see RequestBatcher).
+
+    Args:
+        player_1 (list): Names of the first players.
+        player_2 (list): Names of the second players.
+        surface (list): Surfaces of the matches.
+        odd_1 (list): Odds of the first players.
+        odd_2 (list): Odds of the second players.
+
+    Returns:
+        list: For each match, the result of predict_match or the KeyError it raises if one of the players has no history.
+    """
+    probabilities = predict_batch(player_1, player_2, surface, odd_1, odd_2)['probability_player_1']
+    player_state = load_player_state()
+
+    results = []
+    for name_1, name_2, probability_1 in zip(player_1, player_2, probabilities.tolist()):
+        if np.isnan(probability_1):
+            unknown = [name for name in (name_1, name_2) if not player_state.known(player_state.players.get(name))]
+            results.append(KeyError(f"Unknown player: {unknown[0]}") if unknown else
+                           ValueError(f"No prediction for {name_1} vs {name_2}"))
+        else:
+            results.append(match_prediction(name_1, name_2, probability_1))
+    return results
+
+
+def match_features_batch(player_1: list, player_2: list, surface: list, odd_1: list, odd_2: list, model=None) -> dict:
+    """Build the model features of a batch of upcoming matches from the players' names.
+
+    Vectorized version of match_features().
+
+    Args:
+        player_1 (list): Names of the first players.
+        player_2 (list): Names of the second players.
+        surface (list): Surfaces of the matches.
+        odd_1 (list): Odds of the first players.
+        odd_2 (list): Odds of the second players.
+        model (optional): Model whose transformations are applied. Defaults to the model served by model_holder.
+
+    Returns:
+        dict: {feature: np.ndarray} with every feature of the model, plus 'player_1_is_p1' and 'known', False for
+            the matches where one of the players has no history.
+    """
+    odd_1 = np.asarray(odd_1, dtype=np.float64)
+    odd_2 = np.asarray(odd_2, dtype=np.float64)
+
+    # Features with player_1 as P1, then swapped where player_2 is P1
+    player_state = load_player_state()
+    matches = player_state.match_features_batch(player_state.players.lookup(player_1), player_state.players.lookup(player_2))
+    player_1_is_p1 = (odd_1 < odd_2) | ((odd_1 == odd_2) & (matches['rank_p1'] < matches['rank_p2']))
+    for col in ['consecutive_wins', 'consecutive_losses', 'rank_evol', 'record', 'rank']:
+        matches[f'{col}_p1'], matches[f'{col}_p2'] = (np.where(player_1_is_p1, matches[f'{col}_p1'], matches[f'{col}_p2']),
+                                                      np.where(player_1_is_p1, matches[f'{col}_p2'], matches[f'{col}_p1']))
+    matches['h2h'] = np.where(player_1_is_p1, matches['h2h'], -matches['h2h'])
+    matches['odd_p1'] = np.where(player_1_is_p1, odd_1, odd_2)
+    matches['odd_p2'] = np.where(player_1_is_p1, odd_2, odd_1)
+    matches['surface'] = np.asarray(surface)
+
+    # Unknown players get a placeholder ranking so that the transformations stay finite
+    known = matches.pop('known')
+    matches['rank_p1'] = np.where(known, matches['rank_p1'], 1)
+    matches['rank_p2'] = np.where(known, matches['rank_p2'], 1)
+
+    model = model if model is not None else model_holder.get()
+    features = Transformations.transform_matches(matches, load_transformations(model))
+    features['player_1_is_p1'] = player_1_is_p1
+    features['known'] = known
+    return features
+
+
+def predict_batch(player_1: list, player_2: list, surface: list, odd_1: list, odd_2: list, model=None) -> dict:
+    """Predict the winning probabilities of a batch of upcoming matches with a single predict_proba call.
+
+    Args:
+        player_1 (list): Names of the first players.
+        player_2 (list): Names of the second players.
+        surface (list): Surfaces of the matches.
+        odd_1 (list): Odds of the first players.
+        odd_2 (list): Odds of the second players.
+        model (optional): Model to predict with. Defaults to the model served by model_holder.
+
+    Returns:
+        dict: 'probability_player_1' and 'probability_player_2' arrays, NaN where one of the players has no history.
+    """
+    model = model if model is not None else model_holder.get()
+    features = match_features_batch(player_1, player_2, surface, odd_1, odd_2, model)
+    known = features['known']
+
+    X = {col: features[col][known] for col in model.feature_names_in_}
+    if not isinstance(model, NumpyScorer):
+        X = pd.DataFrame(X)
+    probability_p1 = np.full(len(known), np.nan)
+    if known.any():
+        probability_p1[known] = model.predict_proba(X)[:, 1]
+
+    probability_1 = np.where(features['player_1_is_p1'], probability_p1, 1 - probability_p1)
+    return {
+        'probability_player_1': probability_1,
+        'probability_player_2': 1 - probability_1,
+    }
+
+
+FIXTURES_COLUMNS = ['player_1', 'player_2', 'surface', 'odd_1', 'odd_2']
+
+
+def predict_file(fixtures_path: str, output_path: str, chunk_size: int = 100000) -> int:
+    """Score a CSV file of fixtures chunk by chunk, with bounded memory.
+
+    Each chunk is scored with predict_batch and appended to the output file before the next one is read. The model
+    and the fitted transformations are loaded once and reused for every chunk.
+
+    Args:
+        fixtures_path (str): CSV file with player_1, player_2, surface, odd_1 and odd_2 columns.
+        output_path (str): CSV file to write, with the fixtures' columns and both players' winning probabilities.
+        chunk_size (int, optional): Number of fixtures per chunk. Defaults to 100000.
+
+    Returns:
+        int: Number of fixtures scored.
+    """
+    begin_time = datetime.now()
+    logging.info(f"Scoring {fixtures_path} in chunks of {chunk_size} fixtures...")
+
+    model = model_holder.get()
+    n_rows = 0
+    with open(output_path, 'w', newline='') as output:
+        for chunk in pd.read_csv(fixtures_path, chunksize=chunk_size, dtype={'player_1': str, 'player_2': str, 'surface': str}):
+            missing = [col for col in FIXTURES_COLUMNS if col not in chunk.columns]
+            if missing:
+                raise ValueError(f"Missing columns in {fixtures_path}: {', '.join(missing)}")
+
+            probabilities = predict_batch(*(chunk[col].to_numpy() for col in FIXTURES_COLUMNS), model=model)
+            for col, values in probabilities.items():
+                chunk[col] = values
+
+            chunk.to_csv(output, header=n_rows == 0, index=False)
+            n_rows += len(chunk)
+            logging.info(f" -> Scored {n_rows} fixtures")
+
+    end_time = datetime.now()
+    logging.info(f" -> Saved predictions to {output_path}. ({(end_time-begin_time).total_seconds()})")
+    return n_rows
+
 
 # Command-line argument parsing and script execution
 if __name__ == "__main__":
     try:
         # Parse command-line arguments
         parser = argparse.ArgumentParser(description="Tennis Match Prediction")
-        parser.add_argument('--rank_p1', type=int, required=True, help='Player 1 rank')
-        parser.add_argument('--rank_p2', type=int, required=True, help='Player 2 rank')
-        parser.add_argument('--odd_p1', type=float, required=True, help='Player 1 odds')
-        parser.add_argument('--odd_p2', type=float, required=True, help='Player 2 odds')
-        parser.add_argument('--surface', type=int, required=True, choices=[0, 1, 2], 
-                            help='Surface type: 0 for Hard, 1 for Clay, 2 for Grass')
-        parser.add_argument('--h2h', type=int, required=True, help='Head-to-Head wins for player 1')
-        parser.add_argument('--consecutive_wins_p1', type=int, required=True, help='Consecutive wins for player 1')
-        parser.add_argument('--consecutive_wins_p2', type=int, required=True, help='Consecutive wins for player 2')
-        parser.add_argument('--consecutive_losses_p1', type=int, required=True, help='Consecutive losses for player 1')
-        parser.add_argument('--consecutive_losses_p2', type=int, required=True, help='Consecutive losses for player 2')
-        parser.add_argument('--rank_evol_p1', type=int, required=True, help='Rank evolution for player 1')
-        parser.add_argument('--rank_evol_p2', type=int, required=True, help='Rank evolution for player 2')
+        parser.add_argument('--fixtures', help='CSV file of fixtures to score in bulk (player_1, player_2, surface, odd_1, odd_2)')
+        parser.add_argument('--output', help='CSV file where the bulk predictions are written')
+        parser.add_argument('--chunk_size', type=int, default=100000, help='Number of fixtures scored at a time in bulk mode')
+        parser.add_argument('--player_1', help='Name of the first player, as in the raw data (e.g. "Federer R.")')
+        parser.add_argument('--player_2', help='Name of the second player')
+        parser.add_argument('--surface', choices=['Hard', 'Clay', 'Grass', 'Carpet', 'Greenset'], help='Surface of the match')
+        parser.add_argument('--odd_1', type=float, help='Odd of the first player')
+        parser.add_argument('--odd_2', type=float, help='Odd of the second player')
         
         args = parser.parse_args()
 
-        # Call the predict function with the parsed arguments
-        result = predict(
-            args.rank_p1, args.rank_p2, args.odd_p1, args.odd_p2,
-            args.surface, args.h2h, args.consecutive_wins_p1, args.consecutive_wins_p2,
-            args.consecutive_losses_p1, args.consecutive_losses_p2,
-            args.rank_evol_p1, args.rank_evol_p2
-        )
+        if args.fixtures:
+            # Score a whole file of fixtures
+            if not args.output:
+                parser.error("--output is required with --fixtures")
+            predict_file(args.fixtures, args.output, args.chunk_size)
+
+        else:
+            missing = [flag for flag in FIXTURES_COLUMNS if getattr(args, flag) is None]
+            if missing:
+                parser.error(f"the following arguments are required: {', '.join('--' + flag for flag in missing)}")
+
+            # Predict the match from the players' history
+            result = predict_match(args.player_1, args.player_2, args.surface, args.odd_1, args.odd_2)
 
-        # Print the result of the prediction
-        print(result)
+            # Print the result of the prediction
+            print(result)
 
     except SystemExit as e:
         logging.error(
             f"An error occurred while parsing arguments or executing the script: {e}. "
-            f"Usage: python script.py --rank_p1 <value> --rank_p2 <value> ...",
+            f"Usage: python -m pipeline.predict --player_1 <name> --player_2 <name> --surface <surface> "
+            f"--odd_1 <value> --odd_2 <value>",
             exc_info=True
         )
     except Exception as e:
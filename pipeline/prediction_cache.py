@@ -0,0 +1,73 @@
+import collections
+import threading
+import time
+
+
+class PredictionCache():
+    """Bounded cache of predictions with LRU eviction, a time to live and invalidation on model change.
+
+    Keys are the request (e.g. players, surface and odds) and entries are tagged with the version of what computed
+    them (e.g. the versions of the model and of the players' state): the first get or put with another version
+    empties the cache. The lock is only held inside
+    get and put, never while a prediction is computed.
+
+    Args:
+        max_size (int, optional): Largest number of entries, the least recently used are evicted. Defaults to 100000.
+        ttl (float, optional): Seconds an entry stays valid. Defaults to 30.
+        clock (callable, optional): Function returning the current time in seconds. Defaults to time.monotonic.
+    """
+    def __init__(self, max_size: int = 100_000, ttl: float = 30.0, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()  # key: (expiry time, value)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def get(self, key, version=None):
+        """Return the cached value of key, None if missing, expired or computed by another version."""
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= self.clock():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value, version=None):
+        """Cache the value of key, computed by the given version."""
+        with self._lock:
+            self._check_version(version)
+            self._entries[key] = (self.clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _check_version(self, version):
+        if version != self.version:
+            self._entries.clear()
+            self.version = version
+
+    def stats(self) -> dict:
+        return {'size': len(self), 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses,
+                'hit_ratio': self.hit_ratio, 'evictions': self.evictions, 'version': self.version}
@@ -0,0 +1,155 @@
+import functools
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+import pandas as pd
+from . import PARAMS
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of the process so far, in MB (None where it can't be measured)."""
+    if resource is None:
+        return None
+    # ru_maxrss is in bytes on macOS, in KiB on Linux
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / 2**20 if sys.platform == 'darwin' else max_rss / 1024
+
+
+def count_rows(value) -> int:
+    """Number of rows of a DataFrame, or of the DataFrame returned first in a (df, features) tuple."""
+    if isinstance(value, tuple) and value:
+        value = value[0]
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+    return None
+
+
+class Profiler():
+    """Record the wall time, CPU time, memory peaks and rows in and out of the pipeline steps.
+
+    Steps are recorded with the step() context manager or the profiled() decorator and can be nested: each record
+    keeps the name of its parent step. tracemalloc is only enabled on demand, as it slows down allocations.
+    """
+    def __init__(self, enabled: bool = True, trace_memory: bool = False, report_dir: str = 'logs/'):
+        self.enabled = enabled
+        self.trace_memory = trace_memory
+        self.report_dir = report_dir
+        self.records = []
+        self._stack = []
+
+    def reset(self):
+        """Forget the steps recorded so far."""
+        self.records = []
+        self._stack = []
+
+    @contextmanager
+    def step(self, name: str, rows_in: int = None):
+        """Record a step. The yielded record can be updated, e.g. with record['rows_out'] = len(df).
+
+        Args:
+            name (str): Name of the step.
+            rows_in (int, optional): Number of rows the step receives.
+        """
+        if not self.enabled:
+            yield {}
+            return
+
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+
+        record = {
+            'step': name,
+            'parent': self._stack[-1]['step'] if self._stack else None,
+            'started_at': datetime.now().isoformat(),
+            'status': 'completed',
+            'rows_in': rows_in,
+            'rows_out': None,
+            'children_tracemalloc_peak': 0,
+        }
+        self._stack.append(record)
+        self.records.append(record)
+        begin_wall, begin_cpu = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        except BaseException:
+            record['status'] = 'failed'
+            raise
+        finally:
+            record['wall_seconds'] = time.perf_counter() - begin_wall
+            record['cpu_seconds'] = time.process_time() - begin_cpu
+            record['peak_rss_mb'] = peak_rss_mb()
+
+            # reset_peak() in nested steps hides their peak from this step, so it is carried up from the children
+            tracemalloc_peak = None
+            if tracemalloc.is_tracing():
+                tracemalloc_peak = max(tracemalloc.get_traced_memory()[1], record['children_tracemalloc_peak'])
+            record['tracemalloc_peak_mb'] = tracemalloc_peak / 2**20 if tracemalloc_peak is not None else None
+            del record['children_tracemalloc_peak']
+
+            self._stack.pop()
+            if self._stack and tracemalloc_peak is not None:
+                parent = self._stack[-1]
+                parent['children_tracemalloc_peak'] = max(parent['children_tracemalloc_peak'], tracemalloc_peak)
+
+            logging.debug(f"Profiled {name}: {record['wall_seconds']:.3f}s wall, {record['cpu_seconds']:.3f}s CPU")
+
+    def profiled(self, name: str = None, rows_in=None):
+        """Decorator recording every call of a function as a step.
+
+        The rows in are counted on the first DataFrame argument, the rows out on the returned DataFrame or
+        (df, features) tuple.
+
+        Args:
+            name (str, optional): Name of the step. Defaults to the qualified name of the function.
+            rows_in (callable, optional): Called with the arguments of the function to count the rows in, for
+                functions that don't receive a DataFrame (e.g. methods working on self).
+        """
+        def decorator(function):
+            step_name = name or function.__qualname__
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+
+                if rows_in is not None:
+                    rows = rows_in(*args, **kwargs)
+                else:
+                    rows = next((count_rows(arg) for arg in [*args, *kwargs.values()] if count_rows(arg) is not None), None)
+                with self.step(step_name, rows) as record:
+                    result = function(*args, **kwargs)
+                    record['rows_out'] = count_rows(result)
+                return result
+            return wrapper
+        return decorator
+
+    def write_report(self, name: str = 'profile') -> str:
+        """Write the recorded steps to a JSON report in report_dir.
+
+        Returns:
+            str: Path of the report, or None if nothing was recorded.
+        """
+        if not self.enabled or not self.records:
+            return None
+
+        os.makedirs(self.report_dir, exist_ok=True)
+        report_path = os.path.join(self.report_dir, f"{name}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json")
+        with open(report_path, 'w') as file:
+            json.dump({'created_at': datetime.now().isoformat(), 'steps': self.records}, file, indent=4)
+        logging.info(f"Profiling report saved to {report_path}")
+        return report_path
+
+
+profiler = Profiler(PARAMS.profiling.enabled, PARAMS.profiling.trace_memory, PARAMS.profiling.report_dir)
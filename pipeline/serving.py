@@ -0,0 +1,80 @@
+import gc
+import logging
+import os
+import signal
+import socket
+import uvicorn
+
+
+def serve(app, host: str, port: int, workers: int = 1, preload=None):
+    """Serve an ASGI app with uvicorn from several worker processes sharing one listening socket.
+
+    The parent process runs preload() (loading the model, the players' state...), then forks the workers: what was
+    loaded is shared copy-on-write instead of being loaded again by each worker, and memory-mapped files are shared
+    through the page cache. Objects created before the fork are moved out of the garbage collector's reach
+    (gc.freeze) so that collections in the workers don't write to, and copy, their pages. A worker that dies is
+    replaced. SIGINT and SIGTERM stop the workers gracefully.
+
+    Args:
+        app: ASGI application.
+        host (str): Address to bind.
+        port (int): Port to bind.
+        workers (int, optional): Number of worker processes. Defaults to 1, served from the current process.
+        preload (callable, optional): Function run once in the parent process before forking the workers.
+    """
+    if preload is not None:
+        preload()
+    if workers <= 1 or not hasattr(os, 'fork'):
+        if workers > 1:
+            logging.warning("Forking workers isn't supported on this platform, serving from a single process")
+        uvicorn.run(app, host=host, port=port)
+        return
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    gc.collect()
+    gc.freeze()
+
+    children = set()
+    stopping = False
+
+    def fork_worker():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            try:
+                uvicorn.Server(uvicorn.Config(app)).run(sockets=[sock])
+            except Exception:
+                logging.exception(f"Worker {os.getpid()} failed")
+                os._exit(1)
+            os._exit(0)
+        children.add(pid)
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    logging.info(f"Serving on {host}:{port} with {workers} workers")
+    for _ in range(workers):
+        fork_worker()
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+        if not stopping:
+            logging.warning(f"Worker {pid} exited with status {status}, starting a new one")
+            fork_worker()
+    sock.close()
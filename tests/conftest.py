@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The pipeline reads params.yaml relative to the repository root, as when it is run with python main.py
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(ROOT_DIR)
+sys.path.insert(0, ROOT_DIR)
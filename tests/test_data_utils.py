@@ -0,0 +1,20 @@
+import pandas as pd
+from libs import data_utils
+from pipeline import PARAMS
+
+
+def test_non_integral_rank_is_read_as_missing(tmp_path):
+    file_path = tmp_path / '2018.csv'
+    file_path.write_text('Date,Winner,Loser,WRank,LRank,B365W,B365L,Surface,Comment\n'
+                         '01/01/2018,Player A.,Player B.,12.5,40,1.5,2.5,Hard,Completed\n'
+                         '02/01/2018,Player C.,Player D.,unr,7,1.2,4.0,Clay,Completed\n'
+                         '03/01/2018,Player A.,Player C.,3,9,1.1,6.0,Grass,Completed\n')
+
+    df = data_utils.read_csv_projected(str(file_path), {**PARAMS.data_schemas.raw, 'comment': 'string'},
+                                       date_format='%d/%m/%Y', na_values=['unr'])
+
+    # One bad rank doesn't empty the file: it is missing, as an unranked player's
+    assert len(df) == 3
+    assert df['wrank'].dtype == 'Int64'
+    assert df['wrank'].isna().tolist() == [True, True, False]
+    assert df['lrank'].tolist() == [40, 7, 9]
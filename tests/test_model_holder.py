@@ -0,0 +1,48 @@
+import os
+import threading
+import time
+from pipeline.predict import ModelHolder
+
+
+def read_text(path: str) -> str:
+    with open(path) as file:
+        return file.read()
+
+
+def write_text(path, text: str, mtime_ns: int):
+    path.write_text(text)
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_watched_holder_loads_new_versions_off_get(tmp_path):
+    model_path = tmp_path / 'model.txt'
+    write_text(model_path, 'v1', 1_000_000_000)
+    holder = ModelHolder(str(model_path), check_interval=0.01, loader=read_text)
+    assert holder.get() == 'v1'
+
+    loading_threads = []
+    holder.loader = lambda path: loading_threads.append(threading.current_thread().name) or read_text(path)
+    holder.watch()
+    write_text(model_path, 'v2', 2_000_000_000)
+
+    deadline = time.monotonic() + 5
+    while holder.get() != 'v2' and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert holder.get() == 'v2'
+    # Loaded once, by the watcher thread
+    assert loading_threads == ['watch-model.txt']
+
+
+def test_holder_keeps_model_while_file_is_missing(tmp_path):
+    model_path = tmp_path / 'model.txt'
+    write_text(model_path, 'v1', 1_000_000_000)
+    holder = ModelHolder(str(model_path), check_interval=0, loader=read_text)
+    assert holder.get() == 'v1'
+    version = holder.version
+
+    # Replaced by a new run: removed, then written again
+    model_path.unlink()
+    assert holder.get() == 'v1'
+    assert holder.version == version
+    write_text(model_path, 'v2', 2_000_000_000)
+    assert holder.get() == 'v2'
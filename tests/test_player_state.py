@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+import pytest
+from pipeline.features.h2h_features import H2HFeatures
+from pipeline.features.player_state import PlayerStateEngine
+from pipeline.features.rank_features import RankFeatures
+from pipeline.features.results_features import ResultsFeatures
+
+
+@pytest.fixture
+def matches() -> pd.DataFrame:
+    """Chronologically sorted matches between a few players, with repeated pairs, matches played on the same date
+    and duplicate index labels, as the concatenated ATP and WTA matches have."""
+    rng = np.random.default_rng(0)
+    players = np.array([f'Player {letter}.' for letter in 'ABCDEFGH'])
+    n = 200
+    pairs = np.array([rng.choice(len(players), size=2, replace=False) for _ in range(n)])
+    df = pd.DataFrame({
+        'date': pd.to_datetime('2020-01-01') + pd.to_timedelta(np.sort(rng.integers(0, 60, size=n)), unit='D'),
+        'winner': players[pairs[:, 0]],
+        'loser': players[pairs[:, 1]],
+        'wrank': rng.integers(1, 300, size=n),
+        'lrank': rng.integers(1, 300, size=n),
+        'winner_is_p1': rng.integers(0, 2, size=n),
+    }, index=np.concatenate([np.arange(150), np.arange(50)]))
+    df, _ = RankFeatures.add_ranks(df, [])
+    return df
+
+
+def legacy_features(df: pd.DataFrame) -> pd.DataFrame:
+    """The history-based features as computed by the loops the engine replaces."""
+    df, _ = H2HFeatures.add_h2h(df.copy(), [])
+    df, _ = ResultsFeatures.add_consecutive_wins_and_losses(df, [])
+    df, _ = RankFeatures.add_rank_evolution(df, [])
+    df, _ = ResultsFeatures.add_records(df, [])
+    return df
+
+
+def test_engine_matches_legacy_features(matches):
+    expected = legacy_features(matches)
+
+    df, features = PlayerStateEngine.add_player_state(matches.copy(), [])
+
+    assert features == PlayerStateEngine.columns
+    pd.testing.assert_frame_equal(df[PlayerStateEngine.columns], expected[PlayerStateEngine.columns],
+                                  check_dtype=False)
+
+
+def test_engine_continues_history(matches):
+    expected = legacy_features(matches)
+
+    # Sweeping the history in two parts with the same engine gives the features of a single sweep
+    engine = PlayerStateEngine()
+    head, _ = PlayerStateEngine.add_player_state(matches.iloc[:120].copy(), [], engine)
+    tail, _ = PlayerStateEngine.add_player_state(matches.iloc[120:].copy(), [], engine)
+
+    pd.testing.assert_frame_equal(tail[PlayerStateEngine.columns].reset_index(drop=True),
+                                  expected[PlayerStateEngine.columns].iloc[120:].reset_index(drop=True),
+                                  check_dtype=False)
+
+
+def test_saved_state_matches_in_memory_state(matches, tmp_path):
+    engine = PlayerStateEngine()
+    PlayerStateEngine.add_player_state(matches.copy(), [], engine)
+    engine.save_mapped(str(tmp_path))
+    mapped = PlayerStateEngine.load_mapped(str(tmp_path))
+
+    ids = np.arange(engine.n_players)
+    ids_1, ids_2 = np.repeat(ids, len(ids)), np.tile(ids, len(ids))
+    expected, actual = engine.match_features_batch(ids_1, ids_2), mapped.match_features_batch(ids_1, ids_2)
+    for col in expected:
+        np.testing.assert_array_equal(actual[col], expected[col])
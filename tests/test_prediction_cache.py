@@ -0,0 +1,48 @@
+from pipeline.prediction_cache import PredictionCache
+
+
+class FakeClock():
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_entries_expire_after_ttl():
+    clock = FakeClock()
+    cache = PredictionCache(ttl=10, clock=clock)
+    cache.put('match', 0.6)
+
+    clock.now = 9.9
+    assert cache.get('match') == 0.6
+    clock.now = 10.0
+    assert cache.get('match') is None
+    assert len(cache) == 0
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = PredictionCache(max_size=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.get('a')  # b is now the least recently used
+    cache.put('c', 3)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert cache.evictions == 1
+
+
+def test_new_version_invalidates_entries():
+    cache = PredictionCache()
+    cache.put('a', 1, version=('model-1', 'state-1'))
+    assert cache.get('a', version=('model-1', 'state-1')) == 1
+
+    # A new players' state invalidates the predictions as a new model does
+    assert cache.get('a', version=('model-1', 'state-2')) is None
+    assert len(cache) == 0
+    cache.put('a', 2, version=('model-1', 'state-2'))
+    assert cache.get('a', version=('model-2', 'state-2')) is None
+    assert cache.stats()['version'] == ('model-2', 'state-2')
@@ -0,0 +1,86 @@
+import os
+import pandas as pd
+import pytest
+import main
+from benchmarks.synthetic_data import write_raw_data
+from pipeline import PARAMS
+from pipeline.clean_data import DataCleaner
+
+
+@pytest.fixture
+def work_dir(tmp_path, monkeypatch):
+    """Point the data preparation to tmp_path, with synthetic raw files: ATP matches over 2000 and 2001, WTA matches
+    over 2000 only, so that new ATP matches can be played after the whole history."""
+    write_raw_data(str(tmp_path / 'raw'), 6000)
+    os.remove(tmp_path / 'raw' / 'wta' / '2001.csv')
+
+    monkeypatch.setattr(PARAMS.data_path.raw, 'root_dir', str(tmp_path / 'raw') + '/')
+    monkeypatch.setattr(PARAMS.data_path.interim, 'root_dir', str(tmp_path / 'interim') + '/')
+    monkeypatch.setattr(PARAMS.data_path.processed, 'root_dir', str(tmp_path / 'processed') + '/')
+    monkeypatch.setattr(PARAMS.logistic_regression, 'transformations_path', str(tmp_path / 'transformations.json'))
+    monkeypatch.setattr(PARAMS.ingestion, 'manifest_path', str(tmp_path / 'interim' / 'manifest.json'))
+    monkeypatch.setattr(PARAMS.ingestion, 'hash_index_path', str(tmp_path / 'interim' / 'match_hashes.npy'))
+    monkeypatch.setattr(PARAMS.ingestion, 'history_path', str(tmp_path / 'interim' / 'history_features.parquet'))
+    monkeypatch.setattr(PARAMS.ingestion.chunked, 'enabled', False)
+    monkeypatch.setattr(PARAMS.ingestion.chunked, 'output_dir', str(tmp_path / 'interim' / 'cleaned') + '/')
+    monkeypatch.setattr(PARAMS.cache, 'enabled', False)
+    monkeypatch.setattr(PARAMS.profiling, 'enabled', False)
+    for directory in ['interim', 'processed']:
+        os.makedirs(tmp_path / directory)
+    return tmp_path
+
+
+def split_file(file_path) -> str:
+    """Keep the matches of the first half of a chronological raw file and return the lines of the matches played
+    after them."""
+    with open(file_path) as file:
+        lines = file.readlines()
+    split = len(lines) // 2
+    while lines[split].split(',')[0] == lines[split - 1].split(',')[0]:
+        split += 1
+    with open(file_path, 'w') as file:
+        file.writelines(lines[:split])
+    return ''.join(lines[split:])
+
+
+def features(work_dir) -> pd.DataFrame:
+    return pd.read_csv(work_dir / 'interim' / 'features.csv', index_col=0)
+
+
+def test_incremental_features_equal_full_run(work_dir):
+    main.preparing_data(force=True)
+    expected = features(work_dir)
+
+    # Same raw files, the last ATP matches being appended after a first run
+    new_lines = split_file(work_dir / 'raw' / 'atp' / '2001.csv')
+    main.preparing_data(force=True)
+    with open(work_dir / 'raw' / 'atp' / '2001.csv', 'a') as file:
+        file.write(new_lines)
+    new_features = main.preparing_data(incremental=True)
+
+    assert 0 < len(new_features) < len(expected)
+    pd.testing.assert_frame_equal(features(work_dir), expected)
+
+
+def test_chunked_features_equal_in_memory_run(work_dir, monkeypatch):
+    main.preparing_data(force=True)
+    expected = features(work_dir)
+
+    # Files of 3000 ATP or WTA matches are cleaned in several chunks, written to partitions by year
+    monkeypatch.setattr(PARAMS.ingestion.chunked, 'enabled', True)
+    monkeypatch.setattr(PARAMS.ingestion.chunked, 'memory_limit_mb', 0.1)
+    main.preparing_data(force=True)
+
+    pd.testing.assert_frame_equal(features(work_dir), expected)
+
+
+def test_new_labels_shared_with_other_tour_need_full_run(work_dir):
+    main.preparing_data(force=True)
+
+    # WTA rows are labelled from 0 as ATP rows are: new WTA matches would take labels of ATP matches
+    with open(work_dir / 'raw' / 'wta' / '2000.csv') as file:
+        last_line = file.readlines()[-1]
+    with open(work_dir / 'raw' / 'wta' / '2000.csv', 'a') as file:
+        file.write(last_line.replace('2000-', '2002-', 1))
+
+    assert DataCleaner.incremental() is None
@@ -0,0 +1,79 @@
+import pytest
+import main
+from pipeline import PARAMS
+
+
+@pytest.fixture
+def stages(tmp_path, monkeypatch):
+    """Two stages in tmp_path: 'Prepare' reads a raw file, 'Train' reads what 'Prepare' writes."""
+    for name in ['raw.csv', 'features.csv', 'model.json', 'model-0123.npy']:
+        (tmp_path / name).write_text(name)
+
+    monkeypatch.setattr(main, 'STAGES', {
+        'Prepare': {
+            'function': None,
+            'files': [str(tmp_path / '*.csv')],
+            'params': [],
+            'outputs': [str(tmp_path / 'features.csv')],
+        },
+        'Train': {
+            'function': None,
+            'files': [str(tmp_path / 'features.csv')],
+            'params': ['logistic_regression'],
+            'outputs': [str(tmp_path / 'model.json'), str(tmp_path / 'model-*.npy')],
+        },
+    })
+    monkeypatch.setattr(PARAMS.stages, 'state_path', str(tmp_path / 'stages.json'))
+    return tmp_path
+
+
+def record_runs(*stage_names):
+    for stage_name in stage_names:
+        main.save_stage_state(stage_name, main.stage_hash(stage_name))
+
+
+def decisions(force=False) -> dict:
+    return {stage_name: (run, reason) for stage_name, run, reason in main.plan(['Prepare', 'Train'], force)}
+
+
+def test_stages_that_never_ran_run(stages):
+    record_runs('Prepare')
+
+    assert decisions() == {'Prepare': (False, 'inputs unchanged'), 'Train': (True, 'never ran')}
+
+
+def test_unchanged_stages_are_skipped(stages):
+    record_runs('Prepare', 'Train')
+
+    assert decisions() == {'Prepare': (False, 'inputs unchanged'), 'Train': (False, 'inputs unchanged')}
+
+
+def test_forced_stages_run(stages):
+    record_runs('Prepare', 'Train')
+
+    assert decisions(force=True) == {'Prepare': (True, 'forced'), 'Train': (True, 'forced')}
+
+
+def test_changed_input_reruns_stage_and_downstream_stages(stages):
+    record_runs('Prepare', 'Train')
+    (stages / 'raw.csv').write_text('new matches')
+
+    plan = decisions()
+    assert plan['Prepare'] == (True, 'inputs changed')
+    assert plan['Train'][0] and plan['Train'][1].startswith('upstream artifacts will change')
+
+
+def test_changed_params_rerun_stage(stages, monkeypatch):
+    record_runs('Prepare', 'Train')
+    monkeypatch.setattr(PARAMS.logistic_regression, 'model_path', 'models/other_model.joblib')
+
+    assert decisions()['Train'] == (True, 'inputs changed')
+
+
+def test_missing_output_reruns_stage(stages):
+    record_runs('Prepare', 'Train')
+    # Outputs can be glob patterns, e.g. the coefficients file named after its content hash
+    (stages / 'model-0123.npy').unlink()
+
+    assert decisions() == {'Prepare': (False, 'inputs unchanged'),
+                           'Train': (True, f"missing outputs: ['{stages / 'model-*.npy'}']")}